@@ -1,13 +1,25 @@
 import os
 import json
+import asyncio
 from datetime import datetime
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Body, Query, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from services.loading_service import LoadingService
 from services.chunking_service import ChunkingService
-from services.embedding_service import EmbeddingService, EmbeddingConfig
+from services.embedding_service import EmbeddingService, EmbeddingConfig, get_embedding_model_registry, get_warmup_configs
+from services.embedding_cache import get_embedding_cache, get_query_embedding_cache
+from services.embedding_manifest import get_embedding_manifest
+from services.embedding_pool import shutdown_embedding_pools, embedding_pool_stats
+from services.embedding_artifact import load_embedding_artifact, artifact_files, read_artifact_header, EmbeddingJobInProgressError
 from services.vector_store_service import VectorStoreService, VectorDBConfig
+from services.milvus_connection import close_milvus_connection
 from services.search_service import SearchService
+from services.reranker import rerank_stats
+from services.search_cache import get_search_result_cache, get_collection_versions
+from services.semantic_cache import get_semantic_cache
+from services.evaluation_service import EvaluationService
+from services.benchmark_service import BenchmarkService
+from services.index_autotuner import IndexAutotuner
 from services.parsing_service import ParsingService
 import logging
 from enum import Enum
@@ -15,7 +27,7 @@ from utils.config import VectorDBProvider
 import pandas as pd
 from pathlib import Path
 from services.generation_service import GenerationService
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Optional, Union
 from pydantic import BaseModel
 
 # 设置日志
@@ -32,6 +44,19 @@ async def startup_event():
         os.makedirs(directory, exist_ok=True)
         logger.info(f"Created directory: {directory}")
 
+    # 预热常用的嵌入模型，避免首个请求承担模型加载开销
+    warmup_configs = get_warmup_configs()
+    if warmup_configs:
+        registry = get_embedding_model_registry()
+        await asyncio.to_thread(registry.warmup, warmup_configs)
+        logger.info(f"Warmed up {len(warmup_configs)} embedding models")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # 关闭嵌入进程池（等待进行中的批次完成），并断开共享的 Milvus 连接
+    await asyncio.to_thread(shutdown_embedding_pools)
+    close_milvus_connection()
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -47,6 +72,39 @@ class IndexRequest(BaseModel):
     file_id: str
     vector_db: str
     index_mode: str
+    near_dedup: bool = False
+    near_dedup_threshold: Optional[float] = None
+    near_dedup_mode: str = "skip"
+    upsert: bool = False
+    collection_name: Optional[str] = None
+
+# 批量搜索请求：queries 中每一项可以是查询文本，也可以是 {"query", "top_k", "threshold"}
+# mode 为 dense（向量检索）、sparse（BM25）或 hybrid（两路并发检索后融合）
+class BatchSearchRequest(BaseModel):
+    queries: List[Union[str, Dict[str, Any]]]
+    collection_id: str
+    provider: str
+    top_k: int = 3
+    threshold: float = 0.7
+    save_results: bool = False
+    rescore: bool = False
+    mode: str = "dense"
+
+# 检索基准测试请求：targets 为 provider:index_mode 列表，queries 为空时从嵌入结果中抽样文本块作为查询
+class BenchmarkRequest(BaseModel):
+    file_id: str
+    queries: Optional[List[str]] = None
+    targets: Optional[List[str]] = None
+    top_k: Optional[int] = None
+    sample_queries: Optional[int] = None
+
+# 索引参数调优请求：queries 为空时从集合中抽样向量作为查询，apply 为 True 时用调优后的参数重建索引
+class TuneIndexRequest(BaseModel):
+    queries: Optional[List[str]] = None
+    target_recall: Optional[float] = None
+    top_k: Optional[int] = None
+    sample_queries: Optional[int] = None
+    apply: bool = True
 
 @app.post("/process")
 async def process_file(
@@ -149,6 +207,12 @@ async def list_documents():
         logger.error(f"Error listing documents: {str(e)}")
         raise
 
+def _quantization_report(quantization: Optional[dict]) -> Optional[dict]:
+    """提取量化信息中用于展示的部分（类型和测得的召回率），去掉逐维校准参数"""
+    if not quantization:
+        return None
+    return {key: value for key, value in quantization.items() if key not in ("offset", "scale")}
+
 @app.post("/embed")
 async def embed_document(data: dict = Body(...)):
     try:
@@ -191,57 +255,124 @@ async def embed_document(data: dict = Body(...)):
             }
         }
         
-        # 创建嵌入 - 只接收两个返回值
-        embeddings, _ = embedding_service.create_embeddings(input_data, config)
+        if data.get("stream", False):
+            # 流式模式：逐批写入结果文件并记录检查点，失败后重新提交同样的请求会从断点继续
+            output_path, embedding_stats = embedding_service.create_embeddings_streaming(
+                doc_id, input_data, config, quantization=data.get("quantization"),
+                keep_full_precision=data.get("keep_full_precision")
+            )
+            embedded_doc = load_embedding_artifact(output_path)
+            return {
+                "status": "success",
+                "message": "Embeddings created successfully",
+                "filepath": output_path,
+                "deduplicated_chunks": embedding_stats.get("deduplicated_chunks", 0),
+                "cache_hits": embedding_stats.get("cache_hits", 0),
+                "cache_misses": embedding_stats.get("cache_misses", 0),
+                "resumed_from_chunk": embedding_stats.get("resumed_from_chunk", 0),
+                "quantization": _quantization_report(embedded_doc.get("quantization")),
+                # 流式模式下只返回元数据，不在响应中回传全部向量
+                "embeddings": [{"metadata": emb["metadata"]} for emb in embedded_doc["embeddings"]]
+            }
         
-        # 保存嵌入结果
-        output_path = embedding_service.save_embeddings(doc_id, embeddings)
+        # 创建嵌入 - 第二个返回值为去重和缓存命中统计
+        embeddings, embedding_stats = embedding_service.create_embeddings(input_data, config)
+        
+        # 保存嵌入结果（可选降精度存储）
+        output_path = embedding_service.save_embeddings(
+            doc_id, embeddings, quantization=data.get("quantization"), keep_full_precision=data.get("keep_full_precision")
+        )
         
         return {
             "status": "success",
             "message": "Embeddings created successfully",
             "filepath": output_path,
+            "deduplicated_chunks": embedding_stats.get("deduplicated_chunks", 0),
+            "cache_hits": embedding_stats.get("cache_hits", 0),
+            "cache_misses": embedding_stats.get("cache_misses", 0),
+            "quantization": _quantization_report(read_artifact_header(output_path).get("quantization")),
             "embeddings": embeddings  # 添加embeddings到响应中
         }
         
+    except EmbeddingJobInProgressError as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         logger.error(f"Error creating embeddings: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/embedding-cache/stats")
+async def get_embedding_cache_stats():
+    """获取嵌入缓存的命中统计信息"""
+    try:
+        cache = get_embedding_cache()
+        query_cache = get_query_embedding_cache()
+        query_stats = {"enabled": False} if query_cache is None else {"enabled": True, **query_cache.stats()}
+        if cache is None:
+            return {"enabled": False, "query_cache": query_stats}
+        return {"enabled": True, **cache.stats(), "query_cache": query_stats}
+    except Exception as e:
+        logger.error(f"Error getting embedding cache stats: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/embedding-models/stats")
+async def get_embedding_model_stats():
+    """获取常驻嵌入模型的状态信息"""
+    try:
+        stats = get_embedding_model_registry().stats()
+        stats["process_pools"] = embedding_pool_stats()
+        return stats
+    except Exception as e:
+        logger.error(f"Error getting embedding model stats: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/search-cache/stats")
+async def get_search_cache_stats():
+    """获取检索结果缓存和语义缓存的统计信息（命中率、淘汰数等）"""
+    try:
+        cache = get_search_result_cache()
+        stats = {"enabled": True, **cache.stats(), **get_collection_versions().stats()} if cache is not None else {"enabled": False}
+        semantic_cache = get_semantic_cache()
+        stats["semantic"] = {"enabled": True, **semantic_cache.stats()} if semantic_cache is not None else {"enabled": False}
+        return stats
+    except Exception as e:
+        logger.error(f"Error getting search cache stats: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/rerank/stats")
+async def get_rerank_stats():
+    """获取重排序模型和打分缓存的统计信息"""
+    try:
+        return rerank_stats()
+    except Exception as e:
+        logger.error(f"Error getting rerank stats: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/list-embedded")
 async def list_embedded_docs():
     """List all embedded documents"""
     try:
         documents = []
         embedded_dir = "02-embedded-docs"
-        logger.info(f"Scanning directory: {embedded_dir}")
-        
         if not os.path.exists(embedded_dir):
             logger.warning(f"Directory {embedded_dir} does not exist")
             return {"documents": []}
-            
-        for filename in os.listdir(embedded_dir):
-            if filename.endswith('.json'):
-                file_path = os.path.join(embedded_dir, filename)
-                logger.info(f"Reading file: {file_path}")
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        # 使用实际的文件名，而不是文档名
-                        doc_info = {
-                            "name": filename,  # 保持原始文件名
-                            "metadata": {
-                                "document_name": data.get("document_name", filename),
-                                "embedding_model": data.get("embedding_model", ""),
-                                "embedding_provider": data.get("embedding_provider", ""),
-                                "embedding_timestamp": data.get("created_at", ""),
-                                "vector_dimension": data.get("vector_dimension", 0)
-                            }
-                        }
-                        logger.info(f"Added document info: {doc_info}")
-                        documents.append(doc_info)
-                except Exception as e:
-                    logger.error(f"Error reading file {file_path}: {str(e)}")
+        
+        # 从清单读取摘要信息，只有清单中缺失的文件才需要打开解析
+        manifest = get_embedding_manifest()
+        manifest.sync()
+        for entry in manifest.list_all():
+            documents.append({
+                "name": entry["artifact_file"],  # 保持原始文件名
+                "metadata": {
+                    "document_name": entry["artifact_file"],
+                    "embedding_model": entry["embedding_model"] or "",
+                    "embedding_provider": entry["embedding_provider"] or "",
+                    "embedding_timestamp": entry["created_at"] or "",
+                    "vector_dimension": entry["vector_dimension"] or 0,
+                    "chunk_count": entry["chunk_count"] or 0
+                }
+            })
                     
         logger.info(f"Total documents found: {len(documents)}")
         return {"documents": documents}
@@ -256,10 +387,23 @@ async def index_embeddings(request: IndexRequest):
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="File not found")
         
-        config = VectorDBConfig(request.vector_db, request.index_mode)
+        try:
+            config = VectorDBConfig(
+                request.vector_db,
+                request.index_mode,
+                near_dedup=request.near_dedup,
+                near_dedup_threshold=request.near_dedup_threshold,
+                near_dedup_mode=request.near_dedup_mode,
+                upsert=request.upsert,
+                collection_name=request.collection_name
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         vector_store_service = VectorStoreService()
         result = vector_store_service.index_embeddings(file_path, config)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception(f"Error during indexing: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -297,7 +441,12 @@ async def search(
     top_k: int = Body(3),
     threshold: float = Body(0.7),
     word_count_threshold: int = Body(100),
-    save_results: bool = Body(False)
+    save_results: bool = Body(False),
+    rescore: bool = Body(False),
+    mode: str = Body("dense"),
+    rerank: bool = Body(False),
+    rerank_candidates: Optional[int] = Body(None),
+    semantic_cache: Optional[bool] = Body(None)
 ):
     """执行向量搜索"""
     try:
@@ -316,7 +465,12 @@ async def search(
             "top_k": top_k,
             "threshold": threshold,
             "word_count_threshold": word_count_threshold,
-            "save_results": save_results
+            "save_results": save_results,
+            "rescore": rescore,
+            "mode": mode,
+            "rerank": rerank,
+            "rerank_candidates": rerank_candidates,
+            "semantic_cache": semantic_cache
         })
         
         # Log the search results
@@ -330,6 +484,40 @@ async def search(
             detail=str(e)
         )
 
+@app.post("/search/batch")
+async def batch_search(request: BatchSearchRequest):
+    """批量执行向量搜索：一次生成全部查询向量，一次多向量检索"""
+    try:
+        search_service = SearchService()
+        # 返回值本身已包含 results 和 total_queries，不再嵌套一层
+        return await search_service.batch_search(request.dict())
+    except Exception as e:
+        logger.error(f"Error performing batch search: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/benchmark")
+async def run_benchmark(request: BenchmarkRequest):
+    """在嵌入结果上构建各个索引，测量召回率、延迟分位数、构建时间和内存占用"""
+    try:
+        file_path = os.path.join("02-embedded-docs", request.file_id)
+        if not os.path.exists(file_path):
+            raise HTTPException(status_code=404, detail="File not found")
+        
+        benchmark_service = BenchmarkService()
+        return await asyncio.to_thread(
+            benchmark_service.run,
+            file_path,
+            queries=request.queries,
+            targets=request.targets,
+            top_k=request.top_k,
+            sample_queries=request.sample_queries
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"Error running benchmark: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/collections/{provider}")
 async def get_provider_collections(provider: str):
     """Get collections for a specific vector database provider"""
@@ -344,6 +532,29 @@ async def get_provider_collections(provider: str):
             detail=str(e)
         )
 
+@app.post("/collections/{provider}/{collection_name}/tune")
+async def tune_collection_index(provider: str, collection_name: str, request: TuneIndexRequest):
+    """在 nlist/nprobe 或 M/ef 空间中寻找满足目标召回率的最低代价参数，并保存到集合"""
+    try:
+        if provider != VectorDBProvider.MILVUS.value:
+            raise HTTPException(status_code=400, detail="Index tuning is only supported for Milvus collections")
+        
+        autotuner = IndexAutotuner()
+        return await asyncio.to_thread(
+            autotuner.tune,
+            collection_name,
+            queries=request.queries,
+            target_recall=request.target_recall,
+            top_k=request.top_k,
+            sample_queries=request.sample_queries,
+            apply=request.apply
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"Error tuning index of {collection_name}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/collections/{provider}/{collection_name}")
 async def get_collection_info(provider: str, collection_name: str):
     """Get detailed information about a specific collection"""
@@ -518,31 +729,32 @@ async def get_embedded_doc(doc_name: str):
                 detail=f"Document {doc_name} not found"
             )
             
-        with open(file_path, 'r', encoding='utf-8') as f:
-            doc_data = json.load(f)
-            logger.info(f"Successfully read document: {doc_name}")
-            
-            return {
-                "embeddings": [
-                    {
-                        "embedding": embedding["embedding"],
-                        "metadata": {
-                            "document_name": doc_data.get("document_name", doc_name),
-                            "chunk_id": idx + 1,
-                            "total_chunks": len(doc_data["embeddings"]),
-                            "content": embedding["metadata"].get("content", ""),
-                            "page_number": embedding["metadata"].get("page_number", ""),
-                            "page_range": embedding["metadata"].get("page_range", ""),
-                            # "chunking_method": embedding["metadata"].get("chunking_method", ""),
-                            "embedding_model": doc_data.get("embedding_model", ""),
-                            "embedding_provider": doc_data.get("embedding_provider", ""),
-                            "embedding_timestamp": doc_data.get("created_at", ""),
-                            "vector_dimension": doc_data.get("vector_dimension", 0)
-                        }
+        # 二进制格式通过内存映射读取向量，旧的 JSON 格式仍然兼容
+        doc_data = load_embedding_artifact(file_path)
+        vectors = doc_data["vectors"]
+        logger.info(f"Successfully read document: {doc_name}")
+        
+        return {
+            "embeddings": [
+                {
+                    "embedding": vectors[idx].tolist(),
+                    "metadata": {
+                        "document_name": doc_data.get("document_name", doc_name),
+                        "chunk_id": idx + 1,
+                        "total_chunks": len(doc_data["embeddings"]),
+                        "content": embedding["metadata"].get("content", ""),
+                        "page_number": embedding["metadata"].get("page_number", ""),
+                        "page_range": embedding["metadata"].get("page_range", ""),
+                        # "chunking_method": embedding["metadata"].get("chunking_method", ""),
+                        "embedding_model": doc_data.get("embedding_model", ""),
+                        "embedding_provider": doc_data.get("embedding_provider", ""),
+                        "embedding_timestamp": doc_data.get("created_at", ""),
+                        "vector_dimension": doc_data.get("vector_dimension", 0)
                     }
-                    for idx, embedding in enumerate(doc_data["embeddings"])
-                ]
-            }
+                }
+                for idx, embedding in enumerate(doc_data["embeddings"])
+            ]
+        }
     except HTTPException:
         raise
     except Exception as e:
@@ -560,7 +772,10 @@ async def delete_embedded_doc(doc_name: str):
                 detail=f"Document {doc_name} not found"
             )
             
-        os.remove(file_path)
+        # 同时删除二进制向量文件
+        for path in artifact_files(file_path):
+            os.remove(path)
+        get_embedding_manifest().remove(doc_name)
         return {"message": f"Document {doc_name} deleted successfully"}
     except Exception as e:
         logger.error(f"Error deleting embedded document {doc_name}: {str(e)}")
@@ -801,132 +1016,15 @@ async def chunk_document(data: dict = Body(...)):
 async def evaluate_search(
     file: UploadFile = File(...),
     collection_id: str = Form(...),
+    provider: str = Form("milvus"),
     top_k: int = Form(10),
     threshold: float = Form(0.7)
 ):
     try:
-        # 读取CSV文件
+        # 读取CSV文件，解析、嵌入、检索和计算指标由评估流水线分阶段完成
         df = pd.read_csv(file.file)
-        
-        # 只合并前四列的文本内容
-        df['combined_text'] = df.apply(
-            lambda row: ' '.join(
-                str(val) for i, val in enumerate(row) 
-                if i < 4 and pd.notna(val) and val != '[]'
-            ), 
-            axis=1
-        )
-        
-        # 初始化SearchService
-        search_service = SearchService()
-        
-        results = []
-        total_score_hit = 0
-        total_score_find = 0
-        valid_queries = 0
-        
-        # 处理每个查询
-        for _, row in df.iterrows():
-            # 跳过没有标签的行
-            if pd.isna(row['LABEL']) or row['LABEL'] == '[]':
-                continue
-                
-            try:
-                # 解析标签页码列表
-                label_str = str(row['LABEL']).strip('[]').replace(' ', '')
-                if label_str:
-                    expected_pages = [int(x.strip()) for x in label_str.split(',') if x.strip()]
-                else:
-                    continue
-                
-                # 执行搜索
-                search_results = await search_service.search(
-                    query=row['combined_text'],
-                    collection_id=collection_id,
-                    top_k=top_k,
-                    threshold=threshold
-                )
-                
-                # 提取找到的页码
-                found_pages = [int(result['metadata']['page']) for result in search_results]
-                
-                # 计算分数
-                hits = sum(1 for page in found_pages if page in expected_pages)
-                score_hit = hits / len(found_pages) if found_pages else 0
-                score_find = len(set(found_pages) & set(expected_pages)) / len(expected_pages)
-                
-                # 添加到结果列表，包括所有top_k结果的文本
-                result_entry = {
-                    "query": row['combined_text'],
-                    "expected_pages": expected_pages,
-                    "found_pages": found_pages,
-                    "score_hit": score_hit,
-                    "score_find": score_find
-                }
-                
-                # 添加每个top_k结果的文本作为单独的字段
-                for i, result in enumerate(search_results, 1):
-                    result_entry[f"text_{i}"] = result['text']
-                    result_entry[f"page_{i}"] = result['metadata']['page']
-                    result_entry[f"score_{i}"] = result['score']
-                
-                results.append(result_entry)
-                
-                total_score_hit += score_hit
-                total_score_find += score_find
-                valid_queries += 1
-                
-            except Exception as e:
-                logger.warning(f"Error processing row: {str(e)}")
-                continue
-        
-        if valid_queries == 0:
-            raise ValueError("No valid queries found in the CSV file")
-        
-        # 计算平均分数
-        average_scores = {
-            "score_hit": total_score_hit / valid_queries,
-            "score_find": total_score_find / valid_queries
-        }
-        
-        # 保存结果
-        output_dir = Path("06-evaluation-result")
-        output_dir.mkdir(exist_ok=True)
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        
-        # 保存详细的JSON结果
-        output_path = output_dir / f"evaluation_results_{timestamp}.json"
-        evaluation_results = {
-            "results": results,
-            "average_scores": average_scores,
-            "total_queries": valid_queries,
-            "parameters": {
-                "collection_id": collection_id,
-                "top_k": top_k,
-                "threshold": threshold
-            }
-        }
-        
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(evaluation_results, f, indent=2)
-            
-        # 保存CSV格式的结果，每个top_k结果单独一列
-        results_df = pd.DataFrame(results)
-        
-        # 重新排列列的顺序，使其更有逻辑性
-        column_order = ['query', 'expected_pages', 'found_pages', 'score_hit', 'score_find']
-        for i in range(1, top_k + 1):
-            column_order.extend([f'page_{i}', f'score_{i}', f'text_{i}'])
-        
-        # 只选择存在的列
-        existing_columns = [col for col in column_order if col in results_df.columns]
-        results_df = results_df[existing_columns]
-        
-        csv_path = output_dir / f"evaluation_results_{timestamp}.csv"
-        results_df.to_csv(csv_path, index=False)
-        
-        return evaluation_results
+        evaluation_service = EvaluationService()
+        return await evaluation_service.evaluate(df, collection_id, provider, top_k, threshold)
         
     except Exception as e:
         logger.error(f"Error during evaluation: {str(e)}")
@@ -969,9 +1067,12 @@ async def generate_response(
     provider: str = Body(...),
     model_name: str = Body(...),
     search_results: List[Dict] = Body(...),
-    api_key: Optional[str] = Body(None)
+    api_key: Optional[str] = Body(None),
+    collection_id: Optional[str] = Body(None),
+    collection_provider: str = Body("milvus"),
+    semantic_cache: bool = Body(False)
 ):
-    """生成回答"""
+    """生成回答（semantic_cache 为 True 且指定 collection_id 时，语义相同的查询复用之前生成的回答）"""
     try:
         generation_service = GenerationService()
         result = generation_service.generate(
@@ -979,7 +1080,10 @@ async def generate_response(
             model_name=model_name,
             query=query,
             search_results=search_results,
-            api_key=api_key
+            api_key=api_key,
+            collection_id=collection_id,
+            collection_provider=collection_provider,
+            semantic_cache=semantic_cache
         )
         return result
     except Exception as e:
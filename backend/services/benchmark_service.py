@@ -0,0 +1,438 @@
+import os
+import csv
+import json
+import shutil
+import logging
+import argparse
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+import numpy as np
+import chromadb
+from chromadb.config import Settings
+from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, utility
+from services.embedding_artifact import load_embedding_artifact
+from services.embedding_service import EmbeddingService
+from services.local_vector_store import LocalCollection, LocalVectorStore
+from services.milvus_connection import MilvusConnectionManager
+from services.index_tuning import default_index_params
+from services.vector_store_service import _milvus_search_params
+from utils.config import BENCHMARK_CONFIG, MILVUS_CONFIG, MILVUS_INSERT_CONFIG
+
+try:
+    import psutil
+except ImportError:  # 没有 psutil 时不统计内存
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+"""
+检索基准测试：在同一份嵌入结果和查询集上分别构建各个索引，与精确检索的结果对比召回率，
+并统计延迟分位数、构建时间和内存占用。
+
+每个测试目标（provider:index_mode）都构建在 work_dir 下独立的临时目录中（Milvus Lite 数据库文件、
+Chroma 持久化目录或本地集合），测试结束后删除，不依赖任何外部服务，也不会改动正在使用的向量库。
+"""
+
+CSV_COLUMNS = [
+    "target", "provider", "index_mode", "index_type", "recall_at_k",
+    "latency_p50_ms", "latency_p95_ms", "latency_p99_ms", "latency_mean_ms",
+    "build_seconds", "memory_mb", "disk_mb", "error"
+]
+
+class BenchmarkTarget:
+    """
+    一个已构建的测试目标
+    """
+    def __init__(self, search: Callable[[np.ndarray, int], List[int]], cleanup: Callable[[], None], index_type: str):
+        """
+        参数:
+            search: 单个查询向量 -> top-k 行号列表
+            cleanup: 释放连接和句柄（临时目录由调用方删除）
+            index_type: 实际生效的索引类型
+        """
+        self.search = search
+        self.cleanup = cleanup
+        self.index_type = index_type
+
+class BenchmarkService:
+    """
+    检索延迟/召回率基准测试服务
+    """
+    def __init__(self, output_dir: str = None, work_dir: str = None):
+        """
+        初始化基准测试服务
+
+        参数:
+            output_dir: 报告输出目录，为None时使用默认配置
+            work_dir: 临时索引目录，为None时使用默认配置
+        """
+        self.output_dir = output_dir or BENCHMARK_CONFIG["output_dir"]
+        self.work_dir = work_dir or BENCHMARK_CONFIG["work_dir"]
+
+    def load_queries(self, data: Dict[str, Any], queries: Optional[List[str]], sample_queries: int, seed: int = 0) -> tuple:
+        """
+        准备查询向量
+
+        提供了查询文本时使用嵌入结果对应的嵌入模型生成查询向量；否则从嵌入结果中抽样文本块向量作为查询，
+        这种情况不需要加载任何嵌入模型。
+
+        参数:
+            data: load_embedding_artifact 返回的嵌入结果
+            queries: 查询文本列表
+            sample_queries: 未提供查询文本时抽样的查询数
+            seed: 抽样的随机种子
+
+        返回:
+            (查询向量矩阵, 查询来源说明)
+        """
+        if queries:
+            embeddings = EmbeddingService().embed_queries(
+                queries, data.get("embedding_provider"), data.get("embedding_model")
+            )
+            return np.asarray(embeddings, dtype=np.float32), "text"
+
+        vectors = data["vectors"]
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(vectors.shape[0], size=min(sample_queries, vectors.shape[0]), replace=False))
+        return np.asarray(vectors[rows], dtype=np.float32), "sampled_chunks"
+
+    def run(self, embedding_file: str, queries: Optional[List[str]] = None, targets: Optional[List[str]] = None,
+            top_k: int = None, sample_queries: int = None) -> Dict[str, Any]:
+        """
+        执行基准测试并保存报告
+
+        参数:
+            embedding_file: 嵌入结果文件路径
+            queries: 查询文本列表，为None时从嵌入结果中抽样
+            targets: 测试目标列表，格式为 provider:index_mode，为None时使用默认配置
+            top_k: 计算 recall@k 的 k
+            sample_queries: 抽样查询数
+
+        返回:
+            基准测试报告
+        """
+        top_k = top_k or BENCHMARK_CONFIG["top_k"]
+        targets = targets or BENCHMARK_CONFIG["targets"]
+        data = load_embedding_artifact(embedding_file)
+        vectors = np.ascontiguousarray(data["vectors"], dtype=np.float32)
+        query_vectors, query_source = self.load_queries(data, queries, sample_queries or BENCHMARK_CONFIG["sample_queries"])
+
+        # 精确检索的结果作为标准答案
+        exact = LocalCollection("ground_truth", vectors, [], {})
+        ground_truth = [[row for row, _ in hits] for hits in exact.search(query_vectors, top_k)]
+        logger.info(f"Benchmarking {len(targets)} targets on {vectors.shape[0]} vectors with {len(query_vectors)} queries")
+
+        # 每个目标的临时目录在 _run_target 中删除；work_dir 由并发的运行共用，不整体删除
+        results = [self._run_target(target, vectors, query_vectors, ground_truth, top_k) for target in targets]
+
+        report = {
+            "embedding_file": os.path.basename(embedding_file),
+            "embedding_provider": data.get("embedding_provider"),
+            "embedding_model": data.get("embedding_model"),
+            "num_vectors": int(vectors.shape[0]),
+            "dimension": int(vectors.shape[1]),
+            "num_queries": int(len(query_vectors)),
+            "query_source": query_source,
+            "top_k": top_k,
+            "results": results,
+            "created_at": datetime.now().isoformat()
+        }
+        report["report_files"] = self.save_report(report)
+        return report
+
+    def _run_target(self, target: str, vectors: np.ndarray, query_vectors: np.ndarray,
+                    ground_truth: List[List[int]], top_k: int) -> Dict[str, Any]:
+        """
+        构建并测试一个目标，失败时记录错误而不中断其他目标
+
+        参数:
+            target: provider:index_mode
+            vectors: 全部向量
+            query_vectors: 查询向量
+            ground_truth: 每个查询的精确 top-k 行号
+            top_k: 返回的结果数
+
+        返回:
+            该目标的测试结果
+        """
+        provider, _, index_mode = target.partition(":")
+        result = {column: None for column in CSV_COLUMNS}
+        result.update({"target": target, "provider": provider, "index_mode": index_mode or "flat"})
+        builders = {
+            "milvus": self._build_milvus,
+            "chroma": self._build_chroma,
+            "faiss": self._build_local
+        }
+        if provider not in builders:
+            result["error"] = f"Unsupported benchmark provider: {provider}"
+            return result
+
+        target_dir = os.path.join(self.work_dir, f"{provider}_{result['index_mode']}_{uuid.uuid4().hex[:8]}")
+        os.makedirs(target_dir, exist_ok=True)
+        built = None
+        try:
+            memory_before = _memory_usage()
+            start = time.perf_counter()
+            built = builders[provider](result["index_mode"], vectors, target_dir)
+            result["build_seconds"] = round(time.perf_counter() - start, 4)
+            memory_after = _memory_usage()
+            if memory_before is not None and memory_after is not None:
+                result["memory_mb"] = round((memory_after - memory_before) / 1024 ** 2, 2)
+            result["disk_mb"] = round(_directory_size(target_dir) / 1024 ** 2, 2)
+            result["index_type"] = built.index_type
+
+            for query in query_vectors[:BENCHMARK_CONFIG["warmup_queries"]]:
+                built.search(query, top_k)
+
+            latencies = []
+            recalls = []
+            for query, expected in zip(query_vectors, ground_truth):
+                start = time.perf_counter()
+                found = built.search(query, top_k)
+                latencies.append((time.perf_counter() - start) * 1000)
+                recalls.append(len(set(found) & set(expected)) / max(len(expected), 1))
+
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            result.update({
+                "recall_at_k": round(float(np.mean(recalls)), 4),
+                "latency_p50_ms": round(float(p50), 3),
+                "latency_p95_ms": round(float(p95), 3),
+                "latency_p99_ms": round(float(p99), 3),
+                "latency_mean_ms": round(float(np.mean(latencies)), 3)
+            })
+            logger.info(f"Benchmark {target}: recall@{top_k}={result['recall_at_k']}, p95={result['latency_p95_ms']}ms")
+        except Exception as e:
+            logger.exception(f"Benchmark target {target} failed")
+            result["error"] = str(e)
+        finally:
+            if built is not None:
+                try:
+                    built.cleanup()
+                except Exception as e:
+                    logger.warning(f"Error cleaning up benchmark target {target}: {str(e)}")
+            shutil.rmtree(target_dir, ignore_errors=True)
+        return result
+
+    def _build_milvus(self, index_mode: str, vectors: np.ndarray, target_dir: str,
+                      index_params: Dict[str, Any] = None) -> BenchmarkTarget:
+        """
+        在独立的 Milvus Lite 数据库文件中构建索引
+
+        返回的 search 额外接受 search_params 参数，用于在同一个索引上比较不同的检索参数。
+
+        参数:
+            index_mode: 索引模式
+            vectors: 全部向量
+            target_dir: 临时目录
+            index_params: 索引参数，为None时与建索引流程一样按数据量推导
+
+        返回:
+            BenchmarkTarget
+        """
+        if index_mode not in MILVUS_CONFIG["index_types"]:
+            raise ValueError(f"Unsupported Milvus index mode: {index_mode}")
+        manager = MilvusConnectionManager(
+            uri=os.path.join(target_dir, "benchmark.db"),
+            timeout=MILVUS_CONFIG["timeout"],
+            health_check_interval=MILVUS_CONFIG["health_check_interval"]
+        )
+        if index_params is None:
+            index_params = default_index_params(index_mode, int(vectors.shape[0]))
+        alias = manager.ensure_connected()
+        index_timeout = MILVUS_CONFIG["index_timeout"]
+        schema = CollectionSchema(fields=[
+            FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+            FieldSchema(name="vector", dtype=DataType.FLOAT_VECTOR, dim=int(vectors.shape[1]))
+        ])
+        collection = Collection(name=f"benchmark_{index_mode}", schema=schema, using=alias, timeout=manager.timeout)
+
+        batch_size = MILVUS_INSERT_CONFIG["batch_size"]
+        for start in range(0, vectors.shape[0], batch_size):
+            block = vectors[start:start + batch_size]
+            collection.insert([list(range(start, start + len(block))), block.tolist()], timeout=index_timeout)
+        collection.flush(timeout=index_timeout)
+        collection.create_index(field_name="vector", index_params={
+            "metric_type": "COSINE",
+            "index_type": MILVUS_CONFIG["index_types"][index_mode],
+            "params": index_params
+        }, timeout=index_timeout)
+        collection.load(timeout=index_timeout)
+
+        # 记录 Milvus 实际返回的索引类型
+        params = collection.indexes[0].params if collection.indexes else {}
+        handle = {
+            "index_type": params.get("index_type", MILVUS_CONFIG["index_types"][index_mode]),
+            "index_params": index_params
+        }
+
+        def search(query: np.ndarray, top_k: int, search_params: Dict[str, Any] = None) -> List[int]:
+            hits = collection.search(
+                data=[query.tolist()],
+                anns_field="vector",
+                param={"metric_type": "COSINE", "params": search_params or _milvus_search_params(handle, top_k)},
+                limit=top_k,
+                timeout=manager.timeout
+            )
+            return [hit.id for hit in hits[0]]
+
+        def cleanup():
+            try:
+                utility.drop_collection(collection.name, using=alias, timeout=manager.timeout)
+            finally:
+                manager.close()
+
+        return BenchmarkTarget(search, cleanup, handle["index_type"])
+
+    def _build_chroma(self, index_mode: str, vectors: np.ndarray, target_dir: str) -> BenchmarkTarget:
+        """
+        在独立的 Chroma 持久化目录中构建索引（Chroma 只有 HNSW 一种索引）
+
+        参数:
+            index_mode: 索引模式
+            vectors: 全部向量
+            target_dir: 临时目录
+
+        返回:
+            BenchmarkTarget
+        """
+        if index_mode != "hnsw":
+            raise ValueError(f"Chroma only supports the hnsw index mode, got: {index_mode}")
+        client = chromadb.PersistentClient(
+            path=target_dir,
+            settings=Settings(anonymized_telemetry=False, allow_reset=True)
+        )
+        hnsw_params = MILVUS_CONFIG["index_params"]["hnsw"]
+        collection = client.create_collection(
+            name="benchmark_hnsw",
+            embedding_function=None,
+            metadata={
+                "hnsw:space": "cosine",
+                "hnsw:M": hnsw_params["M"],
+                "hnsw:construction_ef": hnsw_params["efConstruction"],
+                "hnsw:search_ef": MILVUS_CONFIG["search_params"]["hnsw"]["ef"]
+            }
+        )
+        batch_size = MILVUS_INSERT_CONFIG["batch_size"]
+        for start in range(0, vectors.shape[0], batch_size):
+            block = vectors[start:start + batch_size]
+            collection.add(ids=[str(row) for row in range(start, start + len(block))], embeddings=block.tolist())
+
+        def search(query: np.ndarray, top_k: int) -> List[int]:
+            hits = collection.query(query_embeddings=[query.tolist()], n_results=top_k, include=[])
+            return [int(row) for row in hits["ids"][0]]
+
+        def cleanup():
+            client.delete_collection("benchmark_hnsw")
+
+        return BenchmarkTarget(search, cleanup, "HNSW")
+
+    def _build_local(self, index_mode: str, vectors: np.ndarray, target_dir: str) -> BenchmarkTarget:
+        """
+        构建进程内的精确检索集合（FAISS 槽位只有精确检索，index_mode 仅作记录）
+
+        参数:
+            index_mode: 索引模式
+            vectors: 全部向量
+            target_dir: 临时目录
+
+        返回:
+            BenchmarkTarget
+        """
+        store = LocalVectorStore(target_dir)
+        records = [{"text": "", "metadata": {}} for _ in range(vectors.shape[0])]
+        store.create_collection("benchmark", vectors, records, {"index_mode": index_mode})
+        collection = store.get_collection("benchmark")
+
+        def search(query: np.ndarray, top_k: int) -> List[int]:
+            return [row for row, _ in collection.search(query, top_k)[0]]
+
+        return BenchmarkTarget(search, lambda: store.delete_collection("benchmark"), "EXACT")
+
+    def save_report(self, report: Dict[str, Any]) -> Dict[str, str]:
+        """
+        保存 JSON 报告和每个目标一行的 CSV，便于跨次运行对比
+
+        参数:
+            report: 基准测试报告
+
+        返回:
+            {"json": 路径, "csv": 路径}
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        base_name = os.path.splitext(report["embedding_file"])[0]
+        json_path = os.path.join(self.output_dir, f"benchmark_{base_name}_{timestamp}.json")
+        csv_path = os.path.join(self.output_dir, f"benchmark_{base_name}_{timestamp}.csv")
+
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        with open(csv_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["embedding_file", "num_vectors", "num_queries", "top_k"] + CSV_COLUMNS)
+            writer.writeheader()
+            for result in report["results"]:
+                writer.writerow({
+                    "embedding_file": report["embedding_file"],
+                    "num_vectors": report["num_vectors"],
+                    "num_queries": report["num_queries"],
+                    "top_k": report["top_k"],
+                    **result
+                })
+        logger.info(f"Saved benchmark report to {json_path}")
+        return {"json": json_path, "csv": csv_path}
+
+def _memory_usage() -> Optional[int]:
+    """
+    当前进程及其子进程（Milvus Lite 服务进程）的常驻内存字节数，没有 psutil 时返回 None
+    """
+    if psutil is None:
+        return None
+    process = psutil.Process()
+    total = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+def _directory_size(path: str) -> int:
+    """
+    目录下全部文件的字节数
+    """
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+if __name__ == "__main__":
+    # 在 backend 目录下运行：python -m services.benchmark_service 02-embedded-docs/xxx.json --targets milvus:hnsw faiss:flat
+    parser = argparse.ArgumentParser(description="Retrieval latency/recall benchmark across index modes")
+    parser.add_argument("embedding_file", help="Embedded-docs artifact (JSON sidecar)")
+    parser.add_argument("--queries", help="Text file with one query per line; chunks are sampled when omitted")
+    parser.add_argument("--targets", nargs="+", default=None, help="provider:index_mode targets")
+    parser.add_argument("--top-k", type=int, default=None)
+    parser.add_argument("--sample-queries", type=int, default=None)
+    parser.add_argument("--output-dir", default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    query_texts = None
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            query_texts = [line.strip() for line in f if line.strip()]
+
+    benchmark_report = BenchmarkService(output_dir=args.output_dir).run(
+        args.embedding_file,
+        queries=query_texts,
+        targets=args.targets,
+        top_k=args.top_k,
+        sample_queries=args.sample_queries
+    )
+    for row in benchmark_report["results"]:
+        print(json.dumps(row, ensure_ascii=False))
@@ -0,0 +1,344 @@
+import os
+import re
+import json
+import shutil
+import logging
+import threading
+import unicodedata
+from typing import Any, Dict, List, Optional
+import numpy as np
+from utils.config import BM25_CONFIG
+
+logger = logging.getLogger(__name__)
+
+"""
+进程内的 BM25 倒排索引，用于混合检索中的稀疏检索
+
+分词：文本先做 NFKC 规范化（全角字母数字转为半角）并转小写。中文等 CJK 连续片段同时切分为单字和相邻两字组合，
+不依赖中文分词词典；字母数字片段整体作为一个词，带有 - _ . / 连接符的型号（如 ab-123）额外拆出各个部分。
+
+存储：每个集合一个目录，terms.npz 按文档保存 (词ID, 词频) 的 CSR 矩阵，vocabulary.json 保存词表，
+records.json 保存与文档一一对应的 {"text", "metadata"}。加载时再转置出按词排列的倒排表，
+查询时只访问查询词的倒排表，用 bincount 一次累加全部文档得分。
+"""
+
+_CJK = r"\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af"
+_TOKEN_RE = re.compile(rf"[{_CJK}]+|[0-9a-z]+(?:[-_./][0-9a-z]+)*")
+_CJK_RE = re.compile(rf"[{_CJK}]")
+_SEPARATOR_RE = re.compile(r"[-_./]")
+
+def tokenize(text: str) -> List[str]:
+    """
+    把文本切分为 BM25 使用的词
+
+    参数:
+        text: 文本
+
+    返回:
+        词列表（保留重复，用于统计词频）
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    tokens = []
+    for match in _TOKEN_RE.finditer(text):
+        run = match.group()
+        if _CJK_RE.match(run):
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+            parts = _SEPARATOR_RE.split(run)
+            if len(parts) > 1:
+                tokens.extend(part for part in parts if part)
+    return tokens
+
+class BM25Index:
+    """
+    一个集合的 BM25 索引
+    """
+    def __init__(self, vocabulary: Dict[str, int], doc_indptr: np.ndarray, doc_terms: np.ndarray,
+                 doc_freqs: np.ndarray, records: List[Dict[str, Any]], k1: float, b: float):
+        """
+        初始化索引并生成倒排表
+
+        参数:
+            vocabulary: 词 -> 词ID
+            doc_indptr: 文档的 CSR 行指针
+            doc_terms: 每个文档出现的词ID
+            doc_freqs: 与 doc_terms 对应的词频
+            records: 与文档一一对应的 {"text", "metadata"} 列表
+            k1: BM25 词频饱和参数
+            b: BM25 文档长度归一化参数
+        """
+        self.vocabulary = vocabulary
+        self.doc_indptr = np.asarray(doc_indptr, dtype=np.int64)
+        self.doc_terms = np.asarray(doc_terms, dtype=np.int32)
+        self.doc_freqs = np.asarray(doc_freqs, dtype=np.float32)
+        self.records = records
+        self.k1 = k1
+        self.b = b
+
+        num_docs = len(records)
+        doc_rows = np.repeat(np.arange(num_docs, dtype=np.int32), np.diff(self.doc_indptr))
+        self.doc_lengths = np.bincount(doc_rows, weights=self.doc_freqs, minlength=num_docs).astype(np.float32)
+        self.avg_doc_length = float(self.doc_lengths.mean()) if num_docs else 0.0
+
+        # 转置为按词排列的倒排表
+        order = np.argsort(self.doc_terms, kind="stable")
+        self.posting_docs = doc_rows[order]
+        self.posting_freqs = self.doc_freqs[order]
+        document_frequency = np.bincount(self.doc_terms, minlength=len(vocabulary))
+        self.term_indptr = np.concatenate([[0], np.cumsum(document_frequency)])
+        self.idf = np.log1p((num_docs - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+
+    @classmethod
+    def build(cls, records: List[Dict[str, Any]], vocabulary: Optional[Dict[str, int]] = None,
+              k1: float = None, b: float = None) -> "BM25Index":
+        """
+        对记录的文本分词并建立索引
+
+        参数:
+            records: {"text", "metadata"} 列表
+            vocabulary: 已有词表（增量更新时传入，新词追加到末尾）
+            k1: BM25 参数，为None时使用默认配置
+            b: BM25 参数，为None时使用默认配置
+
+        返回:
+            BM25Index 实例
+        """
+        vocabulary = dict(vocabulary or {})
+        indptr = [0]
+        terms = []
+        freqs = []
+        for record in records:
+            counts: Dict[int, int] = {}
+            for token in tokenize(record.get("text", "")):
+                term_id = vocabulary.setdefault(token, len(vocabulary))
+                counts[term_id] = counts.get(term_id, 0) + 1
+            terms.extend(counts.keys())
+            freqs.extend(counts.values())
+            indptr.append(len(terms))
+        return cls(
+            vocabulary, np.asarray(indptr), np.asarray(terms, dtype=np.int32), np.asarray(freqs, dtype=np.float32),
+            list(records), k1 if k1 is not None else BM25_CONFIG["k1"], b if b is not None else BM25_CONFIG["b"]
+        )
+
+    def replace_document(self, document_name: str, records: List[Dict[str, Any]]) -> "BM25Index":
+        """
+        用新的记录替换某个文档的全部记录（增量更新时使用），只对新记录分词
+
+        参数:
+            document_name: 文档名称
+            records: 该文档的新记录
+
+        返回:
+            新的 BM25Index 实例
+        """
+        keep = [row for row, record in enumerate(self.records) if record["metadata"].get("document_name") != document_name]
+        added = BM25Index.build(records, self.vocabulary, self.k1, self.b)
+
+        kept_lengths = np.diff(self.doc_indptr)[keep]
+        kept_slices = [np.arange(self.doc_indptr[row], self.doc_indptr[row + 1]) for row in keep]
+        kept_positions = np.concatenate(kept_slices) if kept_slices else np.zeros(0, dtype=np.int64)
+        indptr = np.concatenate([[0], np.cumsum(np.concatenate([kept_lengths, np.diff(added.doc_indptr)]))])
+        return BM25Index(
+            added.vocabulary,
+            indptr,
+            np.concatenate([self.doc_terms[kept_positions], added.doc_terms]),
+            np.concatenate([self.doc_freqs[kept_positions], added.doc_freqs]),
+            [self.records[row] for row in keep] + added.records,
+            self.k1,
+            self.b
+        )
+
+    def search(self, query: str, top_k: int) -> List[tuple]:
+        """
+        计算查询的 BM25 得分并取 top-k
+
+        参数:
+            query: 查询文本
+            top_k: 返回的结果数
+
+        返回:
+            [(行号, 得分), ...]，按得分降序排列，只包含得分大于 0 的文档
+        """
+        term_ids = {self.vocabulary[token] for token in tokenize(query) if token in self.vocabulary}
+        if not term_ids or top_k <= 0:
+            return []
+
+        docs = []
+        weights = []
+        for term_id in term_ids:
+            start, end = self.term_indptr[term_id], self.term_indptr[term_id + 1]
+            posting_docs = self.posting_docs[start:end]
+            tf = self.posting_freqs[start:end]
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[posting_docs] / max(self.avg_doc_length, 1e-6))
+            docs.append(posting_docs)
+            weights.append(self.idf[term_id] * tf * (self.k1 + 1) / (tf + norm))
+        scores = np.bincount(np.concatenate(docs), weights=np.concatenate(weights), minlength=len(self.records))
+
+        matched = np.flatnonzero(scores > 0)
+        if len(matched) > top_k:
+            matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(int(row), float(scores[row])) for row in matched]
+
+    def stats(self) -> Dict[str, Any]:
+        """索引规模"""
+        return {"documents": len(self.records), "terms": len(self.vocabulary)}
+
+class BM25Store:
+    """
+    按 (provider, 集合) 保存的 BM25 索引及其内存缓存
+    """
+    def __init__(self, root_dir: str):
+        """
+        初始化 BM25 索引存储
+
+        参数:
+            root_dir: 索引保存目录
+        """
+        self.root_dir = root_dir
+        self._indexes: Dict[tuple, tuple] = {}
+        self._lock = threading.Lock()
+        # 每个集合一把写锁：读取旧索引 -> 修改 -> 写回 的整个过程互斥，并发写入不会丢失彼此的记录
+        self._write_locks: Dict[tuple, threading.Lock] = {}
+
+    def _write_lock(self, provider: str, collection_name: str) -> threading.Lock:
+        """获取集合的写锁"""
+        with self._lock:
+            return self._write_locks.setdefault((provider, collection_name), threading.Lock())
+
+    def _index_dir(self, provider: str, collection_name: str) -> str:
+        """获取索引目录，拒绝包含路径分隔符的名称"""
+        for name in (provider, collection_name):
+            if not name or os.path.basename(name) != name or name in (".", ".."):
+                raise ValueError(f"Invalid BM25 index name: {provider}/{collection_name}")
+        return os.path.join(self.root_dir, provider, collection_name)
+
+    def create(self, provider: str, collection_name: str, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        为集合新建 BM25 索引（已存在时覆盖）
+
+        参数:
+            provider: 向量数据库提供商
+            collection_name: 集合名称
+            records: {"text", "metadata"} 列表
+
+        返回:
+            索引规模
+        """
+        with self._write_lock(provider, collection_name):
+            return self._save(provider, collection_name, BM25Index.build(records))
+
+    def replace_document(self, provider: str, collection_name: str, document_name: str,
+                         records: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        替换集合中某个文档的全部记录，集合还没有索引时新建
+
+        参数:
+            provider: 向量数据库提供商
+            collection_name: 集合名称
+            document_name: 文档名称
+            records: 该文档的新记录
+
+        返回:
+            索引规模
+        """
+        with self._write_lock(provider, collection_name):
+            index = self.get(provider, collection_name)
+            if index is None:
+                return self._save(provider, collection_name, BM25Index.build(records))
+            return self._save(provider, collection_name, index.replace_document(document_name, records))
+
+    def _save(self, provider: str, collection_name: str, index: BM25Index) -> Dict[str, Any]:
+        """
+        写入索引文件并替换内存中的缓存（先写入临时目录再替换，调用方需持有集合的写锁）
+        """
+        index_dir = self._index_dir(provider, collection_name)
+        tmp_dir = index_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        np.savez(
+            os.path.join(tmp_dir, "terms.npz"),
+            doc_indptr=index.doc_indptr, doc_terms=index.doc_terms, doc_freqs=index.doc_freqs
+        )
+        with open(os.path.join(tmp_dir, "vocabulary.json"), "w", encoding="utf-8") as f:
+            json.dump(index.vocabulary, f, ensure_ascii=False)
+        with open(os.path.join(tmp_dir, "records.json"), "w", encoding="utf-8") as f:
+            json.dump({"k1": index.k1, "b": index.b, "records": index.records}, f, ensure_ascii=False)
+
+        with self._lock:
+            shutil.rmtree(index_dir, ignore_errors=True)
+            os.replace(tmp_dir, index_dir)
+            self._indexes[(provider, collection_name)] = (self._mtime(index_dir), index)
+        logger.info(f"Saved BM25 index for {provider}/{collection_name}: {index.stats()}")
+        return index.stats()
+
+    def get(self, provider: str, collection_name: str) -> Optional[BM25Index]:
+        """
+        获取集合的 BM25 索引，未加载或文件已更新时从磁盘加载
+
+        参数:
+            provider: 向量数据库提供商
+            collection_name: 集合名称
+
+        返回:
+            BM25Index 实例，集合没有索引时返回 None
+        """
+        index_dir = self._index_dir(provider, collection_name)
+        if not os.path.exists(os.path.join(index_dir, "records.json")):
+            return None
+        mtime = self._mtime(index_dir)
+        with self._lock:
+            cached = self._indexes.get((provider, collection_name))
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+
+        arrays = np.load(os.path.join(index_dir, "terms.npz"))
+        with open(os.path.join(index_dir, "vocabulary.json"), "r", encoding="utf-8") as f:
+            vocabulary = json.load(f)
+        with open(os.path.join(index_dir, "records.json"), "r", encoding="utf-8") as f:
+            stored = json.load(f)
+        index = BM25Index(
+            vocabulary, arrays["doc_indptr"], arrays["doc_terms"], arrays["doc_freqs"],
+            stored["records"], stored["k1"], stored["b"]
+        )
+        with self._lock:
+            self._indexes[(provider, collection_name)] = (mtime, index)
+        logger.info(f"Loaded BM25 index for {provider}/{collection_name}: {index.stats()}")
+        return index
+
+    def delete(self, provider: str, collection_name: str):
+        """
+        删除集合的 BM25 索引（删除集合时调用）
+
+        参数:
+            provider: 向量数据库提供商
+            collection_name: 集合名称
+        """
+        index_dir = self._index_dir(provider, collection_name)
+        with self._write_lock(provider, collection_name):
+            with self._lock:
+                self._indexes.pop((provider, collection_name), None)
+                shutil.rmtree(index_dir, ignore_errors=True)
+
+    @staticmethod
+    def _mtime(index_dir: str) -> float:
+        """以记录文件的修改时间判断索引是否被重写"""
+        return os.path.getmtime(os.path.join(index_dir, "records.json"))
+
+_bm25_store: Optional[BM25Store] = None
+_bm25_store_lock = threading.Lock()
+
+def get_bm25_store() -> BM25Store:
+    """
+    获取进程内共享的 BM25 索引存储，已加载的索引在请求之间复用
+
+    返回:
+        BM25Store 实例
+    """
+    global _bm25_store
+    with _bm25_store_lock:
+        if _bm25_store is None:
+            _bm25_store = BM25Store(BM25_CONFIG["path"])
+        return _bm25_store
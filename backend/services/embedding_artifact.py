@@ -0,0 +1,522 @@
+import os
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import numpy as np
+from services.quantization import calibrate, quantize, dequantize, measure_recall
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，只在进程内互斥
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+"""
+嵌入结果文件（02-embedded-docs）的读写工具
+
+支持两种格式：
+    - json: 旧格式，向量以浮点数列表的形式内联在 JSON 文件的 embeddings[i]["embedding"] 中
+    - npy: 二进制格式，向量以 float32 矩阵保存在同名 .npy 文件中，JSON 文件只作为元数据 sidecar，
+      读取时通过 numpy.memmap 按需映射，避免整体解析和逐元素转换
+npy 格式可以进一步量化为 float16 / int8 存储（sidecar 中的 quantization 字段记录校准参数和召回率影响）。
+量化只保证减少磁盘占用；索引后的内存占用取决于向量库：Milvus 以 FLOAT16_VECTOR 保存 float16，
+本地向量存储直接保存 float16 / int8 编码，int8 在 Milvus 中、以及全部 Chroma 集合仍然是 float32。
+量化时可选地保留一份全精度向量（.f32.npy，会抵消磁盘上的节省），检索时按需映射其中的候选行重排序；
+没有保留时检索跳过重排序。
+"""
+
+FORMAT_JSON = "json"
+FORMAT_NPY = "npy"
+
+def vectors_path_for(json_path: str) -> str:
+    """
+    获取与元数据文件对应的向量文件路径
+
+    参数:
+        json_path: 元数据 JSON 文件路径
+
+    返回:
+        .npy 向量文件路径
+    """
+    return os.path.splitext(json_path)[0] + ".npy"
+
+def full_precision_path_for(json_path: str) -> str:
+    """
+    获取量化结果对应的全精度向量文件路径
+
+    参数:
+        json_path: 元数据 JSON 文件路径
+
+    返回:
+        .f32.npy 向量文件路径
+    """
+    return os.path.splitext(json_path)[0] + ".f32.npy"
+
+def save_embedding_artifact(filepath: str, config_info: Dict[str, Any], embeddings: List[Dict], fmt: str = FORMAT_NPY) -> str:
+    """
+    保存嵌入结果
+
+    参数:
+        filepath: 元数据 JSON 文件路径
+        config_info: 顶层配置信息（文件名、提供商、模型、维度等）
+        embeddings: 嵌入结果列表，每项包含 embedding 和 metadata
+        fmt: 保存格式，npy 或 json
+
+    返回:
+        元数据 JSON 文件路径
+    """
+    if fmt == FORMAT_JSON:
+        _save_json(filepath, config_info, embeddings)
+        return filepath
+
+    vectors_path = vectors_path_for(filepath)
+    matrix = np.asarray([emb["embedding"] for emb in embeddings], dtype=np.float32)
+    np.save(vectors_path, matrix)
+
+    sidecar = {
+        **config_info,
+        "format": FORMAT_NPY,
+        "vectors_file": os.path.basename(vectors_path),
+        "vector_dtype": "float32",
+        "total_vectors": int(matrix.shape[0]),
+        "embeddings": [{"metadata": emb["metadata"]} for emb in embeddings]
+    }
+    with open(filepath, "w", encoding="utf-8") as f:
+        json.dump(sidecar, f, ensure_ascii=False, indent=2, default=_json_default)
+
+    logger.info(f"Saved {matrix.shape[0]} vectors to {vectors_path}")
+    return filepath
+
+def load_embedding_artifact(filepath: str, mmap: bool = True) -> Dict[str, Any]:
+    """
+    加载嵌入结果，兼容旧的 JSON 格式
+
+    参数:
+        filepath: 元数据 JSON 文件路径
+        mmap: 二进制格式下是否使用内存映射读取向量
+
+    返回:
+        包含顶层配置、embeddings（元数据列表）和 vectors（float32 矩阵）的字典；
+        量化结果还包含 quantized_vectors（原始编码），此时 vectors 为按需还原的 DequantizedVectors
+    """
+    with open(filepath, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    if not isinstance(data, dict) or "embeddings" not in data:
+        raise ValueError("Invalid embedding file format: missing 'embeddings' key")
+
+    if data.get("format") == FORMAT_NPY:
+        vectors_path = os.path.join(os.path.dirname(filepath), data["vectors_file"])
+        stored = np.load(vectors_path, mmap_mode="r" if mmap else None)
+        if data.get("quantization"):
+            # 量化存储：保留原始编码，float32 视图只在访问时还原被访问的行
+            data["quantized_vectors"] = stored
+            data["vectors"] = DequantizedVectors(stored, data["quantization"])
+        else:
+            data["vectors"] = stored
+    else:
+        data["vectors"] = np.asarray(
+            [_parse_vector(emb.get("embedding")) for emb in data["embeddings"]],
+            dtype=np.float32
+        )
+
+    if data["vectors"].shape[0] != len(data["embeddings"]):
+        raise ValueError(
+            f"Vector count {data['vectors'].shape[0]} does not match metadata count {len(data['embeddings'])}"
+        )
+    return data
+
+class DequantizedVectors:
+    """
+    量化编码的只读 float32 视图
+
+    按行切片或下标访问时只还原被访问的行，不在内存中保留整份 float32 矩阵；
+    np.asarray 等需要完整矩阵时才整体还原。
+    """
+    def __init__(self, codes: np.ndarray, params: Dict[str, Any]):
+        """
+        参数:
+            codes: 量化编码矩阵（可以是内存映射）
+            params: 量化参数
+        """
+        self.codes = codes
+        self.params = params
+        self.shape = codes.shape
+        self.ndim = codes.ndim
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, key) -> np.ndarray:
+        return dequantize(self.codes[key], self.params)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        vectors = dequantize(self.codes, self.params)
+        return vectors if dtype is None else vectors.astype(dtype, copy=False)
+
+def artifact_files(filepath: str) -> List[str]:
+    """
+    获取一个嵌入结果包含的全部文件（用于删除）
+
+    参数:
+        filepath: 元数据 JSON 文件路径
+
+    返回:
+        存在的文件路径列表
+    """
+    files = [filepath]
+    for path in (vectors_path_for(filepath), full_precision_path_for(filepath)):
+        if os.path.exists(path):
+            files.append(path)
+    return files
+
+def read_artifact_header(filepath: str) -> Dict[str, Any]:
+    """
+    读取嵌入结果的顶层信息（不含逐块元数据和向量）
+
+    参数:
+        filepath: 元数据 JSON 文件路径
+
+    返回:
+        顶层信息字典
+    """
+    with open(filepath, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    data.pop("embeddings", None)
+    return data
+
+def load_full_precision_vectors(filepath: str) -> Optional[np.ndarray]:
+    """
+    以内存映射方式加载用于重排序的全精度向量
+
+    量化结果返回保留的 .f32.npy，未量化的 npy 结果返回其 float32 矩阵。
+    没有比索引更高精度的向量可用时（量化时未保留全精度向量的旧结果）返回 None；
+    旧的 JSON 格式需要整体解析，也返回 None。不会生成还原后的副本。
+
+    参数:
+        filepath: 元数据 JSON 文件路径
+
+    返回:
+        float32 矩阵（内存映射），不可用时返回 None
+    """
+    full_precision_path = full_precision_path_for(filepath)
+    if os.path.exists(full_precision_path):
+        return np.load(full_precision_path, mmap_mode="r")
+    vectors_path = vectors_path_for(filepath)
+    if not os.path.exists(vectors_path):
+        return None
+    vectors = np.load(vectors_path, mmap_mode="r")
+    # 量化后的向量文件是 float16 / int8 编码
+    return vectors if vectors.dtype == np.float32 else None
+
+def apply_quantization(filepath: str, dtype: str, keep_full_precision: bool = False, recall_sample_size: int = 200) -> Dict[str, Any]:
+    """
+    把 npy 格式的嵌入结果量化为 float16 / int8 存储，并测量召回率影响
+
+    参数:
+        filepath: 元数据 JSON 文件路径
+        dtype: 量化类型，float16 或 int8
+        keep_full_precision: 是否把原来的 float32 向量保留为 .f32.npy，供检索时对候选重排序
+            （保留后磁盘占用反而高于量化前）
+        recall_sample_size: 测量召回率时抽样的查询数
+
+    返回:
+        写入 sidecar 的量化信息（包含 recall_at_k 和实际的磁盘占用变化）
+    """
+    with open(filepath, "r", encoding="utf-8") as f:
+        sidecar = json.load(f)
+    if sidecar.get("format") != FORMAT_NPY or sidecar.get("quantization"):
+        raise ValueError(f"Only unquantized npy artifacts can be quantized: {filepath}")
+
+    vectors_path = os.path.join(os.path.dirname(filepath), sidecar["vectors_file"])
+    full = np.load(vectors_path, mmap_mode="r")
+    params = calibrate(full, dtype)
+    recall = measure_recall(full, params, sample_size=recall_sample_size)
+
+    quantized_path = vectors_path + ".tmp.npy"
+    codes = np.lib.format.open_memmap(
+        quantized_path, mode="w+", dtype=np.float16 if dtype == "float16" else np.int8, shape=full.shape
+    )
+    for start in range(0, full.shape[0], 8192):
+        codes[start:start + 8192] = quantize(full[start:start + 8192], params)
+    codes.flush()
+    del codes, full
+
+    float32_bytes = os.path.getsize(vectors_path)
+    if keep_full_precision:
+        os.replace(vectors_path, full_precision_path_for(filepath))
+    else:
+        os.remove(vectors_path)
+    os.replace(quantized_path, vectors_path)
+
+    # 实际的磁盘占用变化（保留全精度向量时 bytes_saved 为负数）
+    quantized_bytes = os.path.getsize(vectors_path)
+    full_precision_bytes = float32_bytes if keep_full_precision else 0
+    storage = {
+        "float32_bytes": float32_bytes,
+        "quantized_bytes": quantized_bytes,
+        "full_precision_bytes": full_precision_bytes,
+        "bytes_saved": float32_bytes - quantized_bytes - full_precision_bytes
+    }
+
+    quantization = {**params, **recall, **storage}
+    sidecar["vector_dtype"] = dtype
+    sidecar["quantization"] = quantization
+    sidecar["full_precision_vectors_file"] = (
+        os.path.basename(full_precision_path_for(filepath)) if keep_full_precision else None
+    )
+    with open(filepath, "w", encoding="utf-8") as f:
+        json.dump(sidecar, f, ensure_ascii=False, indent=2, default=_json_default)
+
+    logger.info(
+        f"Quantized {filepath} to {dtype}, recall@{recall['k']}={recall['recall_at_k']:.4f} "
+        f"over {recall['sample_size']} sampled queries, {storage['bytes_saved']} bytes saved on disk"
+    )
+    return {key: value for key, value in quantization.items() if key not in ("offset", "scale")}
+
+def _parse_vector(embedding) -> List[float]:
+    """
+    解析旧格式中的单个向量，支持列表和字符串两种形式
+    """
+    if embedding is None:
+        raise ValueError("Missing 'embedding' key in vector data")
+    if isinstance(embedding, str):
+        try:
+            return json.loads(embedding)
+        except json.JSONDecodeError:
+            return [float(x) for x in embedding.split()]
+    return embedding
+
+def _json_default(obj):
+    """
+    JSON 序列化回退函数，处理时间和 numpy 标量
+    """
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def _save_json(filepath: str, config_info: Dict[str, Any], embeddings: List[Dict]):
+    """
+    以旧的 JSON 格式保存（向量内联为单行数组）
+    """
+    class CompactJSONEncoder(json.JSONEncoder):
+        """自定义JSON编码器，用于优化嵌入向量的存储格式"""
+        def default(self, obj):
+            if isinstance(obj, datetime):
+                return obj.isoformat()
+            return super().default(obj)
+
+        def encode(self, obj):
+            # 将 embedding 数组转换为单行，其他保持格式化
+            def format_list(lst):
+                if isinstance(lst, list):
+                    # 检查是否为 embedding 数组（通过检查第一个元素是否为数字）
+                    if lst and isinstance(lst[0], (int, float)):
+                        return '[' + ','.join(map(str, lst)) + ']'
+                    return [format_list(item) for item in lst]
+                elif isinstance(lst, dict):
+                    return {k: format_list(v) for k, v in lst.items()}
+                return lst
+
+            return super().encode(format_list(obj))
+
+    # 保存数据，配置信息放在顶层
+    with open(filepath, "w", encoding="utf-8") as f:
+        json.dump({
+            **config_info,  # 配置信息放在顶层
+            "embeddings": embeddings
+        }, f, ensure_ascii=False, indent=2, cls=CompactJSONEncoder)
+
+class EmbeddingJobInProgressError(RuntimeError):
+    """同一个流式嵌入任务已经有一次运行在进行中"""
+
+_active_jobs = set()
+_active_jobs_lock = threading.Lock()
+
+class StreamingArtifactJob:
+    """
+    可断点续传的流式嵌入任务
+
+    每完成一个批次就把向量追加写入原始 float32 文件、把元数据追加写入 JSONL 文件，
+    然后原子地更新 checkpoint.json（记录已完成的块数和两个文件的有效字节数）。
+    任务重启时先把两个文件截断到检查点记录的长度，丢弃中断时写了一半的数据，再从下一个块继续。
+    全部完成后转换为标准的 npy 结果文件并删除任务目录。
+
+    同一任务同时只允许一次运行：open 时获取任务的独占锁（进程内登记 + 任务目录中 .lock 文件的 flock，
+    进程退出时 flock 自动释放，不影响崩溃后的续传），已被占用时抛出 EmbeddingJobInProgressError。
+    """
+    def __init__(self, job_dir: str):
+        """
+        初始化流式任务
+
+        参数:
+            job_dir: 任务目录
+        """
+        self.job_dir = job_dir
+        self.vectors_path = os.path.join(job_dir, "vectors.f32")
+        self.metadata_path = os.path.join(job_dir, "metadata.jsonl")
+        self.checkpoint_path = os.path.join(job_dir, "checkpoint.json")
+        self.lock_path = os.path.join(job_dir, ".lock")
+        self.checkpoint: Dict[str, Any] = {}
+        self._lock_file = None
+        self._locked = False
+
+    def open(self, job_info: Dict[str, Any]) -> int:
+        """
+        打开任务，存在检查点时恢复进度
+
+        参数:
+            job_info: 任务描述信息（文档名、提供商、模型、总块数等），写入检查点
+
+        返回:
+            已完成的块数
+        """
+        os.makedirs(self.job_dir, exist_ok=True)
+        # 先取得独占锁，再截断或清空数据文件
+        self._acquire()
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                self.checkpoint = json.load(f)
+            # 丢弃检查点之后写入的不完整数据
+            for path, size in (
+                (self.vectors_path, self.checkpoint["vectors_bytes"]),
+                (self.metadata_path, self.checkpoint["metadata_bytes"])
+            ):
+                with open(path, "ab") as f:
+                    f.truncate(size)
+            logger.info(
+                f"Resuming embedding job {self.job_dir} from chunk "
+                f"{self.checkpoint['completed_chunks']}/{self.checkpoint['total_chunks']}"
+            )
+        else:
+            for path in (self.vectors_path, self.metadata_path):
+                open(path, "wb").close()
+            self.checkpoint = {
+                **job_info,
+                "completed_chunks": 0,
+                "completed_batches": 0,
+                "vector_dimension": None,
+                "vectors_bytes": 0,
+                "metadata_bytes": 0,
+                "started_at": datetime.now().isoformat()
+            }
+            self._write_checkpoint()
+        return self.checkpoint["completed_chunks"]
+
+    def append(self, vectors: List[List[float]], metadatas: List[Dict]):
+        """
+        追加一个已完成的批次并更新检查点
+
+        参数:
+            vectors: 批次向量
+            metadatas: 与向量对应的元数据
+        """
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if self.checkpoint["vector_dimension"] is None:
+            self.checkpoint["vector_dimension"] = int(matrix.shape[1])
+
+        with open(self.vectors_path, "ab") as f:
+            f.write(matrix.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+            self.checkpoint["vectors_bytes"] = f.tell()
+        with open(self.metadata_path, "ab") as f:
+            for metadata in metadatas:
+                f.write((json.dumps(metadata, ensure_ascii=False, default=_json_default) + "\n").encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+            self.checkpoint["metadata_bytes"] = f.tell()
+
+        self.checkpoint["completed_chunks"] += len(metadatas)
+        self.checkpoint["completed_batches"] += 1
+        self._write_checkpoint()
+
+    def finalize(self, filepath: str, config_info: Dict[str, Any]) -> str:
+        """
+        把任务数据转换为标准的 npy 结果文件，并删除任务目录
+
+        参数:
+            filepath: 元数据 JSON 文件路径
+            config_info: 顶层配置信息
+
+        返回:
+            元数据 JSON 文件路径
+        """
+        dimension = self.checkpoint["vector_dimension"]
+        total = self.checkpoint["completed_chunks"]
+        raw = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(total, dimension))
+        vectors_path = vectors_path_for(filepath)
+        matrix = np.lib.format.open_memmap(vectors_path, mode="w+", dtype=np.float32, shape=(total, dimension))
+        # 分块复制，避免一次性载入内存
+        for start in range(0, total, 4096):
+            matrix[start:start + 4096] = raw[start:start + 4096]
+        matrix.flush()
+        del matrix, raw
+
+        with open(self.metadata_path, "r", encoding="utf-8") as f:
+            metadatas = [json.loads(line) for line in f if line.strip()]
+
+        sidecar = {
+            **config_info,
+            "format": FORMAT_NPY,
+            "vectors_file": os.path.basename(vectors_path),
+            "vector_dtype": "float32",
+            "total_vectors": total,
+            "embeddings": [{"metadata": metadata} for metadata in metadatas]
+        }
+        with open(filepath, "w", encoding="utf-8") as f:
+            json.dump(sidecar, f, ensure_ascii=False, indent=2, default=_json_default)
+
+        for path in (self.vectors_path, self.metadata_path, self.checkpoint_path, self.lock_path):
+            if os.path.exists(path):
+                os.remove(path)
+        os.rmdir(self.job_dir)
+        self.release()
+        logger.info(f"Finalized streamed embeddings ({total} vectors) to {filepath}")
+        return filepath
+
+    def _acquire(self):
+        """获取任务的独占锁，任务已在运行时抛出 EmbeddingJobInProgressError"""
+        job_key = os.path.abspath(self.job_dir)
+        with _active_jobs_lock:
+            if job_key in _active_jobs:
+                raise EmbeddingJobInProgressError(f"Embedding job {self.job_dir} is already running")
+            _active_jobs.add(job_key)
+        self._locked = True
+        if fcntl is None:
+            return
+        # 其他进程（多个 worker）中的运行通过文件锁互斥
+        lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            self.release()
+            raise EmbeddingJobInProgressError(f"Embedding job {self.job_dir} is already running in another process")
+        self._lock_file = lock_file
+
+    def release(self):
+        """释放任务的独占锁（可重复调用）"""
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        if self._locked:
+            with _active_jobs_lock:
+                _active_jobs.discard(os.path.abspath(self.job_dir))
+            self._locked = False
+
+    def _write_checkpoint(self):
+        """原子地写入检查点"""
+        self.checkpoint["updated_at"] = datetime.now().isoformat()
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.checkpoint, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
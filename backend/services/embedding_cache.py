@@ -0,0 +1,332 @@
+import os
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+from utils.config import EMBEDDING_CACHE_CONFIG, QUERY_EMBEDDING_CACHE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def normalize_text(text: str) -> str:
+    """
+    规范化文本，用于内容寻址
+
+    参数:
+        text: 原始文本
+
+    返回:
+        经过 NFC 规范化、去除首尾空白并合并连续空白后的文本
+    """
+    text = unicodedata.normalize("NFC", text or "")
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+def content_hash(text: str) -> str:
+    """
+    计算规范化文本的 SHA-256 哈希
+
+    参数:
+        text: 原始文本
+
+    返回:
+        十六进制哈希字符串
+    """
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """
+    持久化的嵌入向量缓存，使用 SQLite 存储
+
+    缓存键为 (provider, model_name, 规范化文本哈希)，超过容量上限时按最近访问时间进行 LRU 淘汰。
+    同一进程内的多个请求共享一个实例，通过锁保证线程安全。
+    """
+    def __init__(self, path: str, max_entries: int):
+        """
+        初始化嵌入缓存
+
+        参数:
+            path: SQLite 数据库文件路径
+            max_entries: 最大缓存条目数
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                provider TEXT NOT NULL,
+                model_name TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                dimension INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (provider, model_name, text_hash)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+        self._conn.commit()
+
+    def get_many(self, provider: str, model_name: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """
+        批量查询缓存
+
+        参数:
+            provider: 嵌入提供商
+            model_name: 嵌入模型名称
+            texts: 文本列表
+
+        返回:
+            与 texts 等长的列表，命中位置为向量，未命中位置为 None
+        """
+        provider = getattr(provider, "value", provider)
+        hashes = [content_hash(text) for text in texts]
+        found: Dict[str, List[float]] = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+        now = time.time()
+
+        with self._lock:
+            # SQLite 对单条语句的参数数量有限制，分段查询
+            for i in range(0, len(unique_hashes), 500):
+                part = unique_hashes[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings "
+                    f"WHERE provider = ? AND model_name = ? AND text_hash IN ({placeholders})",
+                    [provider, model_name, *part]
+                ).fetchall()
+                for text_hash, blob in rows:
+                    vector = array("d")
+                    vector.frombytes(blob)
+                    found[text_hash] = vector.tolist()
+
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE provider = ? AND model_name = ? AND text_hash = ?",
+                    [(now, provider, model_name, text_hash) for text_hash in found]
+                )
+                self._conn.commit()
+
+            results = [found.get(text_hash) for text_hash in hashes]
+            hit_count = sum(1 for vector in results if vector is not None)
+            self.hits += hit_count
+            self.misses += len(results) - hit_count
+
+        return results
+
+    def put_many(self, provider: str, model_name: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        """
+        批量写入缓存，写入后按容量上限执行 LRU 淘汰
+
+        参数:
+            provider: 嵌入提供商
+            model_name: 嵌入模型名称
+            texts: 文本列表
+            vectors: 与 texts 对应的嵌入向量列表
+        """
+        provider = getattr(provider, "value", provider)
+        now = time.time()
+        rows = [
+            (provider, model_name, content_hash(text), len(vector), array("d", vector).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        if not rows:
+            return
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings "
+                "(provider, model_name, text_hash, dimension, vector, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """
+        删除最久未访问的条目，使缓存条目数不超过上限（调用方需持有锁）
+        """
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN "
+            "(SELECT rowid FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+            (overflow,)
+        )
+        self.evictions += overflow
+        logger.info(f"Evicted {overflow} entries from embedding cache")
+
+    def stats(self) -> Dict[str, float]:
+        """
+        获取缓存统计信息
+
+        返回:
+            包含条目数、命中数、未命中数、淘汰数和命中率的字典
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0
+            }
+
+    def clear(self):
+        """清空缓存并重置计数器"""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+_embedding_cache: Optional[EmbeddingCache] = None
+_embedding_cache_lock = threading.Lock()
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """
+    获取进程内共享的嵌入缓存实例
+
+    返回:
+        EmbeddingCache 实例，缓存被禁用时返回 None
+    """
+    global _embedding_cache
+    if not EMBEDDING_CACHE_CONFIG.get("enabled", True):
+        return None
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache(
+                path=EMBEDDING_CACHE_CONFIG["path"],
+                max_entries=EMBEDDING_CACHE_CONFIG["max_entries"]
+            )
+        return _embedding_cache
+
+class QueryEmbeddingCache:
+    """
+    查询向量的内存缓存（TTL + LRU）
+
+    检索时同一个查询会被反复提交，查询向量只在内存中缓存，不写入 SQLite。
+    以 (provider, model_name, 规范化后的查询文本) 为键，条目超过 TTL 后失效，超过容量时淘汰最久未使用的条目。
+    """
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        """
+        初始化缓存
+
+        参数:
+            max_entries: 最大条目数
+            ttl_seconds: 条目有效期（秒）
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(provider, model_name: str, query: str) -> tuple:
+        """生成缓存键"""
+        return getattr(provider, "value", provider), model_name, normalize_text(query)
+
+    def get(self, provider, model_name: str, query: str) -> Optional[List[float]]:
+        """
+        查询缓存
+
+        参数:
+            provider: 嵌入提供商
+            model_name: 嵌入模型名称
+            query: 查询文本
+
+        返回:
+            查询向量，未命中或已过期时返回 None
+        """
+        key = self._key(provider, model_name, query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[1] > self.ttl_seconds:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, provider, model_name: str, query: str, vector: List[float]):
+        """
+        写入缓存
+
+        参数:
+            provider: 嵌入提供商
+            model_name: 嵌入模型名称
+            query: 查询文本
+            vector: 查询向量
+        """
+        key = self._key(provider, model_name, query)
+        with self._lock:
+            self._entries[key] = (vector, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict:
+        """
+        获取缓存统计信息
+
+        返回:
+            包含条目数和命中计数的字典
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+_query_embedding_cache: Optional[QueryEmbeddingCache] = None
+_query_embedding_cache_lock = threading.Lock()
+
+def get_query_embedding_cache() -> Optional[QueryEmbeddingCache]:
+    """
+    获取进程内共享的查询向量缓存
+
+    返回:
+        QueryEmbeddingCache 实例，缓存被禁用时返回 None
+    """
+    global _query_embedding_cache
+    if not QUERY_EMBEDDING_CACHE_CONFIG.get("enabled", True):
+        return None
+    with _query_embedding_cache_lock:
+        if _query_embedding_cache is None:
+            _query_embedding_cache = QueryEmbeddingCache(
+                max_entries=QUERY_EMBEDDING_CACHE_CONFIG["max_entries"],
+                ttl_seconds=QUERY_EMBEDDING_CACHE_CONFIG["ttl_seconds"]
+            )
+        return _query_embedding_cache
@@ -0,0 +1,164 @@
+import os
+import json
+import logging
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+from utils.config import EMBEDDING_MANIFEST_CONFIG
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingManifest:
+    """
+    嵌入结果清单，使用 SQLite 记录 02-embedded-docs 中每个嵌入结果的摘要信息
+
+    save_embeddings 写入结果后登记一条记录，按文件名查询嵌入配置时直接走索引，
+    不需要逐个打开并解析嵌入结果文件。清单中缺失的旧文件会在 sync 时补登记。
+    """
+    def __init__(self, path: str, embedded_docs_dir: str):
+        """
+        初始化清单
+
+        参数:
+            path: SQLite 数据库文件路径
+            embedded_docs_dir: 嵌入结果目录
+        """
+        self.path = path
+        self.embedded_docs_dir = embedded_docs_dir
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embedded_docs (
+                artifact_file TEXT PRIMARY KEY,
+                filename TEXT,
+                chunked_doc_name TEXT,
+                embedding_provider TEXT,
+                embedding_model TEXT,
+                vector_dimension INTEGER,
+                chunk_count INTEGER,
+                created_at TEXT
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embedded_docs_filename ON embedded_docs(filename)")
+        self._conn.commit()
+
+    def record(self, artifact_file: str, info: Dict[str, Any], chunk_count: int):
+        """
+        登记或更新一个嵌入结果
+
+        参数:
+            artifact_file: 嵌入结果文件名（不含目录）
+            info: 顶层配置信息（filename、chunked_doc_name、embedding_provider 等）
+            chunk_count: 文本块数量
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embedded_docs "
+                "(artifact_file, filename, chunked_doc_name, embedding_provider, embedding_model, "
+                "vector_dimension, chunk_count, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    artifact_file,
+                    info.get("filename"),
+                    info.get("chunked_doc_name"),
+                    info.get("embedding_provider"),
+                    info.get("embedding_model"),
+                    info.get("vector_dimension"),
+                    chunk_count,
+                    info.get("created_at")
+                )
+            )
+            self._conn.commit()
+
+    def remove(self, artifact_file: str):
+        """
+        删除一个嵌入结果的登记
+
+        参数:
+            artifact_file: 嵌入结果文件名（不含目录）
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM embedded_docs WHERE artifact_file = ?", (artifact_file,))
+            self._conn.commit()
+
+    def find_by_filename(self, filename: str) -> Optional[Dict[str, Any]]:
+        """
+        按原始文件名查询最新的嵌入结果
+
+        参数:
+            filename: 原始文件名
+
+        返回:
+            清单记录字典，找不到时返回 None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM embedded_docs WHERE filename = ? ORDER BY created_at DESC LIMIT 1",
+                (filename,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def list_all(self) -> List[Dict[str, Any]]:
+        """
+        列出全部嵌入结果
+
+        返回:
+            清单记录列表
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM embedded_docs ORDER BY created_at DESC").fetchall()
+        return [dict(row) for row in rows]
+
+    def sync(self) -> int:
+        """
+        与目录内容同步：补登记清单中缺失的嵌入结果，删除文件已不存在的记录
+
+        返回:
+            补登记的文件数
+        """
+        if not os.path.exists(self.embedded_docs_dir):
+            return 0
+        on_disk = {name for name in os.listdir(self.embedded_docs_dir) if name.endswith(".json")}
+        with self._lock:
+            known = {row[0] for row in self._conn.execute("SELECT artifact_file FROM embedded_docs")}
+            stale = known - on_disk
+            if stale:
+                self._conn.executemany("DELETE FROM embedded_docs WHERE artifact_file = ?", [(name,) for name in stale])
+                self._conn.commit()
+
+        added = 0
+        for name in sorted(on_disk - known):
+            try:
+                with open(os.path.join(self.embedded_docs_dir, name), "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.record(name, data, len(data.get("embeddings", [])))
+                added += 1
+            except Exception as e:
+                logger.error(f"Error adding {name} to embedding manifest: {str(e)}")
+        if added or stale:
+            logger.info(f"Embedding manifest synced: {added} added, {len(stale)} removed")
+        return added
+
+_manifest: Optional[EmbeddingManifest] = None
+_manifest_lock = threading.Lock()
+
+def get_embedding_manifest() -> EmbeddingManifest:
+    """
+    获取进程内共享的嵌入结果清单，首次创建时与目录同步一次
+
+    返回:
+        EmbeddingManifest 实例
+    """
+    global _manifest
+    with _manifest_lock:
+        if _manifest is None:
+            _manifest = EmbeddingManifest(
+                path=EMBEDDING_MANIFEST_CONFIG["path"],
+                embedded_docs_dir=EMBEDDING_MANIFEST_CONFIG["embedded_docs_dir"]
+            )
+            _manifest.sync()
+        return _manifest
@@ -0,0 +1,193 @@
+import os
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+from utils.config import EMBEDDING_PROCESS_POOL_CONFIG
+
+logger = logging.getLogger(__name__)
+
+"""
+本地嵌入模型的多进程执行器
+
+CPU 上的 HuggingFace 模型在单个进程内只能用到部分核心。进程池中的每个工作进程在启动时加载一次模型，
+并限制自身的 torch 线程数，批次分发到各个工作进程并行计算，结果按批次顺序合并。
+工作进程使用 spawn 方式启动，避免 fork 继承父进程中已初始化的 torch 线程池。
+"""
+
+# 工作进程内的嵌入函数，由 _init_worker 在进程启动时创建
+_worker_embedding = None
+
+def _init_worker(provider: str, model_name: str, torch_threads: int):
+    """
+    工作进程初始化：限制线程数并加载模型
+
+    参数:
+        provider: 嵌入提供商
+        model_name: 嵌入模型名称
+        torch_threads: 每个工作进程的 torch 线程数
+    """
+    global _worker_embedding
+    # 必须在导入 torch 之前设置，才能约束底层 OpenMP / MKL 线程池
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[name] = str(torch_threads)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    import torch
+    torch.set_num_threads(torch_threads)
+
+    # 延迟导入，避免与 embedding_service 循环导入
+    from services.embedding_service import EmbeddingConfig, EmbeddingFactory
+    _worker_embedding = EmbeddingFactory.create_embedding_function(
+        EmbeddingConfig(provider=provider, model_name=model_name)
+    )
+    logger.info(f"Embedding worker {os.getpid()} loaded {provider}/{model_name} with {torch_threads} threads")
+
+def _embed_batch(texts: List[str]) -> List[List[float]]:
+    """
+    在工作进程内嵌入一个批次
+
+    参数:
+        texts: 文本列表
+
+    返回:
+        向量列表
+    """
+    return _worker_embedding.embed_documents(texts)
+
+class EmbeddingProcessPool:
+    """
+    单个模型的嵌入进程池
+    """
+    def __init__(self, provider: str, model_name: str, workers: int, torch_threads: int):
+        """
+        初始化进程池（工作进程在首次提交任务时启动）
+
+        参数:
+            provider: 嵌入提供商
+            model_name: 嵌入模型名称
+            workers: 工作进程数
+            torch_threads: 每个工作进程的 torch 线程数
+        """
+        self.provider = provider
+        self.model_name = model_name
+        self.workers = workers
+        self.torch_threads = torch_threads
+        self.batches = 0
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(provider, model_name, torch_threads)
+        )
+
+    def run(self, batches: List[List[str]]) -> List[List[List[float]]]:
+        """
+        把批次分发到工作进程并行嵌入
+
+        参数:
+            batches: 文本批次列表
+
+        返回:
+            与 batches 一一对应的向量批次列表
+        """
+        # executor.map 按提交顺序返回结果
+        results = list(self._executor.map(_embed_batch, batches))
+        self.batches += len(batches)
+        return results
+
+    def shutdown(self):
+        """等待进行中的批次完成后关闭工作进程，未开始的批次直接取消"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self) -> Dict:
+        """
+        获取进程池状态
+
+        返回:
+            状态字典
+        """
+        return {
+            "provider": self.provider,
+            "model_name": self.model_name,
+            "workers": self.workers,
+            "torch_threads": self.torch_threads,
+            "batches": self.batches
+        }
+
+_pools: Dict[tuple, EmbeddingProcessPool] = {}
+_pools_lock = threading.Lock()
+
+def _pool_size() -> tuple:
+    """
+    根据配置计算工作进程数和每个进程的 torch 线程数
+
+    返回:
+        (workers, torch_threads)
+    """
+    cpu_count = os.cpu_count() or 1
+    workers = EMBEDDING_PROCESS_POOL_CONFIG["workers"] or cpu_count
+    torch_threads = EMBEDDING_PROCESS_POOL_CONFIG["torch_threads_per_worker"] or max(1, cpu_count // workers)
+    return workers, torch_threads
+
+def get_embedding_pool(provider: str, model_name: str) -> Optional[EmbeddingProcessPool]:
+    """
+    获取模型对应的共享进程池
+
+    参数:
+        provider: 嵌入提供商
+        model_name: 嵌入模型名称
+
+    返回:
+        EmbeddingProcessPool 实例；未启用或提供商不使用进程池时返回 None
+    """
+    provider = getattr(provider, "value", provider)
+    if not EMBEDDING_PROCESS_POOL_CONFIG["enabled"] or provider not in EMBEDDING_PROCESS_POOL_CONFIG["providers"]:
+        return None
+    key = (provider, model_name)
+    with _pools_lock:
+        if key not in _pools:
+            workers, torch_threads = _pool_size()
+            _pools[key] = EmbeddingProcessPool(provider, model_name, workers, torch_threads)
+            logger.info(f"Created embedding process pool for {provider}/{model_name}: {workers} workers x {torch_threads} threads")
+        return _pools[key]
+
+def run_in_pool(pool: EmbeddingProcessPool, batches: List[List[str]]) -> List[List[List[float]]]:
+    """
+    在进程池中执行批次；工作进程异常退出时丢弃该进程池，下次调用重新创建
+
+    参数:
+        pool: 进程池
+        batches: 文本批次列表
+
+    返回:
+        与 batches 一一对应的向量批次列表
+    """
+    try:
+        return pool.run(batches)
+    except BrokenProcessPool:
+        with _pools_lock:
+            if _pools.get((pool.provider, pool.model_name)) is pool:
+                del _pools[(pool.provider, pool.model_name)]
+        pool.shutdown()
+        raise
+
+def shutdown_embedding_pools():
+    """关闭全部嵌入进程池，在应用退出时调用"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown()
+        logger.info(f"Shut down embedding process pool for {pool.provider}/{pool.model_name}")
+
+def embedding_pool_stats() -> List[Dict]:
+    """
+    获取全部进程池的状态
+
+    返回:
+        状态字典列表
+    """
+    with _pools_lock:
+        return [pool.stats() for pool in _pools.values()]
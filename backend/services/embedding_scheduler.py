@@ -0,0 +1,217 @@
+import logging
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+from utils.config import REMOTE_EMBEDDING_CONFIG
+
+logger = logging.getLogger(__name__)
+
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]")
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的令牌数：中日韩字符按每字一个令牌，其余字符按每4个字符一个令牌
+
+    参数:
+        text: 文本
+
+    返回:
+        估算的令牌数
+    """
+    text = text or ""
+    cjk_chars = len(_CJK_RE.findall(text))
+    return max(1, cjk_chars + (len(text) - cjk_chars + 3) // 4)
+
+class RateLimiter:
+    """
+    基于令牌桶的限流器，同时限制每分钟请求数和每分钟令牌数
+
+    同一提供商的所有请求共享一个实例，因此并发的 /embed 请求也会一起受限。
+    """
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        """
+        初始化限流器
+
+        参数:
+            requests_per_minute: 每分钟请求数上限
+            tokens_per_minute: 每分钟令牌数上限
+        """
+        self.request_capacity = float(requests_per_minute)
+        self.token_capacity = float(tokens_per_minute)
+        self._requests = self.request_capacity
+        self._tokens = self.token_capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        """按流逝时间补充令牌（调用方需持有锁）"""
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.request_capacity, self._requests + elapsed * self.request_capacity / 60.0)
+        self._tokens = min(self.token_capacity, self._tokens + elapsed * self.token_capacity / 60.0)
+
+    def acquire(self, requests: int = 1, tokens: int = 0):
+        """
+        阻塞直到额度足够，然后扣除额度
+
+        参数:
+            requests: 本次消耗的请求数
+            tokens: 本次消耗的令牌数
+        """
+        # 单次消耗超过桶容量时按满桶处理，避免永久等待
+        requests = min(float(requests), self.request_capacity)
+        tokens = min(float(tokens), self.token_capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._requests >= requests and self._tokens >= tokens:
+                    self._requests -= requests
+                    self._tokens -= tokens
+                    return
+                wait = max(
+                    (requests - self._requests) * 60.0 / self.request_capacity,
+                    (tokens - self._tokens) * 60.0 / self.token_capacity,
+                    0.01
+                )
+            time.sleep(wait)
+
+_TRANSIENT_ERROR_NAMES = {"APIConnectionError", "APITimeoutError", "ConnectionError", "Timeout", "ReadTimeout"}
+
+_rate_limiters: Dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(provider: str) -> RateLimiter:
+    """
+    获取提供商对应的进程内共享限流器
+
+    参数:
+        provider: 嵌入提供商
+
+    返回:
+        RateLimiter 实例
+    """
+    with _rate_limiters_lock:
+        if provider not in _rate_limiters:
+            provider_config = REMOTE_EMBEDDING_CONFIG[provider]
+            _rate_limiters[provider] = RateLimiter(
+                provider_config["requests_per_minute"],
+                provider_config["tokens_per_minute"]
+            )
+        return _rate_limiters[provider]
+
+def is_retryable_error(error: Exception) -> bool:
+    """
+    判断异常是否为可重试的限流或临时错误（HTTP 429 / 5xx / Bedrock Throttling / 连接超时）
+
+    参数:
+        error: 异常对象
+
+    返回:
+        是否可重试
+    """
+    if type(error).__name__ in _TRANSIENT_ERROR_NAMES:
+        return True
+    status_code = getattr(error, "status_code", None)
+    response = getattr(error, "response", None)
+    if status_code is None and response is not None:
+        status_code = getattr(response, "status_code", None)
+        if status_code is None and isinstance(response, dict):
+            # botocore ClientError
+            status_code = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+            if response.get("Error", {}).get("Code") in ("ThrottlingException", "TooManyRequestsException"):
+                return True
+    if isinstance(status_code, int):
+        return status_code == 429 or status_code >= 500
+
+    message = str(error).lower()
+    return "429" in message or "rate limit" in message or "throttl" in message
+
+class RemoteBatchScheduler:
+    """
+    远程嵌入批次调度器
+
+    使用线程池让多个批次请求同时在途，每个请求发出前先向提供商共享的限流器申请额度，
+    遇到限流（429）时按带抖动的指数退避重试，最后按批次顺序返回结果。
+    embed_fn 可以是任意 "文本列表 -> 向量列表" 的函数，因此可以直接对接本地的桩 HTTP 嵌入服务进行测试
+    （例如将 OPENAI_API_BASE 指向桩服务）。
+    """
+    def __init__(self, provider: str):
+        """
+        初始化调度器
+
+        参数:
+            provider: 远程嵌入提供商（openai 或 bedrock）
+        """
+        provider_config = REMOTE_EMBEDDING_CONFIG[provider]
+        self.provider = provider
+        self.max_in_flight = provider_config["max_in_flight"]
+        self.one_request_per_text = provider_config.get("one_request_per_text", False)
+        self.max_retries = REMOTE_EMBEDDING_CONFIG["max_retries"]
+        self.backoff_base = REMOTE_EMBEDDING_CONFIG["backoff_base_seconds"]
+        self.backoff_max = REMOTE_EMBEDDING_CONFIG["backoff_max_seconds"]
+        self.rate_limiter = get_rate_limiter(provider)
+        self.retries = 0
+
+    def run(self, batches: List[List[str]], embed_fn: Callable[[List[str]], List[List[float]]]) -> List[List[List[float]]]:
+        """
+        并发执行全部批次
+
+        参数:
+            batches: 文本批次列表
+            embed_fn: 批量嵌入函数
+
+        返回:
+            与 batches 一一对应的向量批次列表
+        """
+        if not batches:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_in_flight, len(batches))) as executor:
+            futures = [executor.submit(self._run_batch, batch, embed_fn) for batch in batches]
+            # 按提交顺序取结果，保证与批次顺序一致；任一批次失败时异常向上抛出
+            return [future.result() for future in futures]
+
+    def _run_batch(self, texts: List[str], embed_fn: Callable) -> List[List[float]]:
+        """
+        执行单个批次，带限流和重试
+
+        参数:
+            texts: 批次文本
+            embed_fn: 批量嵌入函数
+
+        返回:
+            向量列表
+        """
+        requests = len(texts) if self.one_request_per_text else 1
+        tokens = sum(estimate_tokens(text) for text in texts)
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(requests=requests, tokens=tokens)
+            try:
+                return embed_fn(texts)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable_error(e):
+                    raise
+                delay = self._backoff_delay(attempt)
+                attempt += 1
+                self.retries += 1
+                logger.warning(
+                    f"{self.provider} embedding request failed ({str(e)}), "
+                    f"retry {attempt}/{self.max_retries} in {delay:.2f}s"
+                )
+                time.sleep(delay)
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """
+        计算带完全抖动（full jitter）的指数退避时间
+
+        参数:
+            attempt: 已重试次数
+
+        返回:
+            等待秒数
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
@@ -1,12 +1,29 @@
 import os
 import dotenv
 dotenv.load_dotenv()
-import json
+import gc
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
 from datetime import datetime
 from enum import Enum
 import boto3
 from langchain_community.embeddings import BedrockEmbeddings, OpenAIEmbeddings
 from langchain_community.embeddings.huggingface import HuggingFaceEmbeddings
+from services.embedding_cache import get_embedding_cache, get_query_embedding_cache, content_hash
+from services.embedding_artifact import save_embedding_artifact, apply_quantization, StreamingArtifactJob
+from services.embedding_scheduler import RemoteBatchScheduler
+from services.embedding_manifest import get_embedding_manifest
+from services.embedding_pool import EmbeddingProcessPool, get_embedding_pool, run_in_pool
+from utils.config import (
+    EMBEDDING_MODEL_REGISTRY_CONFIG,
+    EMBEDDING_BATCH_CONFIG,
+    EMBEDDING_ARTIFACT_CONFIG,
+    EMBEDDING_STREAM_CONFIG
+)
+
+logger = logging.getLogger(__name__)
 
 class EmbeddingProvider(str, Enum):
     """
@@ -32,13 +49,51 @@ class EmbeddingConfig:
         self.model_name = model_name
         self.aws_region = "ap-southeast-1"  # 可配置
 
+    def key(self) -> tuple:
+        """
+        获取用于模型注册表和缓存的配置键
+        
+        返回:
+            (provider, model_name, aws_region) 元组
+        """
+        return (getattr(self.provider, "value", self.provider), self.model_name, self.aws_region)
+
+def plan_batches(texts: list, max_batch_size: int, max_batch_chars: int = None) -> list:
+    """
+    按文本长度排序并划分批次
+    
+    参数:
+        texts: 文本列表
+        max_batch_size: 单批最多文本数
+        max_batch_chars: 自适应批次的字符预算（批内文本数 x 批内最长文本长度），为None时只按数量分批
+        
+    返回:
+        批次列表，每个批次为原始文本下标的列表
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i] or ""))
+    batches = []
+    current = []
+    for i in order:
+        # 已按长度升序排列，当前文本就是加入后批内最长的文本
+        padded_chars = (len(current) + 1) * max(len(texts[i] or ""), 1)
+        if current and (
+            len(current) >= max_batch_size
+            or (max_batch_chars is not None and padded_chars > max_batch_chars)
+        ):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
 class EmbeddingService:
     """
     嵌入服务类，提供创建和管理文本嵌入的功能
     """
     def __init__(self):
-        """初始化嵌入服务，创建嵌入工厂实例"""
-        self.embedding_factory = EmbeddingFactory()
+        """初始化嵌入服务，使用进程内共享的模型注册表"""
+        self.model_registry = get_embedding_model_registry()
 
     def create_embeddings(self, input_data: dict, config: EmbeddingConfig) -> tuple:
         """
@@ -49,93 +104,273 @@ class EmbeddingService:
             config: 嵌入配置对象
             
         返回:
-            包含嵌入结果和元数据的元组
+            包含嵌入结果和统计信息（去重数量、缓存命中情况）的元组
         """
-        embedding_function = self.embedding_factory.create_embedding_function(config)
-        
         chunks = input_data.get('chunks', [])
         filename = input_data.get('metadata', {}).get('filename', '')  # 获取文件名
         
-        # 批处理大小
-        BATCH_SIZE = 20
-        results = []
-        
-        # 如果是OpenAI，使用批处理
-        if config.provider == EmbeddingProvider.OPENAI:
-            for i in range(0, len(chunks), BATCH_SIZE):
-                batch = chunks[i:i + BATCH_SIZE]
-                # 提取当前批次的文本内容
-                texts = [chunk.get("content", "") for chunk in batch]
-                
-                # 批量获取embeddings
-                embedding_vectors = embedding_function.embed_documents(texts)
-                
-                # 将结果与原始chunk数据组合
-                for chunk, embedding_vector in zip(batch, embedding_vectors):
-                    metadata = {
-                        "chunk_id": chunk["metadata"]["chunk_id"],
-                        "page_number": chunk["metadata"]["page_number"],
-                        "page_range": chunk["metadata"]["page_range"],
-                        "content": chunk["content"],
-                        "word_count": chunk["metadata"]["word_count"],
-                        # "chunking_method": input_data.get("chunking_method", "loaded"),
-                        "total_chunks": len(chunks),
-                        "embedding_provider": config.provider,
-                        "embedding_model": config.model_name,
-                        "embedding_timestamp": datetime.now().isoformat(),
-                        "vector_dimension": len(embedding_vector),
-                        "filename": filename  # 添加文件名到metadata
-                    }
-                    
-                    embedding_result = {
-                        "embedding": embedding_vector,
-                        "metadata": metadata
-                    }
-                    results.append(embedding_result)
+        texts = [chunk.get("content", "") for chunk in chunks]
+        vectors, stats = self._embed_texts(texts, config)
+        
+        results = [
+            {
+                "embedding": embedding_vector,
+                "metadata": self._build_metadata(chunk, embedding_vector, config, len(chunks), filename)
+            }
+            for chunk, embedding_vector in zip(chunks, vectors)
+        ]
+        
+        # 返回结果和统计信息（metadata已经包含在每个embedding中）
+        return results, stats
+
+    def create_embeddings_streaming(self, doc_name: str, input_data: dict, config: EmbeddingConfig, quantization: str = None,
+                                    keep_full_precision: bool = None) -> tuple:
+        """
+        以流式、可断点续传的方式创建嵌入并直接写入结果文件
+        
+        每完成一个批次就写入磁盘并记录检查点，内存中只保留当前批次的向量。任务ID由文档名、嵌入配置和
+        所有文本块内容决定，因此同样的请求在失败后重新提交时会从最后完成的批次继续。
+        
+        参数:
+            doc_name: 文档名称
+            input_data: 包含文本块和元数据的输入数据字典
+            config: 嵌入配置对象
+            quantization: 量化类型（float16 / int8），为None时使用配置中的默认值
+            keep_full_precision: 量化时是否保留全精度向量，为None时使用配置中的默认值
+            
+        返回:
+            (保存的元数据文件路径, 统计信息字典)
+        """
+        chunks = input_data.get('chunks', [])
+        filename = input_data.get('metadata', {}).get('filename', '')
+        if not chunks:
+            raise ValueError("No chunks to embed")
+        
+        provider = getattr(config.provider, "value", config.provider)
+        job_hash = hashlib.sha256()
+        for part in (doc_name, provider, config.model_name):
+            job_hash.update(part.encode("utf-8") + b"\0")
+        for chunk in chunks:
+            job_hash.update(content_hash(chunk.get("content", "")).encode("ascii"))
+        job = StreamingArtifactJob(os.path.join(EMBEDDING_STREAM_CONFIG["jobs_dir"], job_hash.hexdigest()[:16]))
+        
+        stats = {"deduplicated_chunks": 0, "cache_hits": 0, "cache_misses": 0}
+        batch_chunks = EMBEDDING_STREAM_CONFIG["chunks_per_batch"]
+        
+        try:
+            # 同一任务已在运行时（例如客户端在第一次运行结束前重试）抛出 EmbeddingJobInProgressError
+            completed = job.open({
+                "doc_name": doc_name,
+                "embedding_provider": provider,
+                "embedding_model": config.model_name,
+                "total_chunks": len(chunks)
+            })
+            resumed_from = completed
+            for start in range(completed, len(chunks), batch_chunks):
+                batch = chunks[start:start + batch_chunks]
+                vectors, batch_stats = self._embed_texts([chunk.get("content", "") for chunk in batch], config)
+                job.append(
+                    vectors,
+                    [self._build_metadata(chunk, vector, config, len(chunks), filename) for chunk, vector in zip(batch, vectors)]
+                )
+                for key in stats:
+                    stats[key] += batch_stats[key]
+                logger.info(f"Streamed embeddings {start + len(batch)}/{len(chunks)} for {doc_name}")
+            
+            filepath, config_info = self._artifact_target(doc_name, provider, config.model_name, job.checkpoint["vector_dimension"])
+            job.finalize(filepath, config_info)
+        finally:
+            job.release()
+        self._quantize_artifact(filepath, quantization, keep_full_precision)
+        get_embedding_manifest().record(os.path.basename(filepath), config_info, len(chunks))
+        stats["resumed_from_chunk"] = resumed_from
+        return filepath, stats
+
+    def _build_metadata(self, chunk: dict, embedding_vector: list, config: EmbeddingConfig, total_chunks: int, filename: str) -> dict:
+        """
+        构建单个文本块的嵌入元数据
+        
+        参数:
+            chunk: 文本块
+            embedding_vector: 嵌入向量
+            config: 嵌入配置对象
+            total_chunks: 文档总块数
+            filename: 文件名
+            
+        返回:
+            元数据字典
+        """
+        return {
+            "chunk_id": chunk["metadata"]["chunk_id"],
+            "page_number": chunk["metadata"]["page_number"],
+            "page_range": chunk["metadata"]["page_range"],
+            "content": chunk["content"],
+            "word_count": chunk["metadata"]["word_count"],
+            # "chunking_method": input_data.get("chunking_method", "loaded"),
+            "total_chunks": total_chunks,
+            "embedding_provider": config.provider,
+            "embedding_model": config.model_name,
+            "embedding_timestamp": datetime.now().isoformat(),
+            "vector_dimension": len(embedding_vector),
+            "filename": filename  # 添加文件名到metadata
+        }
+
+    def _embed_texts(self, texts: list, config: EmbeddingConfig) -> tuple:
+        """
+        为文本列表生成嵌入向量
+        
+        先按规范化内容哈希去重，每个不同的文本只嵌入一次；再查询持久化缓存，只对未命中的文本调用嵌入模型；
+        最后把向量分发回所有内容相同的文本位置。
+        
+        参数:
+            texts: 文本列表
+            config: 嵌入配置对象
+            
+        返回:
+            (与texts顺序一致的向量列表, 统计字典)
+        """
+        hashes = [content_hash(text) for text in texts]
+        unique_positions = {}
+        unique_texts = []
+        for text_hash, text in zip(hashes, texts):
+            if text_hash not in unique_positions:
+                unique_positions[text_hash] = len(unique_texts)
+                unique_texts.append(text)
+        
+        cache = get_embedding_cache()
+        if cache is not None:
+            unique_vectors = cache.get_many(config.provider, config.model_name, unique_texts)
         else:
-            # 对其他提供商保持原有的逐个处理逻辑
-            for chunk in chunks:
-                embedding_vector = embedding_function.embed_query(chunk["content"])
-                metadata = {
-                    "chunk_id": chunk["metadata"]["chunk_id"],
-                    "page_number": chunk["metadata"]["page_number"],
-                    "page_range": chunk["metadata"]["page_range"],
-                    "content": chunk["content"],
-                    "word_count": chunk["metadata"]["word_count"],
-                    # "chunking_method": input_data.get("chunking_method", "loaded"),
-                    "total_chunks": len(chunks),
-                    "embedding_provider": config.provider,
-                    "embedding_model": config.model_name,
-                    "embedding_timestamp": datetime.now().isoformat(),
-                    "vector_dimension": len(embedding_vector),
-                    "filename": filename  # 添加文件名到metadata
-                }
-                
-                embedding_result = {
-                    "embedding": embedding_vector,
-                    "metadata": metadata
-                }
-                results.append(embedding_result)
-        
-        # 返回结果和空的metadata（因为metadata已经包含在每个embedding中）
-        return results, {}
-
-    def save_embeddings(self, doc_name: str, embeddings: list) -> str:
-        """
-        保存嵌入向量到JSON文件
+            unique_vectors = [None] * len(unique_texts)
+        
+        miss_indices = [i for i, vector in enumerate(unique_vectors) if vector is None]
+        
+        if miss_indices:
+            # 只有存在未命中时才加载嵌入模型；使用进程池时模型只在工作进程中加载
+            pool = get_embedding_pool(config.provider, config.model_name)
+            embedding_function = pool if pool is not None else self.model_registry.get(config)
+            miss_texts = [unique_texts[i] for i in miss_indices]
+            miss_vectors = self._embed_uncached(miss_texts, config, embedding_function)
+            for i, vector in zip(miss_indices, miss_vectors):
+                unique_vectors[i] = vector
+            if cache is not None:
+                cache.put_many(config.provider, config.model_name, miss_texts, miss_vectors)
+        
+        vectors = [unique_vectors[unique_positions[text_hash]] for text_hash in hashes]
+        stats = {
+            "deduplicated_chunks": len(texts) - len(unique_texts),
+            "cache_hits": len(unique_texts) - len(miss_indices),
+            "cache_misses": len(miss_indices)
+        }
+        logger.info(
+            f"Embedding {len(texts)} texts: {stats['deduplicated_chunks']} duplicates, "
+            f"{stats['cache_hits']} cache hits, {stats['cache_misses']} embedded"
+        )
+        return vectors, stats
+
+    def _embed_uncached(self, texts: list, config: EmbeddingConfig, embedding_function) -> list:
+        """
+        调用嵌入模型批量生成向量（不经过缓存）
+        
+        所有提供商统一走 embed_documents 批处理路径。文本先按长度排序再分批，
+        使同一批内的文本长度接近以减少填充，最后按原始顺序还原结果。
+        
+        参数:
+            texts: 文本列表
+            config: 嵌入配置对象
+            embedding_function: 嵌入函数对象，或本地模型的 EmbeddingProcessPool
+            
+        返回:
+            与texts顺序一致的向量列表
+        """
+        provider = getattr(config.provider, "value", config.provider)
+        batch_size = EMBEDDING_BATCH_CONFIG["batch_sizes"].get(provider, EMBEDDING_BATCH_CONFIG["default_batch_size"])
+        batches = plan_batches(
+            texts,
+            max_batch_size=batch_size,
+            max_batch_chars=EMBEDDING_BATCH_CONFIG["max_batch_chars"] if EMBEDDING_BATCH_CONFIG["adaptive"] else None
+        )
+        
+        batch_texts = [[texts[i] for i in batch] for batch in batches]
+        if isinstance(embedding_function, EmbeddingProcessPool):
+            # 本地模型：批次分发到多个工作进程并行计算
+            batch_results = run_in_pool(embedding_function, batch_texts)
+        elif provider in (EmbeddingProvider.OPENAI.value, EmbeddingProvider.BEDROCK.value):
+            # 远程提供商：多个批次同时在途，受限流器约束并自动重试429
+            batch_results = RemoteBatchScheduler(provider).run(batch_texts, embedding_function.embed_documents)
+        else:
+            batch_results = [embedding_function.embed_documents(texts_in_batch) for texts_in_batch in batch_texts]
+        
+        vectors = [None] * len(texts)
+        for batch, batch_vectors in zip(batches, batch_results):
+            for i, vector in zip(batch, batch_vectors):
+                vectors[i] = vector
+        logger.info(f"Embedded {len(texts)} texts in {len(batches)} batches")
+        return vectors
+
+    def save_embeddings(self, doc_name: str, embeddings: list, quantization: str = None, keep_full_precision: bool = None) -> str:
+        """
+        保存嵌入向量，默认写入 float32 二进制矩阵（.npy）和元数据 JSON sidecar
         
         参数:
             doc_name: 文档名称
             embeddings: 嵌入向量列表
+            quantization: 量化类型（float16 / int8），为None时使用配置中的默认值
+            keep_full_precision: 量化时是否保留全精度向量，为None时使用配置中的默认值
             
         返回:
-            保存的文件路径
+            保存的元数据文件路径
         """
-        os.makedirs("02-embedded-docs", exist_ok=True)
-        
         # 获取第一个embedding的元数据
         first_embedding = embeddings[0]
-        provider = first_embedding["metadata"]["embedding_provider"]
+        filepath, config_info = self._artifact_target(
+            doc_name,
+            first_embedding["metadata"]["embedding_provider"],
+            first_embedding["metadata"]["embedding_model"],
+            first_embedding["metadata"]["vector_dimension"]
+        )
+        
+        save_embedding_artifact(filepath, config_info, embeddings, EMBEDDING_ARTIFACT_CONFIG["format"])
+        self._quantize_artifact(filepath, quantization, keep_full_precision)
+        get_embedding_manifest().record(os.path.basename(filepath), config_info, len(embeddings))
+        return filepath
+
+    def _quantize_artifact(self, filepath: str, quantization: str = None, keep_full_precision: bool = None):
+        """
+        按需对已保存的 npy 结果做降精度存储
+        
+        参数:
+            filepath: 元数据文件路径
+            quantization: 量化类型，为None时使用配置中的默认值
+            keep_full_precision: 是否保留全精度向量用于重排序，为None时使用配置中的默认值
+        """
+        quantization = quantization or EMBEDDING_ARTIFACT_CONFIG["quantization"]
+        if not quantization or EMBEDDING_ARTIFACT_CONFIG["format"] != "npy":
+            return
+        apply_quantization(
+            filepath,
+            quantization,
+            keep_full_precision=(
+                EMBEDDING_ARTIFACT_CONFIG["keep_full_precision"] if keep_full_precision is None else keep_full_precision
+            ),
+            recall_sample_size=EMBEDDING_ARTIFACT_CONFIG["recall_sample_size"]
+        )
+
+    def _artifact_target(self, doc_name: str, provider: str, model_name: str, vector_dimension: int) -> tuple:
+        """
+        确定嵌入结果文件路径和顶层配置信息
+        
+        参数:
+            doc_name: 文档名称
+            provider: 嵌入提供商
+            model_name: 嵌入模型名称
+            vector_dimension: 向量维度
+            
+        返回:
+            (元数据文件路径, 顶层配置信息字典)
+        """
+        os.makedirs("02-embedded-docs", exist_ok=True)
+        provider = getattr(provider, "value", provider)
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
         
         # 保持原始文件名（包括扩展名）
@@ -147,45 +382,15 @@ class EmbeddingService:
         filename = f"{base_name.replace('.pdf', '')}_{provider}_{timestamp}.json"
         filepath = os.path.join("02-embedded-docs", filename)
         
-        # 从第一个embedding中获取配置信息
         config_info = {
             "filename": base_name,  # 使用完整的文件名（包括.pdf）
             "chunked_doc_name": doc_name,  # Add chunked_doc_name
             "created_at": datetime.now().isoformat(),
             "embedding_provider": provider,
-            "embedding_model": first_embedding["metadata"]["embedding_model"],
-            "vector_dimension": first_embedding["metadata"]["vector_dimension"]
+            "embedding_model": model_name,
+            "vector_dimension": vector_dimension
         }
-        
-        class CompactJSONEncoder(json.JSONEncoder):
-            """自定义JSON编码器，用于优化嵌入向量的存储格式"""
-            def default(self, obj):
-                if isinstance(obj, datetime):
-                    return obj.isoformat()
-                return super().default(obj)
-            
-            def encode(self, obj):
-                # 将 embedding 数组转换为单行，其他保持格式化
-                def format_list(lst):
-                    if isinstance(lst, list):
-                        # 检查是否为 embedding 数组（通过检查第一个元素是否为数字）
-                        if lst and isinstance(lst[0], (int, float)):
-                            return '[' + ','.join(map(str, lst)) + ']'
-                        return [format_list(item) for item in lst]
-                    elif isinstance(lst, dict):
-                        return {k: format_list(v) for k, v in lst.items()}
-                    return lst
-                
-                return super().encode(format_list(obj))
-        
-        # 保存数据，配置信息放在顶层
-        with open(filepath, "w", encoding="utf-8") as f:
-            json.dump({
-                **config_info,  # 配置信息放在顶层
-                "embeddings": embeddings
-            }, f, ensure_ascii=False, indent=2, cls=CompactJSONEncoder)
-            
-        return filepath
+        return filepath, config_info
 
     def create_single_embedding(self, text: str, provider: str, model: str) -> list:
         """
@@ -199,9 +404,61 @@ class EmbeddingService:
         返回:
             嵌入向量列表
         """
-        config = EmbeddingConfig(provider=provider, model_name=model)
-        embedding_function = self.embedding_factory.create_embedding_function(config)
-        return embedding_function.embed_query(text)
+        return self.embed_query(text, provider, model)
+
+    def embed_query(self, query: str, provider: str, model: str) -> list:
+        """
+        生成查询向量，优先从查询向量缓存中读取
+        
+        检索路径只需要一个向量，不经过文本块元数据、去重和持久化缓存的处理流程。
+        
+        参数:
+            query: 查询文本
+            provider: 嵌入提供商
+            model: 嵌入模型名称
+            
+        返回:
+            查询向量
+        """
+        return self.embed_queries([query], provider, model)[0]
+
+    def embed_queries(self, queries: list, provider: str, model: str) -> list:
+        """
+        批量生成查询向量：缓存未命中的查询去重后通过一次 embed_documents 调用生成
+        
+        远程提供商的请求同样经过 RemoteBatchScheduler，与文档嵌入共享限流额度并重试 429。
+        
+        参数:
+            queries: 查询文本列表
+            provider: 嵌入提供商
+            model: 嵌入模型名称
+            
+        返回:
+            与 queries 顺序一致的查询向量列表
+        """
+        cache = get_query_embedding_cache()
+        vectors = [cache.get(provider, model, query) if cache is not None else None for query in queries]
+        
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(queries[i], []).append(i)
+        
+        if missing:
+            config = EmbeddingConfig(provider=provider, model_name=model)
+            texts = list(missing)
+            embedding_function = self.model_registry.get(config)
+            provider_name = getattr(config.provider, "value", config.provider)
+            if provider_name in (EmbeddingProvider.OPENAI.value, EmbeddingProvider.BEDROCK.value):
+                embedded = RemoteBatchScheduler(provider_name).run([texts], embedding_function.embed_documents)[0]
+            else:
+                embedded = embedding_function.embed_documents(texts)
+            for text, vector in zip(texts, embedded):
+                for i in missing[text]:
+                    vectors[i] = vector
+                if cache is not None:
+                    cache.put(provider, model, text, vector)
+        return vectors
 
     def get_document_embedding_config(self, collection_name: str) -> EmbeddingConfig:
         """
@@ -220,18 +477,16 @@ class EmbeddingService:
             # 只取第一个下划线之前的部分
             doc_name = collection_name.split('_')[0]
             
-            # 查找对应的embedding文件
-            embedded_docs_dir = "02-embedded-docs"
-            for filename in os.listdir(embedded_docs_dir):
-                if filename.endswith('.json'):
-                    with open(os.path.join(embedded_docs_dir, filename), 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        # 使用 filename 而不是 document_name
-                        if data.get("filename") == doc_name:
-                            return EmbeddingConfig(
-                                provider=data.get("embedding_provider"),
-                                model_name=data.get("embedding_model")
-                            )
+            # 通过清单按文件名查询；查不到时与目录同步一次，兼容手动放入的结果文件
+            manifest = get_embedding_manifest()
+            entry = manifest.find_by_filename(doc_name)
+            if entry is None and manifest.sync():
+                entry = manifest.find_by_filename(doc_name)
+            if entry is not None:
+                return EmbeddingConfig(
+                    provider=entry["embedding_provider"],
+                    model_name=entry["embedding_model"]
+                )
                             
             raise ValueError(f"No matching embedding configuration found for collection: {collection_name}")
         except Exception as e:
@@ -270,7 +525,8 @@ class EmbeddingFactory:
         elif config.provider == EmbeddingProvider.OPENAI:
             return OpenAIEmbeddings(
                 model=config.model_name,
-                openai_api_key=os.getenv('OPENAI_API_KEY')
+                openai_api_key=os.getenv('OPENAI_API_KEY'),
+                max_retries=0  # 限流重试由 RemoteBatchScheduler 统一处理（文档嵌入和查询嵌入都经过调度器）
             )
             
         elif config.provider == EmbeddingProvider.HUGGINGFACE:
@@ -278,12 +534,186 @@ class EmbeddingFactory:
                 return HuggingFaceEmbeddings(
                     model_name=config.model_name,
                     model_kwargs={'device': 'cpu'},  # 如果有GPU可以改为'cuda'
-                    encode_kwargs={'normalize_embeddings': True}  # 在encode_kwargs中设置normalize_embeddings
+                    encode_kwargs={
+                        'normalize_embeddings': True,  # 在encode_kwargs中设置normalize_embeddings
+                        'batch_size': EMBEDDING_BATCH_CONFIG["batch_sizes"]["huggingface"]
+                    }
                 )
             else:
                 # 其他huggingface模型使用默认配置
                 return HuggingFaceEmbeddings(
-                    model_name=config.model_name
+                    model_name=config.model_name,
+                    encode_kwargs={'batch_size': EMBEDDING_BATCH_CONFIG["batch_sizes"]["huggingface"]}
                 )
             
-        raise ValueError(f"Unsupported embedding provider: {config.provider}")
\ No newline at end of file
+        raise ValueError(f"Unsupported embedding provider: {config.provider}")
+
+class EmbeddingModelRegistry:
+    """
+    嵌入模型注册表，在进程内常驻已加载的嵌入模型
+    
+    以 EmbeddingConfig.key() 为键缓存 EmbeddingFactory 创建的嵌入函数，避免每次请求都从磁盘重新加载
+    HuggingFace 模型。常驻模型的估算内存超过预算时，按最近使用顺序（LRU）淘汰。
+    """
+    def __init__(self, memory_budget_mb: int):
+        """
+        初始化模型注册表
+        
+        参数:
+            memory_budget_mb: 常驻模型的内存预算（MB）
+        """
+        self.memory_budget_bytes = memory_budget_mb * 1024 * 1024
+        self._models = OrderedDict()  # key -> (embedding_function, size_bytes)
+        self._lock = threading.Lock()
+        self._loading_locks = {}
+        self.loads = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def get(self, config: EmbeddingConfig):
+        """
+        获取嵌入函数，未加载时创建并登记
+        
+        参数:
+            config: 嵌入配置对象
+            
+        返回:
+            嵌入函数对象
+        """
+        key = config.key()
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return self._models[key][0]
+            loading_lock = self._loading_locks.setdefault(key, threading.Lock())
+
+        # 同一个模型只加载一次，不同模型的加载互不阻塞
+        with loading_lock:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    self.hits += 1
+                    return self._models[key][0]
+
+            logger.info(f"Loading embedding model: provider={key[0]}, model={key[1]}")
+            embedding_function = EmbeddingFactory.create_embedding_function(config)
+            size_bytes = self._estimate_size(embedding_function)
+
+            with self._lock:
+                self._models[key] = (embedding_function, size_bytes)
+                self.loads += 1
+                self._evict(keep=key)
+                self._loading_locks.pop(key, None)
+            return embedding_function
+
+    def warmup(self, configs: list):
+        """
+        预加载模型列表，单个模型加载失败不影响其他模型
+        
+        参数:
+            configs: EmbeddingConfig 对象列表
+        """
+        for config in configs:
+            try:
+                self.get(config)
+            except Exception as e:
+                logger.error(f"Error warming up embedding model {config.model_name}: {str(e)}")
+
+    def _evict(self, keep: tuple):
+        """
+        淘汰最久未使用的模型直到总内存不超过预算（调用方需持有锁）
+        
+        参数:
+            keep: 不允许淘汰的模型键（刚加载的模型）
+        """
+        evicted = False
+        while self._total_size() > self.memory_budget_bytes:
+            candidates = [key for key in self._models if key != keep]
+            if not candidates:
+                break
+            key = candidates[0]
+            self._models.pop(key)
+            self.evictions += 1
+            evicted = True
+            logger.info(f"Evicted embedding model from registry: provider={key[0]}, model={key[1]}")
+        if evicted:
+            gc.collect()
+
+    def _total_size(self) -> int:
+        """计算常驻模型的估算内存总量（字节）"""
+        return sum(size for _, size in self._models.values())
+
+    @staticmethod
+    def _estimate_size(embedding_function) -> int:
+        """
+        估算嵌入模型占用的内存，远程API类提供商视为0
+        
+        参数:
+            embedding_function: 嵌入函数对象
+            
+        返回:
+            估算的字节数
+        """
+        client = getattr(embedding_function, "client", None)
+        if client is None or not hasattr(client, "parameters"):
+            return 0
+        try:
+            size = sum(p.numel() * p.element_size() for p in client.parameters())
+            size += sum(b.numel() * b.element_size() for b in client.buffers())
+            return size
+        except Exception:
+            return 0
+
+    def stats(self) -> dict:
+        """
+        获取注册表状态
+        
+        返回:
+            包含常驻模型、内存占用和计数器的字典
+        """
+        with self._lock:
+            return {
+                "models": [
+                    {"provider": key[0], "model_name": key[1], "size_mb": round(size / 1024 / 1024, 1)}
+                    for key, (_, size) in self._models.items()
+                ],
+                "total_size_mb": round(self._total_size() / 1024 / 1024, 1),
+                "memory_budget_mb": round(self.memory_budget_bytes / 1024 / 1024, 1),
+                "loads": self.loads,
+                "hits": self.hits,
+                "evictions": self.evictions
+            }
+
+_model_registry = None
+_model_registry_lock = threading.Lock()
+
+def get_embedding_model_registry() -> EmbeddingModelRegistry:
+    """
+    获取进程内共享的嵌入模型注册表
+    
+    返回:
+        EmbeddingModelRegistry 实例
+    """
+    global _model_registry
+    with _model_registry_lock:
+        if _model_registry is None:
+            _model_registry = EmbeddingModelRegistry(EMBEDDING_MODEL_REGISTRY_CONFIG["memory_budget_mb"])
+        return _model_registry
+
+def get_warmup_configs() -> list:
+    """
+    读取需要在启动时预热的模型配置
+    
+    返回:
+        EmbeddingConfig 对象列表
+    """
+    configs = [
+        EmbeddingConfig(provider=item["provider"], model_name=item["model_name"])
+        for item in EMBEDDING_MODEL_REGISTRY_CONFIG.get("warmup_models", [])
+    ]
+    for item in os.getenv("EMBEDDING_WARMUP_MODELS", "").split(","):
+        if ":" in item:
+            provider, model_name = item.strip().split(":", 1)
+            configs.append(EmbeddingConfig(provider=provider, model_name=model_name))
+    return configs
@@ -0,0 +1,271 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import numpy as np
+import pandas as pd
+from services.embedding_service import EmbeddingService
+from services.vector_store_service import VectorStoreService
+from utils.config import EVALUATION_CONFIG
+
+logger = logging.getLogger(__name__)
+
+class EvaluationService:
+    """
+    检索评估服务
+
+    评估按阶段流水线执行：一次性解析 CSV，分批生成全部查询向量，在并发上限内执行多查询检索，
+    最后用向量化的方式计算命中指标，并记录每个阶段的耗时。
+    """
+    def __init__(self):
+        """
+        初始化评估服务
+        """
+        self.vector_store_service = VectorStoreService()
+        self.embedding_service = EmbeddingService()
+        self.output_dir = Path("06-evaluation-result")
+        self.batch_size = EVALUATION_CONFIG["batch_size"]
+        self.max_concurrency = EVALUATION_CONFIG["max_concurrency"]
+
+    def parse_queries(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        解析评估数据：合并前四列文本作为查询，解析 LABEL 列的期望页码列表
+
+        参数:
+            df: 原始评估数据
+
+        返回:
+            包含 query 和 expected_pages 两列的 DataFrame，已去掉没有标签或标签无法解析的行
+        """
+        # 只合并前四列的文本内容
+        text_columns = df.iloc[:, :4].astype(object)
+        text_columns = text_columns.where(text_columns.notna() & (text_columns != '[]'))
+        combined_text = text_columns.apply(lambda row: ' '.join(str(val) for val in row.dropna()), axis=1)
+
+        labels = df['LABEL'].where(df['LABEL'].notna(), '').astype(str).str.strip('[]').str.replace(' ', '', regex=False)
+        expected_pages = []
+        for row_number, label in labels.items():
+            # 标签格式错误的行跳过并记录警告，不影响其他行的评估
+            try:
+                expected_pages.append([int(float(item)) for item in label.split(',') if item.strip()])
+            except ValueError as e:
+                logger.warning(f"Skipping row {row_number} with invalid LABEL {label!r}: {str(e)}")
+                expected_pages.append([])
+        expected_pages = pd.Series(expected_pages, index=labels.index, dtype=object)
+
+        parsed = pd.DataFrame({"query": combined_text, "expected_pages": expected_pages})
+        parsed = parsed[parsed["expected_pages"].str.len() > 0].reset_index(drop=True)
+        return parsed
+
+    async def embed_queries(self, queries: List[str], provider: str, collection_id: str) -> List[List[float]]:
+        """
+        按集合的嵌入配置分批生成全部查询向量
+
+        参数:
+            queries: 查询文本列表
+            provider: 向量数据库提供商
+            collection_id: 集合名称
+
+        返回:
+            查询向量列表
+        """
+        embedding_provider, model_name = await self.vector_store_service.collection_embedding_config(provider, collection_id)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def embed_batch(batch: List[str]) -> List[List[float]]:
+            async with semaphore:
+                return await asyncio.to_thread(self.embedding_service.embed_queries, batch, embedding_provider, model_name)
+
+        batches = [queries[i:i + self.batch_size] for i in range(0, len(queries), self.batch_size)]
+        results = await asyncio.gather(*(embed_batch(batch) for batch in batches))
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+    async def search_queries(self, queries: List[str], embeddings: List[List[float]], provider: str,
+                             collection_id: str, top_k: int, threshold: float) -> List[List[Dict[str, Any]]]:
+        """
+        分批执行多查询检索，同时在途的批次数不超过并发上限
+
+        参数:
+            queries: 查询文本列表
+            embeddings: 查询向量列表
+            provider: 向量数据库提供商
+            collection_id: 集合名称
+            top_k: 每个查询返回的结果数
+            threshold: 相似度阈值
+
+        返回:
+            与 queries 顺序一致的检索结果列表
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def search_batch(start: int) -> List[List[Dict[str, Any]]]:
+            async with semaphore:
+                response = await self.vector_store_service.batch_search({
+                    "provider": provider,
+                    "collection_id": collection_id,
+                    "queries": [
+                        {"query": query, "embedding": embedding}
+                        for query, embedding in zip(queries[start:start + self.batch_size], embeddings[start:start + self.batch_size])
+                    ],
+                    "top_k": top_k,
+                    "threshold": threshold
+                })
+                return [item["results"] for item in response["results"]]
+
+        results = await asyncio.gather(*(search_batch(start) for start in range(0, len(queries), self.batch_size)))
+        return [query_results for batch_results in results for query_results in batch_results]
+
+    @staticmethod
+    def _result_page(metadata: Optional[Dict[str, Any]]) -> int:
+        """
+        从检索结果的元数据中取页码，无法解析时返回 -1
+
+        参数:
+            metadata: 结果元数据
+
+        返回:
+            页码
+        """
+        metadata = metadata or {}
+        page = metadata.get("page_number", metadata.get("page"))
+        try:
+            return int(page)
+        except (TypeError, ValueError):
+            return -1
+
+    def compute_metrics(self, expected_pages: List[List[int]], found_pages: np.ndarray, found_counts: np.ndarray) -> tuple:
+        """
+        向量化计算每个查询的 score_hit 和 score_find
+
+        score_hit 为返回结果中页码命中期望页码的比例，score_find 为被找到的（去重后的）期望页码数
+        除以期望页码列表的长度（与逐行计算的 len(set(found) & set(expected)) / len(expected) 一致）。
+
+        参数:
+            expected_pages: 每个查询的期望页码列表
+            found_pages: (查询数, top_k) 的找到页码矩阵，空位为 -1
+            found_counts: 每个查询实际返回的结果数
+
+        返回:
+            (score_hit 数组, score_find 数组)
+        """
+        num_queries = found_pages.shape[0]
+        expected_counts = np.array([len(pages) for pages in expected_pages])
+        expected_query = np.repeat(np.arange(num_queries), expected_counts)
+        expected_flat = np.array([page for pages in expected_pages for page in pages], dtype=np.int64)
+
+        # 以 (查询下标, 页码) 组合成唯一的键，一次 isin 完成全部查询的集合运算
+        offset = int(max(found_pages.max(initial=0), expected_flat.max(initial=0))) + 2
+        found_keys = np.arange(num_queries)[:, None] * offset + found_pages
+        expected_keys = expected_query * offset + expected_flat
+
+        found_hit = np.isin(found_keys, expected_keys) & (found_pages >= 0)
+        score_hit = np.divide(found_hit.sum(axis=1), found_counts, out=np.zeros(num_queries), where=found_counts > 0)
+
+        expected_found = np.isin(np.unique(expected_keys), found_keys[found_pages >= 0])
+        unique_expected_query = np.unique(expected_keys) // offset
+        found_per_query = np.bincount(unique_expected_query[expected_found], minlength=num_queries)
+        score_find = found_per_query / np.maximum(expected_counts, 1)
+        return score_hit, score_find
+
+    async def evaluate(self, df: pd.DataFrame, collection_id: str, provider: str, top_k: int, threshold: float) -> Dict[str, Any]:
+        """
+        执行完整的评估流水线并保存结果
+
+        参数:
+            df: 原始评估数据
+            collection_id: 集合名称
+            provider: 向量数据库提供商
+            top_k: 每个查询返回的结果数
+            threshold: 相似度阈值
+
+        返回:
+            评估结果字典（包含每个阶段的耗时）
+        """
+        timings = {}
+
+        stage_start = time.perf_counter()
+        parsed = self.parse_queries(df)
+        if parsed.empty:
+            raise ValueError("No valid queries found in the CSV file")
+        queries = parsed["query"].tolist()
+        expected_pages = parsed["expected_pages"].tolist()
+        timings["parse"] = time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        embeddings = await self.embed_queries(queries, provider, collection_id)
+        timings["embed"] = time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        search_results = await self.search_queries(queries, embeddings, provider, collection_id, top_k, threshold)
+        timings["search"] = time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        found_pages = np.full((len(queries), max(top_k, 1)), -1, dtype=np.int64)
+        found_counts = np.zeros(len(queries), dtype=np.int64)
+        for i, query_results in enumerate(search_results):
+            pages = [self._result_page(result.get("metadata")) for result in query_results[:top_k]]
+            found_pages[i, :len(pages)] = pages
+            found_counts[i] = len(pages)
+        score_hit, score_find = self.compute_metrics(expected_pages, found_pages, found_counts)
+        timings["metrics"] = time.perf_counter() - stage_start
+
+        results = []
+        for i, query_results in enumerate(search_results):
+            result_entry = {
+                "query": queries[i],
+                "expected_pages": expected_pages[i],
+                "found_pages": found_pages[i, :found_counts[i]].tolist(),
+                "score_hit": float(score_hit[i]),
+                "score_find": float(score_find[i])
+            }
+            # 添加每个top_k结果的文本作为单独的字段
+            for rank, result in enumerate(query_results[:top_k], 1):
+                result_entry[f"text_{rank}"] = result["text"]
+                result_entry[f"page_{rank}"] = found_pages[i, rank - 1].item()
+                result_entry[f"score_{rank}"] = result["score"]
+            results.append(result_entry)
+
+        evaluation_results = {
+            "results": results,
+            "average_scores": {
+                "score_hit": float(score_hit.mean()),
+                "score_find": float(score_find.mean())
+            },
+            "total_queries": len(queries),
+            "parameters": {
+                "collection_id": collection_id,
+                "provider": provider,
+                "top_k": top_k,
+                "threshold": threshold
+            },
+            "timings": {stage: round(seconds, 4) for stage, seconds in timings.items()}
+        }
+        self.save_results(evaluation_results, top_k)
+        logger.info(f"Evaluated {len(queries)} queries on {collection_id}: {evaluation_results['timings']}")
+        return evaluation_results
+
+    def save_results(self, evaluation_results: Dict[str, Any], top_k: int):
+        """
+        保存评估结果：详细的 JSON 结果和每个 top_k 结果单独一列的 CSV
+
+        参数:
+            evaluation_results: 评估结果字典
+            top_k: 每个查询返回的结果数
+        """
+        self.output_dir.mkdir(exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+        with open(self.output_dir / f"evaluation_results_{timestamp}.json", "w", encoding="utf-8") as f:
+            json.dump(evaluation_results, f, indent=2)
+
+        results_df = pd.DataFrame(evaluation_results["results"])
+        # 重新排列列的顺序，使其更有逻辑性
+        column_order = ['query', 'expected_pages', 'found_pages', 'score_hit', 'score_find']
+        for i in range(1, top_k + 1):
+            column_order.extend([f'page_{i}', f'score_{i}', f'text_{i}'])
+        # 只选择存在的列
+        results_df = results_df[[col for col in column_order if col in results_df.columns]]
+        results_df.to_csv(self.output_dir / f"evaluation_results_{timestamp}.csv", index=False)
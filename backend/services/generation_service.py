@@ -8,6 +8,9 @@ from transformers import AutoModelForCausalLM, AutoTokenizer
 import torch
 from openai import OpenAI
 import requests
+from services.embedding_cache import content_hash
+from services.search_cache import get_collection_versions
+from services.semantic_cache import get_semantic_cache, semantic_query_embedding
 
 logger = logging.getLogger(__name__)
 
@@ -224,7 +227,10 @@ class GenerationService:
         query: str,
         search_results: List[Dict],
         api_key: Optional[str] = None,
-        show_reasoning: bool = True
+        show_reasoning: bool = True,
+        collection_id: Optional[str] = None,
+        collection_provider: str = "milvus",
+        semantic_cache: bool = False
     ) -> Dict:
         """
         生成回答并保存结果
@@ -236,9 +242,13 @@ class GenerationService:
             search_results: 搜索结果列表，用于构建上下文
             api_key: API密钥（对于API调用）
             show_reasoning: 是否显示推理过程（仅对DeepSeek推理模型有效）
+            collection_id: 检索结果所属的集合（使用语义缓存时必须指定）
+            collection_provider: 集合所在的向量数据库提供商
+            semantic_cache: 是否使用语义缓存：与之前某个查询语义相同、上下文相同的查询直接返回之前生成的回答，
+                不再调用模型
             
         返回:
-            包含生成回答和保存路径的字典
+            包含生成回答、保存路径和 cached（回答是否来自缓存）的字典（使用语义缓存时还包含 semantic_cache）
         """
         try:
             # 准备上下文
@@ -246,6 +256,29 @@ class GenerationService:
                 f"[Source {i+1}]: {result['text']}"
                 for i, result in enumerate(search_results)
             ])
+
+            semantic_cache = get_semantic_cache() if semantic_cache and collection_id else None
+            embedding = None
+            answer_key = (provider, model_name, show_reasoning, content_hash(context))
+            if semantic_cache is not None:
+                try:
+                    version = get_collection_versions().get(collection_provider, collection_id)
+                    embedding = semantic_query_embedding(collection_provider, collection_id, query)
+                    hit = semantic_cache.get(collection_provider, collection_id, embedding, "answers", answer_key)
+                    if hit is not None:
+                        logger.info(f"Semantic cache hit (similarity {hit['similarity']:.4f}), skipping {provider} generation")
+                        return {
+                            **hit["payload"],
+                            "cached": True,
+                            "semantic_cache": {
+                                "hit": True,
+                                "similarity": round(hit["similarity"], 4),
+                                "matched_query": hit["matched_query"]
+                            }
+                        }
+                except Exception as e:
+                    logger.warning(f"Semantic cache lookup failed, generating directly: {str(e)}")
+                    semantic_cache = None
             
             # 根据不同提供商生成回答
             if provider == "huggingface":
@@ -275,10 +308,15 @@ class GenerationService:
             with open(filepath, "w", encoding="utf-8") as f:
                 json.dump(result, f, ensure_ascii=False, indent=2)
                 
-            return {
+            answer = {
                 "response": response,
                 "saved_filepath": filepath
             }
+            if semantic_cache is not None:
+                semantic_cache.put(collection_provider, collection_id, query, embedding, "answers", answer_key,
+                                   answer, version)
+                return {**answer, "cached": False, "semantic_cache": {"hit": False}}
+            return {**answer, "cached": False}
             
         except Exception as e:
             logger.error(f"Error in generation: {str(e)}")
@@ -0,0 +1,306 @@
+import os
+import json
+import shutil
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import numpy as np
+from pymilvus import Collection, DataType
+from services.benchmark_service import BenchmarkService
+from services.embedding_service import EmbeddingService
+from services.index_tuning import default_index_params, get_index_tuning_store
+from services.local_vector_store import LocalCollection
+from services.milvus_connection import get_milvus_connection_manager
+from services.search_cache import get_collection_versions
+from services.vector_store_service import forget_milvus_collection
+from utils.config import INDEX_TUNING_CONFIG, MILVUS_CONFIG, MILVUS_INSERT_CONFIG
+
+logger = logging.getLogger(__name__)
+
+class IndexAutotuner:
+    """
+    Milvus ANN 索引参数自动调优
+
+    从集合中读出全部向量，以精确检索的结果为标准答案，在临时的 Milvus Lite 数据库中依次构建
+    IVF（nlist）或 HNSW（M）的候选索引，并对每个索引从小到大扫描 nprobe / ef，
+    选出满足目标 recall@k 且平均延迟最低的组合。结果按集合保存，之后的检索自动使用调优后的参数，
+    需要时也会用调优后的构建参数重建集合的索引。
+    """
+    def __init__(self, work_dir: str = None):
+        """
+        初始化调优器
+
+        参数:
+            work_dir: 候选索引的临时目录，为None时使用默认配置
+        """
+        self.work_dir = work_dir or INDEX_TUNING_CONFIG["work_dir"]
+        self.milvus = get_milvus_connection_manager()
+
+    def tune(self, collection_name: str, queries: Optional[List[str]] = None, target_recall: float = None,
+             top_k: int = None, sample_queries: int = None, apply: bool = True) -> Dict[str, Any]:
+        """
+        调优集合的索引参数并保存结果
+
+        参数:
+            collection_name: Milvus 集合名称
+            queries: 查询文本列表，为None时从集合中抽样向量作为查询
+            target_recall: 目标 recall@k
+            top_k: 计算 recall@k 的 k
+            sample_queries: 抽样查询数
+            apply: 调优后的构建参数与当前索引不同时是否重建集合的索引
+
+        返回:
+            调优结果（包含全部候选的测量结果）
+        """
+        target_recall = target_recall or INDEX_TUNING_CONFIG["target_recall"]
+        top_k = top_k or INDEX_TUNING_CONFIG["top_k"]
+        sample_queries = sample_queries or INDEX_TUNING_CONFIG["sample_queries"]
+
+        collection, index_type, current_params, metric_type = self._load_collection(collection_name)
+        index_modes = {value: key for key, value in MILVUS_CONFIG["index_types"].items()}
+        index_mode = index_modes.get(index_type)
+        if index_mode not in ("ivf_flat", "ivf_sq8", "hnsw"):
+            raise ValueError(f"Index type {index_type} of {collection_name} has no parameters to tune")
+
+        vectors, embedding_config = self._read_vectors(collection)
+        if queries:
+            query_vectors = np.asarray(
+                EmbeddingService().embed_queries(queries, *embedding_config), dtype=np.float32
+            )
+            query_source = "text"
+        else:
+            rng = np.random.default_rng(0)
+            rows = rng.choice(vectors.shape[0], size=min(sample_queries, vectors.shape[0]), replace=False)
+            query_vectors = vectors[np.sort(rows)]
+            query_source = "sampled_chunks"
+
+        exact = LocalCollection("ground_truth", vectors, [], {})
+        ground_truth = [[row for row, _ in hits] for hits in exact.search(query_vectors, top_k)]
+
+        candidates = []
+        for build_params, search_space in self._search_space(index_mode, vectors.shape[0], top_k):
+            candidates.extend(
+                self._measure_build(index_mode, build_params, search_space, vectors, query_vectors,
+                                    ground_truth, top_k, target_recall)
+            )
+        # 每个候选的临时目录在 _measure_build 中删除；work_dir 由并发的调优共用，不整体删除
+
+        chosen = self._choose(candidates, target_recall)
+        entry = {
+            "index_mode": index_mode,
+            "index_type": index_type,
+            "build_params": chosen["build_params"],
+            "search_params": chosen["search_params"],
+            "recall_at_k": chosen["recall_at_k"],
+            "latency_mean_ms": chosen["latency_mean_ms"],
+            "target_recall": target_recall,
+            "target_met": chosen["recall_at_k"] >= target_recall,
+            "top_k": top_k,
+            "num_vectors": int(vectors.shape[0]),
+            "num_queries": int(len(query_vectors)),
+            "query_source": query_source,
+            "tuned_at": datetime.now().isoformat(),
+            "candidates": candidates
+        }
+
+        entry["rebuilt"] = False
+        # Milvus 返回的索引参数值可能是字符串，按字符串比较
+        current = {key: str(value) for key, value in current_params.items()}
+        if apply and {key: str(value) for key, value in chosen["build_params"].items()} != current:
+            self._rebuild_index(collection, index_type, metric_type, chosen["build_params"])
+            entry["rebuilt"] = True
+        get_index_tuning_store().save(collection_name, entry)
+        # 已加载集合的缓存中保存着旧的检索参数，缓存的检索结果也按旧参数得到
+        forget_milvus_collection(collection_name)
+        get_collection_versions().bump("milvus", collection_name)
+        logger.info(
+            f"Tuned {collection_name}: build {chosen['build_params']}, search {chosen['search_params']}, "
+            f"recall@{top_k}={chosen['recall_at_k']}"
+        )
+        return entry
+
+    def _load_collection(self, collection_name: str) -> tuple:
+        """
+        加载集合并读取其索引信息
+
+        参数:
+            collection_name: 集合名称
+
+        返回:
+            (Collection, 索引类型, 索引参数, 度量类型)
+        """
+        with self.milvus.call() as ctx:
+            collection = Collection(collection_name, using=ctx.alias, timeout=ctx.timeout)
+            collection.load(timeout=MILVUS_CONFIG["index_timeout"])
+            if not collection.indexes:
+                raise ValueError(f"Collection {collection_name} has no index")
+            params = collection.indexes[0].params
+            index_params = params.get("params", {})
+            if isinstance(index_params, str):
+                index_params = json.loads(index_params)
+            return collection, params.get("index_type"), index_params, params.get("metric_type", "COSINE")
+
+    def _read_vectors(self, collection: Collection) -> tuple:
+        """
+        读出集合中的全部向量
+
+        参数:
+            collection: 已加载的集合
+
+        返回:
+            (float32 向量矩阵, (嵌入提供商, 嵌入模型))
+        """
+        vector_field = next(field for field in collection.schema.fields if field.name == "vector")
+        use_float16 = vector_field.dtype == DataType.FLOAT16_VECTOR
+        with self.milvus.call() as ctx:
+            iterator = collection.query_iterator(
+                batch_size=MILVUS_INSERT_CONFIG["batch_size"],
+                output_fields=["vector", "embedding_provider", "embedding_model"],
+                timeout=ctx.timeout
+            )
+            rows = []
+            embedding_config = (None, None)
+            while True:
+                batch = iterator.next()
+                if not batch:
+                    iterator.close()
+                    break
+                if embedding_config == (None, None):
+                    embedding_config = (batch[0].get("embedding_provider"), batch[0].get("embedding_model"))
+                for row in batch:
+                    vector = row["vector"]
+                    # FLOAT16_VECTOR 以字节返回
+                    if use_float16 and isinstance(vector, (bytes, bytearray)):
+                        vector = np.frombuffer(vector, dtype=np.float16)
+                    rows.append(np.asarray(vector, dtype=np.float32))
+        if not rows:
+            raise ValueError(f"Collection {collection.name} is empty")
+        return np.vstack(rows), embedding_config
+
+    def _search_space(self, index_mode: str, num_vectors: int, top_k: int) -> List[tuple]:
+        """
+        生成候选的构建参数及其对应的检索参数序列（检索参数按代价从小到大排列）
+
+        参数:
+            index_mode: 索引模式
+            num_vectors: 向量数量
+            top_k: 返回的结果数
+
+        返回:
+            [(构建参数, [检索参数, ...]), ...]
+        """
+        space = []
+        if index_mode == "hnsw":
+            ef_values = sorted({max(ef, top_k) for ef in INDEX_TUNING_CONFIG["ef_candidates"]})
+            for m in INDEX_TUNING_CONFIG["hnsw_m"]:
+                build_params = {"M": m, "efConstruction": INDEX_TUNING_CONFIG["hnsw_ef_construction"]}
+                space.append((build_params, [{"ef": ef} for ef in ef_values]))
+            return space
+
+        base_nlist = default_index_params(index_mode, num_vectors)["nlist"]
+        nlists = sorted({
+            max(1, min(int(base_nlist * factor), num_vectors, 65536))
+            for factor in INDEX_TUNING_CONFIG["nlist_factors"]
+        })
+        for nlist in nlists:
+            nprobes = sorted({2 ** power for power in range(int(np.log2(nlist)) + 1)} | {nlist})
+            space.append(({"nlist": nlist}, [{"nprobe": nprobe} for nprobe in nprobes]))
+        return space
+
+    def _measure_build(self, index_mode: str, build_params: Dict[str, Any], search_space: List[Dict[str, Any]],
+                       vectors: np.ndarray, query_vectors: np.ndarray, ground_truth: List[List[int]],
+                       top_k: int, target_recall: float) -> List[Dict[str, Any]]:
+        """
+        构建一个候选索引并扫描检索参数，达到目标召回率后停止（更大的参数只会更慢）
+
+        参数:
+            index_mode: 索引模式
+            build_params: 构建参数
+            search_space: 按代价从小到大排列的检索参数
+            vectors: 全部向量
+            query_vectors: 查询向量
+            ground_truth: 每个查询的精确 top-k 行号
+            top_k: 返回的结果数
+            target_recall: 目标召回率
+
+        返回:
+            每组检索参数的测量结果
+        """
+        target_dir = os.path.join(self.work_dir, uuid.uuid4().hex[:8])
+        os.makedirs(target_dir, exist_ok=True)
+        built = None
+        measured = []
+        try:
+            start = time.perf_counter()
+            built = BenchmarkService(work_dir=self.work_dir)._build_milvus(index_mode, vectors, target_dir, build_params)
+            build_seconds = round(time.perf_counter() - start, 4)
+            for search_params in search_space:
+                latencies = []
+                recalls = []
+                for query, expected in zip(query_vectors, ground_truth):
+                    start = time.perf_counter()
+                    found = built.search(query, top_k, search_params)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    recalls.append(len(set(found) & set(expected)) / max(len(expected), 1))
+                measured.append({
+                    "build_params": build_params,
+                    "search_params": search_params,
+                    "recall_at_k": round(float(np.mean(recalls)), 4),
+                    "latency_mean_ms": round(float(np.mean(latencies)), 3),
+                    "build_seconds": build_seconds
+                })
+                if measured[-1]["recall_at_k"] >= target_recall:
+                    break
+        except Exception as e:
+            logger.warning(f"Tuning candidate {build_params} failed: {str(e)}")
+        finally:
+            if built is not None:
+                try:
+                    built.cleanup()
+                except Exception as e:
+                    logger.warning(f"Error cleaning up tuning candidate {build_params}: {str(e)}")
+            shutil.rmtree(target_dir, ignore_errors=True)
+        return measured
+
+    def _choose(self, candidates: List[Dict[str, Any]], target_recall: float) -> Dict[str, Any]:
+        """
+        选出满足目标召回率且平均延迟最低的候选；都不满足时选召回率最高的
+
+        参数:
+            candidates: 全部测量结果
+            target_recall: 目标召回率
+
+        返回:
+            选中的候选
+        """
+        if not candidates:
+            raise ValueError("No tuning candidate could be built")
+        qualified = [candidate for candidate in candidates if candidate["recall_at_k"] >= target_recall]
+        if qualified:
+            return min(qualified, key=lambda candidate: candidate["latency_mean_ms"])
+        logger.warning(f"No candidate reached recall {target_recall}, using the most accurate one")
+        return max(candidates, key=lambda candidate: (candidate["recall_at_k"], -candidate["latency_mean_ms"]))
+
+    def _rebuild_index(self, collection: Collection, index_type: str, metric_type: str, build_params: Dict[str, Any]):
+        """
+        用调优后的构建参数重建集合的索引
+
+        参数:
+            collection: 集合
+            index_type: 索引类型
+            metric_type: 度量类型
+            build_params: 构建参数
+        """
+        forget_milvus_collection(collection.name)
+        with self.milvus.call(timeout=MILVUS_CONFIG["index_timeout"]) as ctx:
+            collection.release(timeout=ctx.timeout)
+            collection.drop_index(timeout=ctx.timeout)
+            collection.create_index(
+                field_name="vector",
+                index_params={"metric_type": metric_type, "index_type": index_type, "params": build_params},
+                timeout=ctx.timeout
+            )
+            collection.load(timeout=ctx.timeout)
+        logger.info(f"Rebuilt {index_type} index of {collection.name} with {build_params}")
@@ -0,0 +1,144 @@
+import os
+import json
+import math
+import logging
+import threading
+from typing import Any, Dict, Optional
+from utils.config import INDEX_TUNING_CONFIG, MILVUS_CONFIG
+
+logger = logging.getLogger(__name__)
+
+def default_index_params(index_mode: str, num_vectors: int) -> Dict[str, Any]:
+    """
+    按数据量生成未调优集合的索引参数
+
+    IVF 类索引的 nlist 取 nlist_per_sqrt_n * sqrt(n)，并限制在 [1, min(n, 65536)]，
+    避免小集合出现空的聚类、大集合聚类过少；其他索引沿用 MILVUS_CONFIG 中的参数。
+
+    参数:
+        index_mode: 索引模式
+        num_vectors: 向量数量
+
+    返回:
+        索引参数字典
+    """
+    params = dict(MILVUS_CONFIG["index_params"].get(index_mode, {}))
+    if "nlist" in params:
+        nlist = int(INDEX_TUNING_CONFIG["nlist_per_sqrt_n"] * math.sqrt(max(num_vectors, 1)))
+        params["nlist"] = max(1, min(nlist, num_vectors, 65536))
+    return params
+
+class IndexTuningStore:
+    """
+    按集合保存的调优结果（索引构建参数和检索参数）
+    """
+    def __init__(self, path: str):
+        """
+        初始化调优结果存储
+
+        参数:
+            path: JSON 文件路径
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        """读取全部调优结果（调用方需持有锁）"""
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write(self, entries: Dict[str, Dict[str, Any]]):
+        """写入全部调优结果（调用方需持有锁），先写临时文件再替换"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def get(self, collection_name: str) -> Optional[Dict[str, Any]]:
+        """
+        获取集合的调优结果
+
+        参数:
+            collection_name: 集合名称
+
+        返回:
+            调优结果，没有时返回 None
+        """
+        with self._lock:
+            return self._read().get(collection_name)
+
+    def save(self, collection_name: str, entry: Dict[str, Any]):
+        """
+        保存集合的调优结果
+
+        参数:
+            collection_name: 集合名称
+            entry: 调优结果
+        """
+        with self._lock:
+            entries = self._read()
+            entries[collection_name] = entry
+            self._write(entries)
+
+    def remove(self, collection_name: str):
+        """
+        删除集合的调优结果（删除集合时调用）
+
+        参数:
+            collection_name: 集合名称
+        """
+        with self._lock:
+            entries = self._read()
+            if entries.pop(collection_name, None) is not None:
+                self._write(entries)
+
+    def build_params(self, collection_name: str, index_mode: str) -> Optional[Dict[str, Any]]:
+        """
+        获取集合调优后的索引构建参数（索引模式一致时才返回）
+
+        参数:
+            collection_name: 集合名称
+            index_mode: 索引模式
+
+        返回:
+            索引参数字典，没有时返回 None
+        """
+        entry = self.get(collection_name)
+        if entry and entry.get("index_mode") == index_mode:
+            return dict(entry["build_params"])
+        return None
+
+    def search_params(self, collection_name: str, index_type: str) -> Optional[Dict[str, Any]]:
+        """
+        获取集合调优后的检索参数（索引类型一致时才返回）
+
+        参数:
+            collection_name: 集合名称
+            index_type: 集合当前的 Milvus 索引类型
+
+        返回:
+            检索参数字典，没有时返回 None
+        """
+        entry = self.get(collection_name)
+        if entry and entry.get("index_type") == index_type:
+            return dict(entry["search_params"])
+        return None
+
+_tuning_store: Optional[IndexTuningStore] = None
+_tuning_store_lock = threading.Lock()
+
+def get_index_tuning_store() -> IndexTuningStore:
+    """
+    获取进程内共享的调优结果存储
+
+    返回:
+        IndexTuningStore 实例
+    """
+    global _tuning_store
+    with _tuning_store_lock:
+        if _tuning_store is None:
+            _tuning_store = IndexTuningStore(INDEX_TUNING_CONFIG["path"])
+        return _tuning_store
@@ -0,0 +1,376 @@
+import os
+import json
+import logging
+import shutil
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import numpy as np
+from services.quantization import dequantize, quantize
+from utils.config import LOCAL_VECTOR_STORE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+"""
+进程内的精确向量检索（占用 VectorDBProvider.FAISS）
+
+每个集合保存为一个目录：vectors.npy（float32 矩阵）、records.json（文本和元数据）和 collection.json（集合信息）。
+检索时集合常驻内存，向量为连续的 float32 矩阵并预先计算好范数，
+一批查询只做一次矩阵乘法，再用 argpartition 取 top-k，不依赖任何外部服务。
+
+由量化后的嵌入结果创建的集合直接保存 float16 / int8 编码（量化参数在 quantization.json 中），
+内存占用与量化后的文件相同；检索时按块还原为 float32 再做矩阵乘法。
+"""
+
+# 量化集合检索时每次还原的行数
+_DEQUANTIZE_BLOCK_ROWS = 65536
+
+class LocalCollection:
+    """
+    已加载到内存的本地集合
+    """
+    def __init__(self, name: str, vectors: np.ndarray, records: List[Dict[str, Any]], info: Dict[str, Any],
+                 quantization: Optional[Dict[str, Any]] = None):
+        """
+        初始化集合
+
+        参数:
+            name: 集合名称
+            vectors: 向量矩阵，quantization 不为 None 时为量化编码
+            records: 与向量一一对应的 {"text", "metadata"} 列表
+            info: 集合信息
+            quantization: 量化参数，为None时 vectors 为 float32
+        """
+        self.name = name
+        self.quantization = quantization
+        if quantization:
+            self.vectors = np.ascontiguousarray(vectors)
+        else:
+            self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        norms = [np.linalg.norm(block, axis=1) for _, block in self._blocks()]
+        self.norms = np.maximum(np.concatenate(norms) if norms else np.zeros(0, dtype=np.float32), 1e-12)
+        self.records = records
+        self.info = info
+
+    def _blocks(self):
+        """
+        按块产生 float32 向量：未量化时为整个矩阵（不复制），量化时逐块还原
+
+        返回:
+            生成器，每次产生 (起始行, float32 块)
+        """
+        if not self.quantization:
+            yield 0, self.vectors
+            return
+        for start in range(0, self.vectors.shape[0], _DEQUANTIZE_BLOCK_ROWS):
+            yield start, dequantize(self.vectors[start:start + _DEQUANTIZE_BLOCK_ROWS], self.quantization)
+
+    def search(self, queries: np.ndarray, top_k: int) -> List[List[tuple]]:
+        """
+        批量计算余弦相似度并取 top-k
+
+        参数:
+            queries: 查询向量矩阵 (n, dim)
+            top_k: 每个查询返回的结果数
+
+        返回:
+            每个查询一个 [(行号, 相似度), ...] 列表，按相似度降序排列
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.vectors.shape[1])
+        top_k = min(top_k, self.vectors.shape[0])
+        if top_k <= 0:
+            return [[] for _ in range(queries.shape[0])]
+
+        query_norms = np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        scores = np.empty((queries.shape[0], self.vectors.shape[0]), dtype=np.float32)
+        for start, block in self._blocks():
+            scores[:, start:start + block.shape[0]] = queries @ block.T
+        scores = scores / query_norms / self.norms
+
+        if top_k < scores.shape[1]:
+            top = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        else:
+            top = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        return [list(zip(rows.tolist(), row_scores.tolist())) for rows, row_scores in zip(top, top_scores)]
+
+class LocalVectorStore:
+    """
+    本地集合的持久化与内存缓存
+    """
+    def __init__(self, root_dir: str):
+        """
+        初始化本地向量存储
+
+        参数:
+            root_dir: 集合保存目录
+        """
+        self.root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+        self._collections: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        # 每个集合一把写锁：读取旧集合 -> 修改 -> 写回 的整个过程互斥，并发写入不会丢失彼此的记录。
+        # 使用可重入锁，调用方可以持有锁完成 检查 -> 对比 -> 写入 的整个增量更新过程
+        self._write_locks: Dict[str, threading.RLock] = {}
+
+    def write_lock(self, name: str) -> threading.RLock:
+        """获取集合的写锁"""
+        with self._lock:
+            return self._write_locks.setdefault(name, threading.RLock())
+
+    def _collection_dir(self, name: str) -> str:
+        """获取集合目录，拒绝包含路径分隔符的名称"""
+        if not name or os.path.basename(name) != name or name in (".", ".."):
+            raise ValueError(f"Invalid collection name: {name}")
+        return os.path.join(self.root_dir, name)
+
+    def create_collection(self, name: str, vectors: np.ndarray, records: List[Dict[str, Any]], info: Dict[str, Any],
+                          quantization: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        创建并持久化一个集合
+
+        参数:
+            name: 集合名称
+            vectors: 向量矩阵，quantization 不为 None 时为量化编码
+            records: 与向量一一对应的 {"text", "metadata"} 列表（增量更新的集合还包含 "id"）
+            info: 集合信息（嵌入提供商、模型等）
+            quantization: 量化参数，为None时以 float32 保存
+
+        返回:
+            写入的集合信息
+        """
+        collection_dir = self._collection_dir(name)
+        with self.write_lock(name):
+            if os.path.exists(collection_dir):
+                raise ValueError(f"Collection already exists: {name}")
+            info = {**info, "name": name, "created_at": datetime.now().isoformat()}
+            info = self._write_collection(name, vectors, records, info, quantization)
+        logger.info(f"Created local collection {name} with {info['count']} {info['vector_dtype']} vectors")
+        return info
+
+    def document_ids(self, name: str, document_name: str) -> List[str]:
+        """
+        获取集合中某个文档的全部记录ID（用于增量更新）
+
+        参数:
+            name: 集合名称
+            document_name: 文档名称
+
+        返回:
+            记录ID列表
+        """
+        collection = self.get_collection(name)
+        return [
+            record["id"] for record in collection.records
+            if record.get("id") is not None and record["metadata"].get("document_name") == document_name
+        ]
+
+    def apply_changes(self, name: str, delete_ids: List[str], vectors: np.ndarray, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        删除指定ID的记录并追加新记录，然后整体重写集合文件
+
+        量化集合中新增的向量按集合的量化参数编码（int8 超出原校准范围的值会被截断）。
+
+        参数:
+            name: 集合名称
+            delete_ids: 需要删除的记录ID
+            vectors: 新增的 float32 向量矩阵
+            records: 新增的 {"id", "text", "metadata"} 列表
+
+        返回:
+            更新后的集合信息
+        """
+        new_vectors = np.asarray(vectors, dtype=np.float32)
+        with self.write_lock(name):
+            collection = self.get_collection(name)
+            delete_ids = set(delete_ids)
+            keep = [idx for idx, record in enumerate(collection.records) if record.get("id") not in delete_ids]
+            new_vectors = new_vectors.reshape(-1, collection.vectors.shape[1])
+            if collection.quantization:
+                new_vectors = quantize(new_vectors, collection.quantization)
+            merged_vectors = np.concatenate([collection.vectors[keep], new_vectors])
+            merged_records = [collection.records[idx] for idx in keep] + list(records)
+            info = {**collection.info, "updated_at": datetime.now().isoformat()}
+            return self._write_collection(name, merged_vectors, merged_records, info, collection.quantization)
+
+    def _write_collection(self, name: str, vectors: np.ndarray, records: List[Dict[str, Any]], info: Dict[str, Any],
+                          quantization: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        写入集合文件并替换内存中的缓存（调用方需持有集合的写锁）
+
+        先写入临时目录，全部文件写完后再替换原目录，读取方不会看到写了一半的集合。
+
+        参数:
+            name: 集合名称
+            vectors: 向量矩阵，quantization 不为 None 时为量化编码
+            records: 与向量一一对应的记录列表
+            info: 集合信息
+            quantization: 量化参数
+
+        返回:
+            写入的集合信息（count、dimension 和 vector_dtype 按实际数据更新）
+        """
+        if quantization:
+            # 只保留还原所需的参数
+            quantization = {key: quantization[key] for key in ("dtype", "offset", "scale") if key in quantization}
+            vectors = np.ascontiguousarray(vectors)
+        else:
+            vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.shape[0] != len(records):
+            raise ValueError(f"Got {vectors.shape[0]} vectors but {len(records)} records")
+        info = {
+            **info,
+            "count": int(vectors.shape[0]),
+            "dimension": int(vectors.shape[1]) if vectors.ndim == 2 else 0,
+            "vector_dtype": quantization["dtype"] if quantization else "float32"
+        }
+
+        collection_dir = self._collection_dir(name)
+        tmp_dir = collection_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        np.save(os.path.join(tmp_dir, "vectors.npy"), vectors)
+        with open(os.path.join(tmp_dir, "records.json"), "w", encoding="utf-8") as f:
+            json.dump(records, f, ensure_ascii=False)
+        with open(os.path.join(tmp_dir, "collection.json"), "w", encoding="utf-8") as f:
+            json.dump(info, f, ensure_ascii=False, indent=2)
+        if quantization:
+            with open(os.path.join(tmp_dir, "quantization.json"), "w", encoding="utf-8") as f:
+                json.dump(quantization, f)
+
+        old_dir = collection_dir + ".old"
+        with self._lock:
+            if os.path.exists(collection_dir):
+                shutil.rmtree(old_dir, ignore_errors=True)
+                os.replace(collection_dir, old_dir)
+            os.replace(tmp_dir, collection_dir)
+            shutil.rmtree(old_dir, ignore_errors=True)
+            self._collections[name] = (
+                self._mtime(collection_dir), LocalCollection(name, vectors, records, info, quantization)
+            )
+        return info
+
+    def get_collection(self, name: str) -> LocalCollection:
+        """
+        获取集合，未加载或文件已更新时从磁盘加载
+
+        参数:
+            name: 集合名称
+
+        返回:
+            LocalCollection 实例
+        """
+        collection_dir = self._collection_dir(name)
+        if not os.path.exists(collection_dir):
+            raise ValueError(f"Collection not found: {name}")
+        mtime = self._mtime(collection_dir)
+        with self._lock:
+            cached = self._collections.get(name)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+
+        vectors = np.load(os.path.join(collection_dir, "vectors.npy"))
+        with open(os.path.join(collection_dir, "records.json"), "r", encoding="utf-8") as f:
+            records = json.load(f)
+        info = self._read_info(collection_dir)
+        quantization = None
+        quantization_path = os.path.join(collection_dir, "quantization.json")
+        if os.path.exists(quantization_path):
+            with open(quantization_path, "r", encoding="utf-8") as f:
+                quantization = json.load(f)
+        collection = LocalCollection(name, vectors, records, info, quantization)
+        with self._lock:
+            self._collections[name] = (mtime, collection)
+        logger.info(f"Loaded local collection {name} ({vectors.shape[0]} vectors)")
+        return collection
+
+    def list_collections(self) -> List[Dict[str, Any]]:
+        """
+        列出全部集合的信息（只读取 collection.json）
+
+        返回:
+            集合信息列表
+        """
+        collections = []
+        for name in sorted(os.listdir(self.root_dir)):
+            collection_dir = os.path.join(self.root_dir, name)
+            if name.endswith((".tmp", ".old")) or not os.path.isdir(collection_dir):
+                continue
+            try:
+                collections.append(self._read_info(collection_dir))
+            except Exception as e:
+                logger.error(f"Error reading local collection {name}: {str(e)}")
+        return collections
+
+    def has_collection(self, name: str) -> bool:
+        """
+        判断集合是否存在
+
+        参数:
+            name: 集合名称
+
+        返回:
+            是否存在
+        """
+        return os.path.exists(self._collection_dir(name))
+
+    def collection_info(self, name: str) -> Dict[str, Any]:
+        """
+        获取集合信息
+
+        参数:
+            name: 集合名称
+
+        返回:
+            集合信息字典
+        """
+        return self._read_info(self._collection_dir(name))
+
+    def delete_collection(self, name: str) -> bool:
+        """
+        删除集合
+
+        参数:
+            name: 集合名称
+
+        返回:
+            集合存在并被删除时返回 True
+        """
+        collection_dir = self._collection_dir(name)
+        with self.write_lock(name):
+            with self._lock:
+                self._collections.pop(name, None)
+            if not os.path.exists(collection_dir):
+                return False
+            shutil.rmtree(collection_dir)
+            return True
+
+    @staticmethod
+    def _read_info(collection_dir: str) -> Dict[str, Any]:
+        """读取集合信息文件"""
+        with open(os.path.join(collection_dir, "collection.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _mtime(collection_dir: str) -> float:
+        """以集合信息文件的修改时间判断集合是否被重写"""
+        return os.path.getmtime(os.path.join(collection_dir, "collection.json"))
+
+_local_store: Optional[LocalVectorStore] = None
+_local_store_lock = threading.Lock()
+
+def get_local_vector_store() -> LocalVectorStore:
+    """
+    获取进程内共享的本地向量存储，已加载的集合在请求之间复用
+
+    返回:
+        LocalVectorStore 实例
+    """
+    global _local_store
+    with _local_store_lock:
+        if _local_store is None:
+            _local_store = LocalVectorStore(LOCAL_VECTOR_STORE_CONFIG["path"])
+        return _local_store
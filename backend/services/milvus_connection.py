@@ -0,0 +1,146 @@
+import os
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+from pymilvus import connections, utility
+from utils.config import MILVUS_CONFIG
+
+logger = logging.getLogger(__name__)
+
+class MilvusCall:
+    """
+    单次 Milvus 调用的上下文，携带连接别名和超时时间
+    """
+    def __init__(self, alias: str, timeout: Optional[float]):
+        self.alias = alias
+        self.timeout = timeout
+
+class MilvusConnectionManager:
+    """
+    进程内共享的 Milvus 连接管理器
+
+    首次使用时才建立连接，之后所有请求复用同一个连接别名。别名带有进程号和随机后缀，
+    不会与其他代码使用的 "default" 别名互相干扰。距离上次健康检查超过间隔时先检查连接，
+    失败时重新连接；调用过程中出现异常也会让下一次调用重新检查。
+    """
+    def __init__(self, uri: str, timeout: float, health_check_interval: float):
+        """
+        初始化连接管理器（不立即连接）
+
+        参数:
+            uri: Milvus 地址或 Milvus Lite 数据库文件路径
+            timeout: 默认的单次调用超时时间（秒）
+            health_check_interval: 健康检查间隔（秒）
+        """
+        self.uri = uri
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.alias = f"rag_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._connected = False
+        self._last_check = 0.0
+        self.reconnects = 0
+
+    def _connect(self):
+        """建立连接（调用方需持有锁）"""
+        connections.connect(alias=self.alias, uri=self.uri, timeout=self.timeout)
+        self._connected = True
+        self._last_check = time.monotonic()
+        logger.info(f"Connected to Milvus at {self.uri} (alias {self.alias})")
+
+    def _healthy(self) -> bool:
+        """检查连接是否可用（调用方需持有锁）"""
+        try:
+            utility.list_collections(using=self.alias, timeout=self.timeout)
+            return True
+        except Exception as e:
+            logger.warning(f"Milvus health check failed: {str(e)}")
+            return False
+
+    def ensure_connected(self) -> str:
+        """
+        确保连接可用，必要时建立或重建连接
+
+        返回:
+            连接别名
+        """
+        with self._lock:
+            if not self._connected:
+                self._connect()
+            elif time.monotonic() - self._last_check > self.health_check_interval:
+                if not self._healthy():
+                    try:
+                        connections.disconnect(self.alias)
+                    except Exception:
+                        pass
+                    self._connected = False
+                    self._connect()
+                    self.reconnects += 1
+                self._last_check = time.monotonic()
+            return self.alias
+
+    @contextmanager
+    def call(self, timeout: Optional[float] = None):
+        """
+        获取一次调用的上下文
+
+        用法:
+            with manager.call(timeout=5) as ctx:
+                utility.list_collections(using=ctx.alias, timeout=ctx.timeout)
+
+        参数:
+            timeout: 本次调用的超时时间，为None时使用默认值
+
+        返回:
+            MilvusCall 上下文
+        """
+        alias = self.ensure_connected()
+        try:
+            yield MilvusCall(alias, timeout if timeout is not None else self.timeout)
+        except Exception:
+            # 调用失败可能是连接断开，下一次调用先做健康检查
+            self.request_health_check()
+            raise
+
+    def request_health_check(self):
+        """让下一次调用前先做健康检查"""
+        with self._lock:
+            self._last_check = 0.0
+
+    def close(self):
+        """断开连接，在应用退出时调用"""
+        with self._lock:
+            if self._connected:
+                try:
+                    connections.disconnect(self.alias)
+                finally:
+                    self._connected = False
+
+_connection_manager: Optional[MilvusConnectionManager] = None
+_connection_manager_lock = threading.Lock()
+
+def get_milvus_connection_manager() -> MilvusConnectionManager:
+    """
+    获取进程内共享的 Milvus 连接管理器
+
+    返回:
+        MilvusConnectionManager 实例
+    """
+    global _connection_manager
+    with _connection_manager_lock:
+        if _connection_manager is None:
+            _connection_manager = MilvusConnectionManager(
+                uri=MILVUS_CONFIG["uri"],
+                timeout=MILVUS_CONFIG["timeout"],
+                health_check_interval=MILVUS_CONFIG["health_check_interval"]
+            )
+        return _connection_manager
+
+def close_milvus_connection():
+    """关闭共享连接（未创建过连接时不做任何事）"""
+    with _connection_manager_lock:
+        if _connection_manager is not None:
+            _connection_manager.close()
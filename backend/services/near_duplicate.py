@@ -0,0 +1,334 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Set
+import numpy as np
+from services.embedding_cache import normalize_text
+from utils.config import NEAR_DUPLICATE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+"""
+基于 MinHash + LSH 的近重复文本块检测
+
+对每个文本块取字符 n-gram（shingle）集合，用 MinHash 签名估计 Jaccard 相似度，
+再按 LSH 分段（band）把签名分桶，只有落入同一个桶的文本块才会作为候选进行精确比较。
+使用字符级 shingle，对中文等不以空格分词的文本同样适用。
+
+增量更新的集合还按 (provider, 集合) 保存已索引文本块的 MinHash 签名（SignatureStore），
+新文档的文本块同时与集合中其他文档的文本块比较；与已有文本块只能用签名估计相似度（不保存原文）。
+"""
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+def shingles(text: str, size: int = 5) -> Set[str]:
+    """
+    提取文本的字符 n-gram 集合
+
+    参数:
+        text: 文本
+        size: n-gram 长度
+
+    返回:
+        shingle 集合，文本短于 size 时返回整个文本
+    """
+    text = normalize_text(text).lower()
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    """
+    计算两个集合的 Jaccard 相似度
+
+    参数:
+        a: 集合a
+        b: 集合b
+
+    返回:
+        相似度，两个空集合视为完全相同
+    """
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+def lsh_params(num_perm: int, threshold: float, false_positive_weight: float = 0.2) -> tuple:
+    """
+    选择 LSH 的分段数和每段行数
+
+    文本块成为候选的概率为 P(s) = 1 - (1 - s^r)^b。在阈值两侧分别对漏检（s >= 阈值但未成为候选）
+    和误检（s < 阈值却成为候选）的概率积分，选择加权误差最小的组合。由于候选还会做精确比较，
+    误检只增加计算量，因此默认更看重减少漏检。
+
+    参数:
+        num_perm: MinHash 签名长度
+        threshold: 相似度阈值
+        false_positive_weight: 误检的权重，漏检权重为 1 - false_positive_weight
+
+    返回:
+        (bands, rows)
+    """
+    if not 0 < threshold <= 1:
+        raise ValueError(f"Similarity threshold must be in (0, 1], got {threshold}")
+    best = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        below = np.linspace(0.0, threshold, 200)
+        above = np.linspace(threshold, 1.0, 200)
+        # 用区间内的平均概率乘以区间宽度近似积分
+        false_positive = np.mean(1 - (1 - below ** rows) ** bands) * threshold
+        false_negative = np.mean((1 - above ** rows) ** bands) * (1 - threshold)
+        error = false_positive_weight * false_positive + (1 - false_positive_weight) * false_negative
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+class MinHasher:
+    """
+    MinHash 签名计算器，使用 (a * h + b) mod p 形式的随机哈希族
+    """
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        """
+        初始化 MinHash 计算器
+
+        参数:
+            num_perm: 签名长度（哈希函数个数）
+            seed: 随机种子
+        """
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = rng.randint(1, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingle_set: Set[str]) -> np.ndarray:
+        """
+        计算集合的 MinHash 签名
+
+        参数:
+            shingle_set: shingle 集合
+
+        返回:
+            长度为 num_perm 的 uint64 数组
+        """
+        if not shingle_set:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingle_set),
+            dtype=np.uint64,
+            count=len(shingle_set)
+        )
+        permuted = ((hashes[:, None] * self.a + self.b) % _MERSENNE_PRIME) & _MAX_HASH
+        return permuted.min(axis=0)
+
+class NearDuplicateDetector:
+    """
+    近重复检测器
+
+    按顺序处理文本块，每个文本块与之前保留的文本块比较，相似度达到阈值时标记为该保留块的近重复。
+    """
+    def __init__(self, threshold: float = 0.9, num_perm: int = 128, shingle_size: int = 5):
+        """
+        初始化检测器
+
+        参数:
+            threshold: Jaccard 相似度阈值
+            num_perm: MinHash 签名长度
+            shingle_size: 字符 n-gram 长度
+        """
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.hasher = MinHasher(num_perm)
+        self.bands, self.rows = lsh_params(num_perm, threshold)
+
+    def signatures(self, texts: List[str]) -> np.ndarray:
+        """
+        计算文本的 MinHash 签名矩阵
+
+        参数:
+            texts: 文本列表
+
+        返回:
+            (len(texts), num_perm) 的 uint64 矩阵
+        """
+        signatures = np.empty((len(texts), self.hasher.num_perm), dtype=np.uint64)
+        for idx, text in enumerate(texts):
+            signatures[idx] = self.hasher.signature(shingles(text, self.shingle_size))
+        return signatures
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        """签名按 LSH 分段后的桶键"""
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def find_duplicates(self, texts: List[str], signatures: Optional[np.ndarray] = None,
+                        existing_signatures: Optional[np.ndarray] = None) -> List[Optional[Dict]]:
+        """
+        查找近重复文本块
+
+        参数:
+            texts: 文本列表
+            signatures: 预先计算的 texts 的签名矩阵，为None时在这里计算
+            existing_signatures: 集合中已有文本块的签名矩阵，为None时只在 texts 内部比较
+
+        返回:
+            与 texts 等长的列表；保留的文本块为 None，与 texts 中之前的块重复时为
+            {"duplicate_of": 下标, "similarity": 相似度}，与已有文本块重复时为
+            {"duplicate_of_existing": 已有文本块下标, "similarity": 估计的相似度}
+        """
+        buckets = [{} for _ in range(self.bands)]
+        existing_buckets = [{} for _ in range(self.bands)]
+        if existing_signatures is not None:
+            for idx, signature in enumerate(existing_signatures):
+                for band, key in enumerate(self._band_keys(signature)):
+                    existing_buckets[band].setdefault(key, []).append(idx)
+        shingle_sets = []
+        results: List[Optional[Dict]] = []
+
+        for idx, text in enumerate(texts):
+            shingle_set = shingles(text, self.shingle_size)
+            shingle_sets.append(shingle_set)
+            signature = signatures[idx] if signatures is not None else self.hasher.signature(shingle_set)
+            band_keys = self._band_keys(signature)
+
+            candidates = set()
+            existing_candidates = set()
+            for band, key in enumerate(band_keys):
+                candidates.update(buckets[band].get(key, ()))
+                existing_candidates.update(existing_buckets[band].get(key, ()))
+
+            # 候选只来自已保留的文本块，用精确 Jaccard 相似度确认
+            best = None
+            for candidate in sorted(candidates):
+                similarity = jaccard(shingle_set, shingle_sets[candidate])
+                if similarity >= self.threshold and (best is None or similarity > best["similarity"]):
+                    best = {"duplicate_of": candidate, "similarity": similarity}
+            # 已有文本块没有原文，用签名中相同位置取值相等的比例估计 Jaccard 相似度
+            for candidate in sorted(existing_candidates):
+                similarity = float(np.mean(existing_signatures[candidate] == signature))
+                if similarity >= self.threshold and (best is None or similarity > best["similarity"]):
+                    best = {"duplicate_of_existing": candidate, "similarity": similarity}
+
+            results.append(best)
+            if best is None:
+                for band, key in enumerate(band_keys):
+                    buckets[band].setdefault(key, []).append(idx)
+
+        logger.info(f"Near-duplicate detection: {sum(r is not None for r in results)}/{len(texts)} duplicates")
+        return results
+
+class SignatureStore:
+    """
+    按 (provider, 集合) 保存的已索引文本块 MinHash 签名
+
+    每个集合一个目录：signatures.npy（签名矩阵）和 records.json（与签名一一对应的 {"document_name", "chunk_id"}）。
+    """
+    def __init__(self, root_dir: str):
+        """
+        初始化签名存储
+
+        参数:
+            root_dir: 签名保存目录
+        """
+        self.root_dir = root_dir
+        self._lock = threading.Lock()
+        # 每个集合一把写锁：读取 -> 替换文档 -> 写回 的整个过程互斥
+        self._write_locks: Dict[tuple, threading.Lock] = {}
+
+    def _write_lock(self, provider: str, collection_name: str) -> threading.Lock:
+        """获取集合的写锁"""
+        with self._lock:
+            return self._write_locks.setdefault((provider, collection_name), threading.Lock())
+
+    def _collection_dir(self, provider: str, collection_name: str) -> str:
+        """获取集合的签名目录，拒绝包含路径分隔符的名称"""
+        for name in (provider, collection_name):
+            if not name or os.path.basename(name) != name or name in (".", ".."):
+                raise ValueError(f"Invalid signature store name: {provider}/{collection_name}")
+        return os.path.join(self.root_dir, provider, collection_name)
+
+    def get(self, provider: str, collection_name: str) -> Optional[tuple]:
+        """
+        读取集合的签名
+
+        参数:
+            provider: 向量数据库提供商
+            collection_name: 集合名称
+
+        返回:
+            (签名矩阵, 记录列表)，集合没有保存签名时返回 None
+        """
+        collection_dir = self._collection_dir(provider, collection_name)
+        if not os.path.exists(os.path.join(collection_dir, "records.json")):
+            return None
+        signatures = np.load(os.path.join(collection_dir, "signatures.npy"))
+        with open(os.path.join(collection_dir, "records.json"), "r", encoding="utf-8") as f:
+            records = json.load(f)
+        return signatures, records
+
+    def replace_document(self, provider: str, collection_name: str, document_name: str,
+                         signatures: np.ndarray, records: List[Dict[str, Any]]) -> int:
+        """
+        替换集合中某个文档的全部签名，集合还没有签名时新建
+
+        参数:
+            provider: 向量数据库提供商
+            collection_name: 集合名称
+            document_name: 文档名称
+            signatures: 该文档文本块的签名矩阵
+            records: 与签名一一对应的 {"document_name", "chunk_id"}
+
+        返回:
+            集合中的签名总数
+        """
+        with self._write_lock(provider, collection_name):
+            stored = self.get(provider, collection_name)
+            if stored is not None and stored[0].shape[1] == signatures.shape[1]:
+                keep = [idx for idx, record in enumerate(stored[1]) if record.get("document_name") != document_name]
+                signatures = np.concatenate([stored[0][keep], signatures])
+                records = [stored[1][idx] for idx in keep] + list(records)
+            elif stored is not None:
+                logger.warning(f"Discarding signatures of {provider}/{collection_name} computed with a different num_perm")
+
+            collection_dir = self._collection_dir(provider, collection_name)
+            tmp_dir = collection_dir + ".tmp"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            np.save(os.path.join(tmp_dir, "signatures.npy"), signatures)
+            with open(os.path.join(tmp_dir, "records.json"), "w", encoding="utf-8") as f:
+                json.dump(records, f, ensure_ascii=False)
+            shutil.rmtree(collection_dir, ignore_errors=True)
+            os.replace(tmp_dir, collection_dir)
+        return len(records)
+
+    def delete(self, provider: str, collection_name: str):
+        """
+        删除集合的签名（删除集合时调用）
+
+        参数:
+            provider: 向量数据库提供商
+            collection_name: 集合名称
+        """
+        collection_dir = self._collection_dir(provider, collection_name)
+        with self._write_lock(provider, collection_name):
+            shutil.rmtree(collection_dir, ignore_errors=True)
+
+_signature_store: Optional[SignatureStore] = None
+_signature_store_lock = threading.Lock()
+
+def get_signature_store() -> SignatureStore:
+    """
+    获取进程内共享的签名存储
+
+    返回:
+        SignatureStore 实例
+    """
+    global _signature_store
+    with _signature_store_lock:
+        if _signature_store is None:
+            _signature_store = SignatureStore(NEAR_DUPLICATE_CONFIG["path"])
+        return _signature_store
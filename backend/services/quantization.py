@@ -0,0 +1,148 @@
+import logging
+from typing import Any, Dict, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+"""
+向量降精度存储（float16 / int8 标量量化）
+
+int8 量化按维度校准：offset 为该维度的最小值，scale 为 (最大值 - 最小值) / 255，
+存储值为 round((x - offset) / scale) - 128。float16 直接转换，不需要校准参数。
+"""
+
+SUPPORTED_DTYPES = ("float16", "int8")
+
+def calibrate(vectors: np.ndarray, dtype: str, block_size: int = 8192) -> Dict[str, Any]:
+    """
+    计算量化参数
+
+    参数:
+        vectors: float32 向量矩阵（可以是 memmap，按块读取）
+        dtype: 量化类型，float16 或 int8
+        block_size: 按块计算统计量时的块大小
+
+    返回:
+        量化参数字典
+    """
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported quantization dtype: {dtype}")
+    if dtype == "float16":
+        return {"dtype": "float16"}
+
+    minimum = np.full(vectors.shape[1], np.inf, dtype=np.float32)
+    maximum = np.full(vectors.shape[1], -np.inf, dtype=np.float32)
+    for start in range(0, vectors.shape[0], block_size):
+        block = np.asarray(vectors[start:start + block_size], dtype=np.float32)
+        minimum = np.minimum(minimum, block.min(axis=0))
+        maximum = np.maximum(maximum, block.max(axis=0))
+    # 常量维度的 scale 置为 1，避免除零
+    scale = np.where(maximum > minimum, (maximum - minimum) / 255.0, 1.0).astype(np.float32)
+    return {"dtype": "int8", "offset": minimum.tolist(), "scale": scale.tolist()}
+
+def quantize(vectors: np.ndarray, params: Dict[str, Any]) -> np.ndarray:
+    """
+    按量化参数量化向量
+
+    参数:
+        vectors: float32 向量矩阵
+        params: calibrate 返回的量化参数
+
+    返回:
+        float16 或 int8 矩阵
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if params["dtype"] == "float16":
+        return vectors.astype(np.float16)
+    offset = np.asarray(params["offset"], dtype=np.float32)
+    scale = np.asarray(params["scale"], dtype=np.float32)
+    codes = np.rint((vectors - offset) / scale) - 128
+    return np.clip(codes, -128, 127).astype(np.int8)
+
+def dequantize(codes: np.ndarray, params: Optional[Dict[str, Any]]) -> np.ndarray:
+    """
+    把量化后的向量还原为 float32
+
+    参数:
+        codes: 量化后的矩阵
+        params: 量化参数，为 None 时表示未量化
+
+    返回:
+        float32 矩阵
+    """
+    if not params or params["dtype"] == "float16":
+        return np.asarray(codes, dtype=np.float32)
+    offset = np.asarray(params["offset"], dtype=np.float32)
+    scale = np.asarray(params["scale"], dtype=np.float32)
+    return (np.asarray(codes, dtype=np.float32) + 128) * scale + offset
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """
+    对矩阵逐行做 L2 归一化
+
+    参数:
+        vectors: 向量矩阵
+
+    返回:
+        归一化后的 float32 矩阵
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def measure_recall(vectors: np.ndarray, params: Dict[str, Any], k: int = 10, sample_size: int = 200,
+                   max_corpus: int = 50000, seed: int = 0) -> Dict[str, Any]:
+    """
+    测量量化对检索召回率的影响
+
+    从向量中抽样作为查询，分别在原始向量和量化还原后的向量上做精确余弦检索，
+    计算量化结果的 top-k 与原始 top-k 的平均重合比例（recall@k）。
+
+    参数:
+        vectors: 原始 float32 向量矩阵
+        params: 量化参数
+        k: 比较的 top-k
+        sample_size: 抽样查询数
+        max_corpus: 参与比较的最大向量数，超过时随机抽样子集，控制内存占用
+        seed: 随机种子
+
+    返回:
+        包含 recall@k、k 和实际抽样数的字典
+    """
+    rng = np.random.default_rng(seed)
+    total = vectors.shape[0]
+    if total > max_corpus:
+        corpus = np.asarray(vectors[np.sort(rng.choice(total, size=max_corpus, replace=False))], dtype=np.float32)
+    else:
+        corpus = np.asarray(vectors[:], dtype=np.float32)
+    total = corpus.shape[0]
+    k = min(k, total)
+    if total == 0 or k == 0:
+        return {"recall_at_k": 1.0, "k": k, "sample_size": 0}
+
+    query_rows = rng.choice(total, size=min(sample_size, total), replace=False)
+    exact = normalize_rows(corpus)
+    approx = normalize_rows(dequantize(quantize(corpus, params), params))
+
+    overlaps = []
+    # 分组计算，避免生成过大的相似度矩阵
+    for start in range(0, len(query_rows), 32):
+        queries = exact[query_rows[start:start + 32]]
+        exact_top = np.argpartition(-(queries @ exact.T), k - 1, axis=1)[:, :k]
+        approx_top = np.argpartition(-(queries @ approx.T), k - 1, axis=1)[:, :k]
+        overlaps.extend(len(set(a) & set(b)) / k for a, b in zip(exact_top, approx_top))
+    return {"recall_at_k": float(np.mean(overlaps)), "k": k, "sample_size": int(len(query_rows))}
+
+def rescore(query: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+    """
+    用全精度向量重新计算候选的余弦相似度
+
+    参数:
+        query: 查询向量
+        candidates: 候选向量矩阵
+
+    返回:
+        与候选顺序一致的余弦相似度数组
+    """
+    query = normalize_rows(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+    return normalize_rows(candidates) @ query
@@ -0,0 +1,194 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from services.embedding_cache import content_hash
+from utils.config import RERANK_CONFIG
+
+logger = logging.getLogger(__name__)
+
+class RerankScoreCache:
+    """
+    (查询, 文本块) 打分结果的内存缓存（LRU）
+
+    以 (模型名称, 查询哈希, 文本块ID) 为键。文本块ID由文档名称、块编号和内容哈希组成，
+    文本块重新索引后内容变化时不会命中旧的分数。
+    """
+    def __init__(self, max_entries: int):
+        """
+        初始化缓存
+
+        参数:
+            max_entries: 最大条目数
+        """
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys: List[tuple]) -> List[Optional[float]]:
+        """
+        批量查询缓存
+
+        参数:
+            keys: 缓存键列表
+
+        返回:
+            与 keys 对应的分数列表，未命中的位置为 None
+        """
+        scores = []
+        with self._lock:
+            for key in keys:
+                score = self._entries.get(key)
+                if score is None:
+                    self.misses += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                scores.append(score)
+        return scores
+
+    def put_many(self, keys: List[tuple], scores: List[float]):
+        """
+        批量写入缓存，超过容量时淘汰最久未使用的条目
+
+        参数:
+            keys: 缓存键列表
+            scores: 与 keys 对应的分数
+        """
+        with self._lock:
+            for key, score in zip(keys, scores):
+                self._entries[key] = score
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0
+            }
+
+class CrossEncoderReranker:
+    """
+    基于本地交叉编码器的重排序器
+
+    模型只在 CPU 上加载一次；一次请求的全部未缓存 (查询, 文本块) 对在一次 predict 调用中批量打分。
+    """
+    def __init__(self, model_name: str, batch_size: int, max_length: int, cache: RerankScoreCache):
+        """
+        加载交叉编码器模型
+
+        参数:
+            model_name: 模型名称或本地路径
+            batch_size: 打分时的批大小
+            max_length: 输入的最大 token 数
+            cache: 打分结果缓存
+        """
+        # 只有启用重排序时才需要 sentence_transformers
+        from sentence_transformers import CrossEncoder
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache = cache
+        self.model = CrossEncoder(model_name, device="cpu", max_length=max_length)
+        self._lock = threading.Lock()
+        logger.info(f"Loaded cross-encoder {model_name} on CPU")
+
+    @staticmethod
+    def chunk_id(candidate: Dict[str, Any]) -> str:
+        """
+        生成文本块ID：文档名称、块编号和内容哈希
+
+        参数:
+            candidate: 检索结果
+
+        返回:
+            文本块ID
+        """
+        metadata = candidate.get("metadata") or {}
+        return f"{metadata.get('document_name', '')}#{metadata.get('chunk_id', '')}:{content_hash(candidate.get('text', ''))[:16]}"
+
+    def rerank(self, query: str, candidates: List[Dict[str, Any]], top_k: int) -> tuple:
+        """
+        对候选结果重新打分并取 top_k
+
+        参数:
+            query: 查询文本
+            candidates: 检索得到的候选结果
+            top_k: 返回的结果数
+
+        返回:
+            (带有 rerank_score 的结果列表（按分数降序）, {"candidates", "cache_hits", "scored"})
+        """
+        if not candidates:
+            return [], {"candidates": 0, "cache_hits": 0, "scored": 0}
+
+        query_hash = content_hash(query)
+        keys = [(self.model_name, query_hash, self.chunk_id(candidate)) for candidate in candidates]
+        scores = self.cache.get_many(keys)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            pairs = [(query, str(candidates[i].get("text", ""))) for i in missing]
+            # CrossEncoder 不保证线程安全，并发请求依次打分
+            with self._lock:
+                predicted = self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+            predicted = [float(score) for score in predicted]
+            for i, score in zip(missing, predicted):
+                scores[i] = score
+            self.cache.put_many([keys[i] for i in missing], predicted)
+
+        reranked = [
+            {**candidate, "rerank_score": score}
+            for candidate, score in sorted(zip(candidates, scores), key=lambda item: item[1], reverse=True)
+        ]
+        return reranked[:top_k], {
+            "candidates": len(candidates),
+            "cache_hits": len(candidates) - len(missing),
+            "scored": len(missing)
+        }
+
+_score_cache = RerankScoreCache(RERANK_CONFIG["cache_max_entries"])
+_rerankers: Dict[str, CrossEncoderReranker] = {}
+_rerankers_lock = threading.Lock()
+
+def get_reranker(model_name: str = None) -> CrossEncoderReranker:
+    """
+    获取进程内共享的重排序器，每个模型只加载一次
+
+    参数:
+        model_name: 模型名称，为None时使用默认配置
+
+    返回:
+        CrossEncoderReranker 实例
+    """
+    model_name = model_name or RERANK_CONFIG["model"]
+    with _rerankers_lock:
+        reranker = _rerankers.get(model_name)
+        if reranker is None:
+            reranker = CrossEncoderReranker(
+                model_name,
+                batch_size=RERANK_CONFIG["batch_size"],
+                max_length=RERANK_CONFIG["max_length"],
+                cache=_score_cache
+            )
+            _rerankers[model_name] = reranker
+        return reranker
+
+def rerank_stats() -> Dict[str, Any]:
+    """
+    重排序统计信息：已加载的模型和打分缓存
+
+    返回:
+        统计信息字典
+    """
+    with _rerankers_lock:
+        models = list(_rerankers.keys())
+    return {"models": models, "score_cache": _score_cache.stats()}
@@ -0,0 +1,205 @@
+import copy
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from services.embedding_cache import normalize_text
+from utils.config import SEARCH_RESULT_CACHE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+class CollectionVersions:
+    """
+    集合版本号
+
+    集合内容每次变化（索引、增量更新、删除、重建索引）时版本号加一。检索结果缓存的键中包含版本号，
+    集合变化后旧版本的条目不会再被命中，随后由 LRU 淘汰。
+    """
+    def __init__(self):
+        self._versions: Dict[tuple, int] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(provider, collection_name: str) -> tuple:
+        """生成集合键"""
+        return str(getattr(provider, "value", provider)).lower(), collection_name
+
+    def get(self, provider, collection_name: str) -> int:
+        """
+        获取集合当前的版本号
+
+        参数:
+            provider: 向量数据库提供商
+            collection_name: 集合名称
+
+        返回:
+            版本号
+        """
+        with self._lock:
+            return self._versions.get(self._key(provider, collection_name), 0)
+
+    def bump(self, provider, collection_name: str) -> int:
+        """
+        集合内容变化后递增版本号
+
+        参数:
+            provider: 向量数据库提供商
+            collection_name: 集合名称
+
+        返回:
+            新的版本号
+        """
+        key = self._key(provider, collection_name)
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            version = self._versions[key]
+        logger.info(f"Collection {key[0]}/{collection_name} is now at version {version}")
+        return version
+
+    def stats(self) -> Dict[str, Any]:
+        """版本号统计信息"""
+        with self._lock:
+            return {"tracked_collections": len(self._versions)}
+
+class SearchResultCache:
+    """
+    检索结果的内存缓存（LRU）
+
+    键由提供商、集合、集合版本号、规范化后的查询文本以及影响结果的其他检索参数组成。
+    写入和读取时都复制结果，调用方修改返回值不会影响缓存。
+    """
+    # 除查询文本外影响检索结果的参数及其默认值
+    RESULT_PARAMS = {
+        "top_k": 3,
+        "threshold": 0.7,
+        "mode": "dense",
+        "rescore": False,
+        "rerank": False,
+        "rerank_candidates": None
+    }
+
+    def __init__(self, max_entries: int):
+        """
+        初始化缓存
+
+        参数:
+            max_entries: 最大条目数
+        """
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def result_params(cls, search_params: Dict[str, Any]) -> tuple:
+        """
+        取出除查询文本外影响检索结果的参数（未指定的使用默认值）
+
+        参数:
+            search_params: 检索参数
+
+        返回:
+            (参数名, 参数值) 元组
+        """
+        return tuple(
+            (name, search_params.get(name) if search_params.get(name) is not None else default)
+            for name, default in cls.RESULT_PARAMS.items()
+        )
+
+    def key(self, search_params: Dict[str, Any], version: int) -> tuple:
+        """
+        生成缓存键
+
+        参数:
+            search_params: 检索参数
+            version: 集合版本号
+
+        返回:
+            缓存键
+        """
+        provider = search_params.get("provider", "milvus")
+        return (
+            str(getattr(provider, "value", provider)).lower(),
+            search_params.get("collection_id"),
+            version,
+            normalize_text(search_params.get("query") or ""),
+            self.result_params(search_params)
+        )
+
+    def get(self, key: tuple) -> Optional[Dict[str, Any]]:
+        """
+        查询缓存
+
+        参数:
+            key: 缓存键
+
+        返回:
+            检索结果的副本，未命中时返回 None
+        """
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return copy.deepcopy(result)
+
+    def put(self, key: tuple, result: Dict[str, Any]):
+        """
+        写入缓存，超过容量时淘汰最久未使用的条目
+
+        参数:
+            key: 缓存键
+            result: 检索结果
+        """
+        result = copy.deepcopy(result)
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / total if total else 0.0
+            }
+
+_collection_versions = CollectionVersions()
+_search_result_cache: Optional[SearchResultCache] = None
+_search_result_cache_lock = threading.Lock()
+
+def get_collection_versions() -> CollectionVersions:
+    """
+    获取进程内共享的集合版本号
+
+    返回:
+        CollectionVersions 实例
+    """
+    return _collection_versions
+
+def get_search_result_cache() -> Optional[SearchResultCache]:
+    """
+    获取进程内共享的检索结果缓存
+
+    返回:
+        SearchResultCache 实例，缓存被禁用时返回 None
+    """
+    global _search_result_cache
+    if not SEARCH_RESULT_CACHE_CONFIG.get("enabled", True):
+        return None
+    with _search_result_cache_lock:
+        if _search_result_cache is None:
+            _search_result_cache = SearchResultCache(SEARCH_RESULT_CACHE_CONFIG["max_entries"])
+        return _search_result_cache
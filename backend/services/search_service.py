@@ -1,12 +1,17 @@
 from typing import List, Dict, Any, Optional
+import asyncio
 import logging
+import time
 from datetime import datetime
 from pymilvus import connections, Collection, utility
 from services.embedding_service import EmbeddingService
-from utils.config import VectorDBProvider, MILVUS_CONFIG
+from utils.config import VectorDBProvider, MILVUS_CONFIG, RERANK_CONFIG, SEMANTIC_CACHE_CONFIG
 import os
 import json
 from services.vector_store_service import VectorStoreService
+from services.reranker import get_reranker
+from services.search_cache import SearchResultCache, get_search_result_cache, get_collection_versions
+from services.semantic_cache import get_semantic_cache, semantic_query_embedding
 
 logger = logging.getLogger(__name__)
 
@@ -91,7 +96,15 @@ class SearchService:
             raise
 
     async def search(self, search_params: Dict) -> Dict:
-        """执行向量搜索"""
+        """
+        执行向量搜索
+        
+        rerank 为 True 时先从向量库多取 rerank_candidates 个候选（不超过配置的上限），
+        再用交叉编码器批量打分，返回重排序后的 top_k，并在 timings 中给出各阶段耗时（毫秒）。
+        semantic_cache 为 True 时（未指定时取配置的默认值，默认关闭），与之前某个查询语义相同的查询直接返回该查询的结果，
+        返回值中的 semantic_cache 说明是否命中及命中的原始查询；sparse / hybrid 检索不使用语义缓存。
+        返回值中的 cached 为 True 表示结果来自缓存（精确缓存或语义缓存），而不是本次检索计算的。
+        """
         try:
             # 从 search_params 中获取参数
             query = search_params.get("query")
@@ -110,9 +123,70 @@ class SearchService:
             self.logger.info(f"- Word Count Threshold: {word_count_threshold}")
             self.logger.info(f"- Save Results: {save_results}")
             self.logger.info(f"- Provider: {provider}")
+            self.logger.info(f"- Mode: {search_params.get('mode', 'dense')}")
+
+            rerank = search_params.get("rerank", False)
+            self.logger.info(f"- Rerank: {rerank}")
+
+            # 相同的请求在集合未变化时直接返回缓存的结果（键中包含集合版本号）
+            version = get_collection_versions().get(provider, collection_id)
+            cache = get_search_result_cache()
+            cache_key = None
+            search_results = None
+            if cache is not None:
+                cache_key = cache.key(search_params, version)
+                search_results = cache.get(cache_key)
+
+            if search_results is not None:
+                self.logger.info("Search result cache hit")
+                search_results["cached"] = True
+            else:
+                # 语义相同的查询（查询向量相似度不低于阈值）复用之前的检索结果。
+                # sparse / hybrid 用于精确匹配词项（如编号），向量相似不代表结果相同，不使用语义缓存
+                use_semantic_cache = search_params.get("semantic_cache")
+                if use_semantic_cache is None:
+                    use_semantic_cache = SEMANTIC_CACHE_CONFIG["search_default"]
+                if search_params.get("mode", "dense") != "dense":
+                    use_semantic_cache = False
+                semantic_cache = get_semantic_cache() if use_semantic_cache else None
+                embedding = None
+                result_key = SearchResultCache.result_params(search_params)
+                if semantic_cache is not None:
+                    try:
+                        embedding = await asyncio.to_thread(
+                            semantic_query_embedding, provider, collection_id, query, self.vector_store_service
+                        )
+                        hit = semantic_cache.get(provider, collection_id, embedding, "results", result_key)
+                        if hit is not None:
+                            self.logger.info(f"Semantic cache hit (similarity {hit['similarity']:.4f}): {hit['matched_query']}")
+                            search_results = hit["payload"]
+                            search_results["cached"] = True
+                            search_results["semantic_cache"] = {
+                                "hit": True,
+                                "similarity": round(hit["similarity"], 4),
+                                "matched_query": hit["matched_query"]
+                            }
+                    except Exception as e:
+                        self.logger.warning(f"Semantic cache lookup failed, searching directly: {str(e)}")
+                        semantic_cache = None
 
-            # 直接调用向量存储服务进行搜索
-            search_results = await self.vector_store_service.search(search_params)
+                if search_results is None:
+                    # 已生成的查询向量直接用于检索，不再重复生成
+                    params = {**search_params, "embedding": embedding} if embedding is not None else search_params
+                    if rerank:
+                        search_results = await self._search_with_rerank(params)
+                    else:
+                        # 直接调用向量存储服务进行搜索
+                        search_results = await self.vector_store_service.search(params)
+                    if semantic_cache is not None:
+                        semantic_cache.put(provider, collection_id, query, embedding, "results", result_key,
+                                           search_results, version)
+                    # 只缓存本查询自己的检索结果，语义缓存命中得到的是另一个查询的结果
+                    if cache_key is not None:
+                        cache.put(cache_key, search_results)
+                    if semantic_cache is not None:
+                        search_results["semantic_cache"] = {"hit": False}
+                    search_results["cached"] = False
 
             # 如果需要保存结果
             if save_results and search_results.get("results"):
@@ -129,6 +203,100 @@ class SearchService:
             self.logger.error(f"Error performing search: {str(e)}")
             raise
 
+    async def _search_with_rerank(self, search_params: Dict) -> Dict:
+        """
+        多取候选后用交叉编码器重排序
+        
+        Args:
+            search_params (Dict): 检索参数，rerank_candidates 为候选数
+            
+        Returns:
+            Dict: {"results", "total", "timings", "rerank"}
+        """
+        top_k = search_params.get("top_k", 3)
+        candidate_count = min(
+            max(search_params.get("rerank_candidates") or RERANK_CONFIG["candidates"], top_k),
+            RERANK_CONFIG["max_candidates"]
+        )
+
+        start = time.perf_counter()
+        retrieved = await self.vector_store_service.search({**search_params, "top_k": candidate_count})
+        retrieve_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        reranker = await asyncio.to_thread(get_reranker)
+        load_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        results, rerank_info = await asyncio.to_thread(
+            reranker.rerank, search_params.get("query"), retrieved["results"], top_k
+        )
+        rerank_ms = (time.perf_counter() - start) * 1000
+
+        return {
+            "results": results,
+            "total": len(results),
+            "timings": {
+                "retrieve_ms": round(retrieve_ms, 2),
+                "model_load_ms": round(load_ms, 2),
+                "rerank_ms": round(rerank_ms, 2),
+                "total_ms": round(retrieve_ms + load_ms + rerank_ms, 2)
+            },
+            "rerank": {"model": reranker.model_name, **rerank_info}
+        }
+
+    async def batch_search(self, search_params: Dict) -> Dict:
+        """
+        批量执行向量搜索，所有查询共用一次向量生成和一次多向量检索
+        
+        Args:
+            search_params (Dict): 包含 queries、collection_id、provider 以及共享的 top_k、threshold、rescore、save_results
+            
+        Returns:
+            Dict: 每个查询一组结果，顺序与 queries 一致
+        """
+        try:
+            collection_id = search_params.get("collection_id")
+            save_results = search_params.get("save_results", False)
+            self.logger.info(
+                f"Batch search: {len(search_params.get('queries') or [])} queries, "
+                f"collection {collection_id}, provider {search_params.get('provider', 'milvus')}"
+            )
+
+            search_results = await self.vector_store_service.batch_search(search_params)
+
+            if save_results and search_results.get("results"):
+                search_results["saved_filepath"] = self.save_batch_search_results(collection_id, search_results["results"])
+
+            return search_results
+
+        except Exception as e:
+            self.logger.error(f"Error performing batch search: {str(e)}")
+            raise
+
+    def save_batch_search_results(self, collection_id: str, results: List[Dict[str, Any]]) -> str:
+        """
+        将批量搜索结果保存到一个JSON文件
+        
+        Args:
+            collection_id (str): 集合ID
+            results (List[Dict[str, Any]]): 每个查询的搜索结果
+            
+        Returns:
+            str: 保存文件的路径
+        """
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        collection_base = os.path.basename(collection_id)
+        filepath = os.path.join(self.search_results_dir, f"search_batch_{collection_base}_{timestamp}.json")
+        with open(filepath, "w", encoding="utf-8") as f:
+            json.dump({
+                "collection_id": collection_id,
+                "timestamp": datetime.now().isoformat(),
+                "results": results
+            }, f, ensure_ascii=False, indent=2)
+        logger.info(f"Saved batch search results to: {filepath}")
+        return filepath
+
     async def _save_search_results(self, query: str, collection_id: str, results: List[Dict]) -> str:
         """保存搜索结果到文件"""
         try:
@@ -0,0 +1,270 @@
+import copy
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+import numpy as np
+from services.search_cache import get_collection_versions
+from utils.config import SEMANTIC_CACHE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+"""
+语义缓存：换一种说法提出的相同问题直接复用之前的检索结果和生成的回答
+
+按 (provider, 集合) 分区，每个分区在内存中保存缓存查询的单位化向量矩阵，
+新查询与全部缓存查询一次矩阵乘法得到余弦相似度，不低于阈值的条目按相似度从高到低依次查找所需的结果。
+条目记录写入时的集合版本号，集合被重新索引、增量更新或删除后旧条目不再命中；
+条目超过 TTL 后失效，总数超过容量时淘汰最久未使用的条目。
+"""
+
+class _Partition:
+    """
+    一个集合的缓存条目及其查询向量矩阵
+    """
+    def __init__(self):
+        self.entries: List[Dict[str, Any]] = []
+        self._matrix: Optional[np.ndarray] = None
+
+    def matrix(self) -> np.ndarray:
+        """缓存查询的向量矩阵，条目变化后重新拼接"""
+        if self._matrix is None:
+            self._matrix = np.vstack([entry["vector"] for entry in self.entries])
+        return self._matrix
+
+    def remove(self, entries: List[Dict[str, Any]]):
+        """删除条目"""
+        removed = {id(entry) for entry in entries}
+        self.entries = [entry for entry in self.entries if id(entry) not in removed]
+        self._matrix = None
+
+    def append(self, entry: Dict[str, Any]):
+        """追加条目"""
+        self.entries.append(entry)
+        self._matrix = None
+
+class SemanticCache:
+    """
+    基于查询向量相似度的检索结果/回答缓存
+    """
+    def __init__(self, max_entries: int, ttl_seconds: float, similarity_threshold: float):
+        """
+        初始化语义缓存
+
+        参数:
+            max_entries: 全部集合的最大条目数
+            ttl_seconds: 条目有效期（秒）
+            similarity_threshold: 命中所需的最低余弦相似度
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._partitions: Dict[tuple, _Partition] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _namespace(provider, collection_name: str) -> tuple:
+        """生成分区键"""
+        return str(getattr(provider, "value", provider)).lower(), collection_name
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        """单位化查询向量"""
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _matches(self, namespace: tuple, vector: np.ndarray) -> List[tuple]:
+        """
+        找出分区中相似度不低于阈值的有效条目（调用方需持有锁），同时清理过期和集合版本已变化的条目
+
+        返回:
+            [(条目, 相似度), ...]，按相似度降序排列
+        """
+        partition = self._partitions.get(namespace)
+        if partition is None:
+            return []
+        now = time.monotonic()
+        version = get_collection_versions().get(*namespace)
+        stale = [
+            entry for entry in partition.entries
+            if now - entry["created_at"] > self.ttl_seconds or entry["version"] != version
+        ]
+        if stale:
+            partition.remove(stale)
+            self.expirations += len(stale)
+        if not partition.entries:
+            del self._partitions[namespace]
+            return []
+        if partition.entries[0]["vector"].shape != vector.shape:
+            # 集合换了嵌入模型（维度不同），旧条目全部作废
+            self.expirations += len(partition.entries)
+            del self._partitions[namespace]
+            return []
+
+        similarities = partition.matrix() @ vector
+        order = np.argsort(-similarities)
+        return [
+            (partition.entries[i], float(similarities[i]))
+            for i in order if similarities[i] >= self.similarity_threshold
+        ]
+
+    def get(self, provider, collection_name: str, embedding: List[float], kind: str, key: Any) -> Optional[Dict[str, Any]]:
+        """
+        查找与查询语义相同的缓存条目中的结果
+
+        参数:
+            provider: 向量数据库提供商
+            collection_name: 集合名称
+            embedding: 查询向量
+            kind: 结果类型，results（检索结果）或 answers（生成的回答）
+            key: 结果的参数键（检索参数或生成模型）
+
+        返回:
+            {"payload": 结果的副本, "similarity": 相似度, "matched_query": 缓存的原始查询}，未命中时返回 None
+        """
+        namespace = self._namespace(provider, collection_name)
+        vector = self._normalize(embedding)
+        with self._lock:
+            for entry, similarity in self._matches(namespace, vector):
+                payload = entry[kind].get(key)
+                if payload is not None:
+                    entry["last_used"] = time.monotonic()
+                    self.hits += 1
+                    return {
+                        "payload": copy.deepcopy(payload),
+                        "similarity": similarity,
+                        "matched_query": entry["query"]
+                    }
+            self.misses += 1
+            return None
+
+    def put(self, provider, collection_name: str, query: str, embedding: List[float], kind: str, key: Any,
+            payload: Dict[str, Any], version: int):
+        """
+        写入结果：已有语义相同的条目时附加到该条目，否则新建条目
+
+        参数:
+            provider: 向量数据库提供商
+            collection_name: 集合名称
+            query: 查询文本
+            embedding: 查询向量
+            kind: 结果类型，results 或 answers
+            key: 结果的参数键
+            payload: 结果
+            version: 计算结果前读取的集合版本号（期间集合发生变化时不写入）
+        """
+        namespace = self._namespace(provider, collection_name)
+        vector = self._normalize(embedding)
+        payload = copy.deepcopy(payload)
+        with self._lock:
+            if get_collection_versions().get(*namespace) != version:
+                return
+            matches = self._matches(namespace, vector)
+            if matches:
+                entry = matches[0][0]
+            else:
+                now = time.monotonic()
+                entry = {
+                    "query": query,
+                    "vector": vector,
+                    "version": version,
+                    "created_at": now,
+                    "last_used": now,
+                    "results": {},
+                    "answers": {}
+                }
+                self._partitions.setdefault(namespace, _Partition()).append(entry)
+                self._evict()
+            entry[kind][key] = payload
+
+    def _evict(self):
+        """总条目数超过容量时淘汰最久未使用的条目（调用方需持有锁）"""
+        total = sum(len(partition.entries) for partition in self._partitions.values())
+        while total > self.max_entries:
+            namespace, oldest = min(
+                ((namespace, entry) for namespace, partition in self._partitions.items() for entry in partition.entries),
+                key=lambda item: item[1]["last_used"]
+            )
+            partition = self._partitions[namespace]
+            partition.remove([oldest])
+            if not partition.entries:
+                del self._partitions[namespace]
+            self.evictions += 1
+            total -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": sum(len(partition.entries) for partition in self._partitions.values()),
+                "collections": len(self._partitions),
+                "max_entries": self.max_entries,
+                "similarity_threshold": self.similarity_threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": self.hits / total if total else 0.0
+            }
+
+_semantic_cache: Optional[SemanticCache] = None
+_semantic_cache_lock = threading.Lock()
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """
+    获取进程内共享的语义缓存
+
+    返回:
+        SemanticCache 实例，缓存被禁用时返回 None
+    """
+    global _semantic_cache
+    if not SEMANTIC_CACHE_CONFIG.get("enabled", True):
+        return None
+    with _semantic_cache_lock:
+        if _semantic_cache is None:
+            _semantic_cache = SemanticCache(
+                max_entries=SEMANTIC_CACHE_CONFIG["max_entries"],
+                ttl_seconds=SEMANTIC_CACHE_CONFIG["ttl_seconds"],
+                similarity_threshold=SEMANTIC_CACHE_CONFIG["similarity_threshold"]
+            )
+        return _semantic_cache
+
+# (provider, 集合) -> (集合版本号, (嵌入提供商, 嵌入模型))，集合版本变化后重新读取
+_embedding_configs: Dict[tuple, tuple] = {}
+_embedding_configs_lock = threading.Lock()
+
+def semantic_query_embedding(provider: str, collection_name: str, query: str, vector_store_service=None) -> List[float]:
+    """
+    用集合的嵌入模型生成查询向量（查询向量缓存会被后续的向量检索复用）
+
+    集合的嵌入配置按集合版本号缓存，同一版本的集合只读取一次。
+
+    参数:
+        provider: 向量数据库提供商
+        collection_name: 集合名称
+        query: 查询文本
+        vector_store_service: 读取嵌入配置使用的 VectorStoreService，为None时在需要时创建
+
+    返回:
+        查询向量
+    """
+    from services.embedding_service import EmbeddingService
+    namespace = SemanticCache._namespace(provider, collection_name)
+    version = get_collection_versions().get(*namespace)
+    with _embedding_configs_lock:
+        cached = _embedding_configs.get(namespace)
+    if cached is not None and cached[0] == version:
+        embedding_provider, model_name = cached[1]
+    else:
+        if vector_store_service is None:
+            from services.vector_store_service import VectorStoreService
+            vector_store_service = VectorStoreService()
+        embedding_provider, model_name = vector_store_service.get_collection_embedding_config(provider, collection_name)
+        with _embedding_configs_lock:
+            _embedding_configs[namespace] = (version, (embedding_provider, model_name))
+    return EmbeddingService().embed_queries([query], embedding_provider, model_name)[0]
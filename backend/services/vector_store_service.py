@@ -4,11 +4,24 @@ import json
 from typing import List, Dict, Any
 import logging
 from pathlib import Path
-from pymilvus import connections, utility
+from pymilvus import utility
 from pymilvus import Collection, DataType, FieldSchema, CollectionSchema
 import chromadb
 from chromadb.config import Settings
-from utils.config import VectorDBProvider, MILVUS_CONFIG  # Updated import
+from utils.config import VectorDBProvider, MILVUS_CONFIG, MILVUS_INSERT_CONFIG, RESCORE_CONFIG, NEAR_DUPLICATE_CONFIG, BM25_CONFIG, HYBRID_SEARCH_CONFIG  # Updated import
+from services.embedding_artifact import load_embedding_artifact, load_full_precision_vectors, DequantizedVectors
+from services.quantization import rescore as rescore_vectors
+from services.near_duplicate import NearDuplicateDetector, get_signature_store
+from services.embedding_cache import content_hash
+from services.local_vector_store import get_local_vector_store
+from services.index_tuning import get_index_tuning_store, default_index_params
+from services.bm25_index import get_bm25_store
+from services.search_cache import get_collection_versions
+from services.milvus_connection import get_milvus_connection_manager
+import asyncio
+import threading
+import numpy as np
+import hashlib
 import warnings
 import sys
 import re
@@ -30,16 +43,37 @@ class VectorDBConfig:
     """
     向量数据库配置类，用于存储和管理向量数据库的配置信息
     """
-    def __init__(self, provider: str, index_mode: str):
+    def __init__(self, provider: str, index_mode: str, near_dedup: bool = False,
+                 near_dedup_threshold: float = None, near_dedup_mode: str = "skip",
+                 upsert: bool = False, collection_name: str = None):
         """
         初始化向量数据库配置
         
         参数:
             provider: 向量数据库提供商名称
             index_mode: 索引模式
+            near_dedup: 是否在索引前检测并处理近重复文本块
+            near_dedup_threshold: 近重复的 Jaccard 相似度阈值，取值范围 (0, 1]，为None时使用默认配置
+            near_dedup_mode: skip（直接丢弃近重复块）或 merge（丢弃并把其块ID合并到保留块的元数据中）
+            upsert: 是否增量更新到固定名称的集合，而不是每次新建带时间戳的集合
+            collection_name: 增量更新的目标集合名称，为None时按文件名生成固定名称
+            
+        异常:
+            ValueError: near_dedup_threshold 或 near_dedup_mode 取值无效
         """
+        if near_dedup_threshold is None:
+            near_dedup_threshold = NEAR_DUPLICATE_CONFIG["threshold"]
+        if not 0 < near_dedup_threshold <= 1:
+            raise ValueError(f"near_dedup_threshold must be in (0, 1], got {near_dedup_threshold}")
+        if near_dedup_mode not in ("skip", "merge"):
+            raise ValueError(f"near_dedup_mode must be 'skip' or 'merge', got {near_dedup_mode!r}")
         self.provider = provider
         self.index_mode = index_mode
+        self.near_dedup = near_dedup
+        self.near_dedup_threshold = near_dedup_threshold
+        self.near_dedup_mode = near_dedup_mode
+        self.upsert = upsert
+        self.collection_name = collection_name
         self.milvus_uri = MILVUS_CONFIG["uri"]
         # 修改 Chroma 配置路径
         self.chroma_persist_directory = os.path.join("03-vector-store", "chroma_db")
@@ -96,6 +130,8 @@ class VectorStoreService:
             logger.error(f"Error initializing Chroma client: {str(e)}")
             self.chroma_client = None
         self.chroma_collections = {}
+        # Milvus 连接由进程内共享的连接管理器维护，首次使用时才连接
+        self.milvus = get_milvus_connection_manager()
 
     def _get_milvus_index_type(self, config: VectorDBConfig) -> str:
         """
@@ -138,14 +174,28 @@ class VectorStoreService:
             # 读取embedding文件
             embeddings_data = self._load_embeddings(embedding_file)
             
+            # 可选：索引前剔除近重复文本块
+            near_duplicate_report = None
+            if config.near_dedup:
+                embeddings_data, near_duplicate_report = self._drop_near_duplicates(embeddings_data, config)
+            
             # 根据不同的数据库进行索引
             if config.provider.lower() == "milvus":  # 使用字符串比较而不是枚举
                 result = self._index_to_milvus(embeddings_data, config)
             elif config.provider.lower() == "chroma":  # 使用字符串比较而不是枚举
                 result = self._index_to_chroma(embeddings_data, config)
+            elif config.provider.lower() == "faiss":
+                result = self._index_to_local(embeddings_data, config)
             else:
                 raise ValueError(f"Unsupported vector database provider: {config.provider}")
             
+            # 同时为集合建立 BM25 稀疏索引，用于混合检索
+            sparse_report = self._index_sparse(config, result.get("collection_name"), embeddings_data)
+            # 增量更新的集合保存文本块签名，之后写入的文档可以与集合中已有的文本块比较近重复
+            self._index_signatures(config, result.get("collection_name"), embeddings_data)
+            # 集合内容已变化，递增版本号使缓存的检索结果失效
+            get_collection_versions().bump(config.provider, result.get("collection_name"))
+            
             end_time = datetime.now()
             processing_time = (end_time - start_time).total_seconds()
             
@@ -155,12 +205,90 @@ class VectorStoreService:
                 "total_vectors": len(embeddings_data["embeddings"]),
                 "index_size": result.get("index_size", "N/A"),
                 "processing_time": processing_time,
-                "collection_name": result.get("collection_name", "N/A")
+                "collection_name": result.get("collection_name", "N/A"),
+                "near_duplicates": near_duplicate_report,
+                "upsert": result.get("upsert"),
+                "sparse_index": sparse_report
             }
         except Exception as e:
             logger.exception(f"Error in index_embeddings: {str(e)}")
             raise
     
+    def _index_sparse(self, config: VectorDBConfig, collection_name: str, embeddings_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        从文本块内容建立集合的 BM25 索引；增量更新时只替换该文档的记录
+        
+        稀疏索引失败不影响已经写入的向量索引，只记录错误。
+        
+        参数:
+            config: 向量数据库配置对象
+            collection_name: 集合名称
+            embeddings_data: 待索引的嵌入数据
+            
+        返回:
+            索引规模，未启用或失败时返回 None
+        """
+        if not BM25_CONFIG["enabled"] or not collection_name:
+            return None
+        try:
+            filename = embeddings_data.get("filename", "")
+            records = [
+                {
+                    "text": str(emb["metadata"].get("content", "")),
+                    "metadata": {
+                        "document_name": filename,
+                        "chunk_id": emb["metadata"].get("chunk_id", 0),
+                        "page_number": str(emb["metadata"].get("page_number", "")),
+                        "page_range": str(emb["metadata"].get("page_range", ""))
+                    }
+                }
+                for emb in embeddings_data["embeddings"]
+            ]
+            store = get_bm25_store()
+            provider = config.provider.lower()
+            if config.upsert:
+                return store.replace_document(provider, collection_name, filename, records)
+            return store.create(provider, collection_name, records)
+        except Exception as e:
+            logger.error(f"Error building BM25 index for {collection_name}: {str(e)}")
+            return None
+
+    def _index_signatures(self, config: VectorDBConfig, collection_name: str, embeddings_data: Dict[str, Any]):
+        """
+        保存增量更新集合中该文档文本块的 MinHash 签名（替换该文档之前的签名）
+        
+        签名保存失败不影响已经写入的向量索引，只记录错误。
+        
+        参数:
+            config: 向量数据库配置对象
+            collection_name: 集合名称
+            embeddings_data: 已写入集合的嵌入数据（近重复检测之后、增量对比之前的完整文档）
+        """
+        if not config.upsert or not collection_name:
+            return
+        try:
+            filename = embeddings_data.get("filename", "")
+            signatures = embeddings_data.get("minhash_signatures")
+            if signatures is None:
+                signatures = self._near_duplicate_detector(config).signatures(
+                    [str(emb["metadata"].get("content", "")) for emb in embeddings_data["embeddings"]]
+                )
+            records = [
+                {"document_name": filename, "chunk_id": emb["metadata"].get("chunk_id")}
+                for emb in embeddings_data["embeddings"]
+            ]
+            get_signature_store().replace_document(config.provider.lower(), collection_name, filename, signatures, records)
+        except Exception as e:
+            logger.error(f"Error saving near-duplicate signatures for {collection_name}: {str(e)}")
+
+    def _near_duplicate_detector(self, config: VectorDBConfig) -> NearDuplicateDetector:
+        """按配置创建近重复检测器"""
+        return NearDuplicateDetector(
+            threshold=config.near_dedup_threshold,
+            num_perm=NEAR_DUPLICATE_CONFIG["num_perm"],
+            shingle_size=NEAR_DUPLICATE_CONFIG["shingle_size"]
+        )
+
     def _load_embeddings(self, file_path: str) -> Dict[str, Any]:
         """
         加载embedding文件，返回配置信息和embeddings
@@ -169,24 +297,184 @@ class VectorStoreService:
             file_path: 嵌入向量文件路径
             
         返回:
-            包含嵌入向量和元数据的字典
+            包含嵌入元数据和 vectors（float32 矩阵）的字典
         """
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                logger.info(f"Loading embeddings from {file_path}")
-                
-                if not isinstance(data, dict) or "embeddings" not in data:
-                    raise ValueError("Invalid embedding file format: missing 'embeddings' key")
-                    
-                # 返回完整的数据，包括顶层配置
-                logger.info(f"Found {len(data['embeddings'])} embeddings")
-                return data
+            logger.info(f"Loading embeddings from {file_path}")
+            # 二进制格式通过内存映射读取向量，旧的 JSON 格式仍然兼容
+            data = load_embedding_artifact(file_path)
+            data["source_file"] = os.path.basename(file_path)
+            # 每个向量在原嵌入文件中的行号，过滤后仍能对应到原文件
+            data["rows"] = list(range(len(data["embeddings"])))
+            
+            # 返回完整的数据，包括顶层配置和 vectors 矩阵
+            logger.info(f"Found {len(data['embeddings'])} embeddings")
+            return data
                 
         except Exception as e:
             logger.error(f"Error loading embeddings from {file_path}: {str(e)}")
             raise
     
+    def _drop_near_duplicates(self, embeddings_data: Dict[str, Any], config: VectorDBConfig) -> tuple:
+        """
+        使用 MinHash + LSH 检测近重复文本块并从待索引数据中剔除
+        
+        增量更新时还与目标集合中其他文档已索引的文本块（保存的签名）比较；该文档自己之前的文本块
+        由增量对比处理，不参与比较。与已有文本块重复的块在 merge 模式下同样被丢弃，
+        但已写入集合的文本块元数据不会更新，merged_chunk_ids 只记录本次写入的块之间的合并。
+        
+        参数:
+            embeddings_data: 嵌入向量数据
+            config: 向量数据库配置对象
+            
+        返回:
+            (过滤后的嵌入向量数据, 剔除报告)
+        """
+        embeddings = embeddings_data["embeddings"]
+        detector = self._near_duplicate_detector(config)
+        texts = [str(emb["metadata"].get("content", "")) for emb in embeddings]
+        signatures = detector.signatures(texts)
+        
+        existing_signatures, existing_records = None, []
+        if config.upsert:
+            filename = embeddings_data.get("filename", "")
+            collection_name = config.collection_name or self._safe_collection_name(filename, with_timestamp=False)
+            stored = get_signature_store().get(config.provider.lower(), collection_name)
+            if stored is not None and stored[0].shape[1] == signatures.shape[1]:
+                others = [idx for idx, record in enumerate(stored[1]) if record.get("document_name") != filename]
+                existing_signatures = stored[0][others]
+                existing_records = [stored[1][idx] for idx in others]
+        duplicates = detector.find_duplicates(texts, signatures=signatures, existing_signatures=existing_signatures)
+        
+        keep = [idx for idx, duplicate in enumerate(duplicates) if duplicate is None]
+        dropped = []
+        for idx, duplicate in enumerate(duplicates):
+            if duplicate is None:
+                continue
+            if "duplicate_of_existing" in duplicate:
+                existing = existing_records[duplicate["duplicate_of_existing"]]
+                dropped.append({
+                    "chunk_id": embeddings[idx]["metadata"].get("chunk_id"),
+                    "page_number": embeddings[idx]["metadata"].get("page_number"),
+                    "duplicate_of_document": existing.get("document_name"),
+                    "duplicate_of_chunk_id": existing.get("chunk_id"),
+                    "similarity": round(duplicate["similarity"], 4)
+                })
+                continue
+            kept_metadata = embeddings[duplicate["duplicate_of"]]["metadata"]
+            dropped.append({
+                "chunk_id": embeddings[idx]["metadata"].get("chunk_id"),
+                "page_number": embeddings[idx]["metadata"].get("page_number"),
+                "duplicate_of_chunk_id": kept_metadata.get("chunk_id"),
+                "similarity": round(duplicate["similarity"], 4)
+            })
+            if config.near_dedup_mode == "merge":
+                kept_metadata.setdefault("merged_chunk_ids", []).append(embeddings[idx]["metadata"].get("chunk_id"))
+        
+        filtered = self._select_rows({**embeddings_data, "minhash_signatures": signatures}, keep)
+        
+        report = {
+            "threshold": config.near_dedup_threshold,
+            "mode": config.near_dedup_mode,
+            "checked": len(embeddings),
+            "existing_checked": len(existing_records),
+            "dropped": len(dropped),
+            "details": dropped
+        }
+        logger.info(f"Dropped {len(dropped)}/{len(embeddings)} near-duplicate chunks before indexing")
+        return filtered, report
+    
+    def _select_rows(self, embeddings_data: Dict[str, Any], keep: List[int]) -> Dict[str, Any]:
+        """
+        从嵌入向量数据中选出指定的行
+        
+        参数:
+            embeddings_data: 嵌入向量数据
+            keep: 保留的行下标
+            
+        返回:
+            只包含这些行的嵌入向量数据（向量只读取被选中的行）
+        """
+        selected = {
+            **embeddings_data,
+            "embeddings": [embeddings_data["embeddings"][idx] for idx in keep],
+            "rows": [embeddings_data["rows"][idx] for idx in keep]
+        }
+        if "minhash_signatures" in embeddings_data:
+            selected["minhash_signatures"] = embeddings_data["minhash_signatures"][keep]
+        if "quantized_vectors" in embeddings_data:
+            # 量化结果只复制选中行的编码，float32 视图仍按需还原
+            selected["quantized_vectors"] = np.asarray(embeddings_data["quantized_vectors"][keep])
+            selected["vectors"] = DequantizedVectors(selected["quantized_vectors"], embeddings_data["quantization"])
+        else:
+            selected["vectors"] = np.asarray(embeddings_data["vectors"][keep])
+        return selected
+    
+    def _chunk_keys(self, embeddings_data: Dict[str, Any]) -> List[str]:
+        """
+        为每个文本块生成确定性的ID：由文档名和文本块内容哈希决定
+        
+        同一文档中内容相同的文本块按出现顺序加上序号区分，因此重新索引同一文档时，
+        未变化的文本块得到相同的ID。
+        
+        参数:
+            embeddings_data: 嵌入向量数据
+            
+        返回:
+            与 embeddings 一一对应的ID列表
+        """
+        document_name = str(embeddings_data.get("filename", ""))
+        occurrences = {}
+        keys = []
+        for emb in embeddings_data["embeddings"]:
+            digest = content_hash(str(emb["metadata"].get("content", "")))
+            occurrence = occurrences.get(digest, 0)
+            occurrences[digest] = occurrence + 1
+            key_source = f"{document_name}\0{digest}\0{occurrence}".encode("utf-8")
+            keys.append(hashlib.sha256(key_source).hexdigest()[:32])
+        return keys
+    
+    def _plan_upsert(self, embeddings_data: Dict[str, Any], existing_ids: List[str]) -> tuple:
+        """
+        对比文档在集合中已有的文本块ID，确定需要写入和删除的文本块
+        
+        参数:
+            embeddings_data: 嵌入向量数据
+            existing_ids: 集合中该文档已有的文本块ID
+            
+        返回:
+            (只包含新增文本块的嵌入向量数据, 新增文本块ID列表, 需要删除的ID列表, 统计信息)
+        """
+        keys = self._chunk_keys(embeddings_data)
+        existing = set(existing_ids)
+        keep = [idx for idx, key in enumerate(keys) if key not in existing]
+        stale_ids = sorted(existing - set(keys))
+        report = {
+            "inserted": len(keep),
+            "deleted": len(stale_ids),
+            "unchanged": len(keys) - len(keep)
+        }
+        logger.info(f"Upsert plan: {report['inserted']} new, {report['deleted']} stale, {report['unchanged']} unchanged chunks")
+        return self._select_rows(embeddings_data, keep), [keys[idx] for idx in keep], stale_ids, report
+    
+    def _check_upsert_target(self, collection_name: str, provider: str, model_name: str, embeddings_data: Dict[str, Any]):
+        """
+        检查已有集合的嵌入配置与待写入数据一致，避免不同模型的向量混在同一个集合中
+        
+        参数:
+            collection_name: 集合名称
+            provider: 集合中记录的嵌入提供商
+            model_name: 集合中记录的嵌入模型
+            embeddings_data: 嵌入向量数据
+        """
+        if provider is None and model_name is None:
+            return
+        if (provider, model_name) != (embeddings_data.get("embedding_provider"), embeddings_data.get("embedding_model")):
+            raise ValueError(
+                f"Collection {collection_name} uses {provider}/{model_name}, "
+                f"cannot upsert embeddings from {embeddings_data.get('embedding_provider')}/{embeddings_data.get('embedding_model')}"
+            )
+    
     def _index_to_milvus(self, embeddings_data: Dict[str, Any], config: VectorDBConfig) -> Dict[str, Any]:
         """
         将嵌入向量索引到Milvus数据库
@@ -212,12 +500,13 @@ class VectorStoreService:
             embedding_provider = embeddings_data.get("embedding_provider", "unknown")
             timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
             collection_name = f"{base_name}_{embedding_provider}_{timestamp}"
+            if config.upsert:
+                # 增量更新写入固定名称的集合
+                collection_name = config.collection_name or self._safe_collection_name(filename, with_timestamp=False)
             
-            # 连接到Milvus
-            connections.connect(
-                alias="default", 
-                uri=config.milvus_uri
-            )
+            # 复用进程内共享的 Milvus 连接
+            alias = self.milvus.ensure_connected()
+            index_timeout = MILVUS_CONFIG["index_timeout"]
             
             # 从顶层配置获取向量维度
             vector_dim = int(embeddings_data.get("vector_dimension"))
@@ -226,8 +515,22 @@ class VectorStoreService:
             
             logger.info(f"Creating collection with dimension: {vector_dim}")
             
+            # float16 量化的嵌入文件直接以 FLOAT16_VECTOR 存储，内存占用减半。
+            # Milvus 没有 int8 向量类型，int8 结果还原为 FLOAT_VECTOR 存储，不节省内存
+            # （需要 8 位的内存索引时使用 ivf_sq8 索引模式）
+            quantization = embeddings_data.get("quantization") or {}
+            use_float16 = quantization.get("dtype") == "float16"
+            if quantization.get("dtype") == "int8" and self._get_milvus_index_type(config) != "IVF_SQ8":
+                logger.warning(
+                    "int8 artifacts are stored as FLOAT_VECTOR in Milvus and save no memory; "
+                    "use index_mode ivf_sq8 for an 8-bit in-memory index"
+                )
+            
             # 定义字段
             fields = [
+                # 增量更新的集合使用确定性的字符串ID作为主键
+                {"name": "id", "dtype": "VARCHAR", "max_length": 64, "is_primary": True, "auto_id": False}
+                if config.upsert else
                 {"name": "id", "dtype": "INT64", "is_primary": True, "auto_id": True},
                 {"name": "content", "dtype": "VARCHAR", "max_length": 5000},
                 {"name": "document_name", "dtype": "VARCHAR", "max_length": 255},
@@ -240,92 +543,238 @@ class VectorStoreService:
                 {"name": "embedding_provider", "dtype": "VARCHAR", "max_length": 50},
                 {"name": "embedding_model", "dtype": "VARCHAR", "max_length": 50},
                 {"name": "embedding_timestamp", "dtype": "VARCHAR", "max_length": 50},
+                # 来源嵌入文件和行号，用于检索时按全精度向量重排序
+                {"name": "source_file", "dtype": "VARCHAR", "max_length": 255},
+                {"name": "row", "dtype": "INT64"},
+                # merge 模式下被合并的近重复文本块ID（逗号分隔）
+                {"name": "merged_chunk_ids", "dtype": "VARCHAR", "max_length": _MILVUS_MERGED_IDS_MAX_LENGTH},
                 {
                     "name": "vector",
-                    "dtype": "FLOAT_VECTOR",
+                    "dtype": "FLOAT16_VECTOR" if use_float16 else "FLOAT_VECTOR",
                     "dim": vector_dim,
                     "params": self._get_milvus_index_params(config)
                 }
             ]
             
-            # 准备数据为列表格式
-            entities = []
-            for emb in embeddings_data["embeddings"]:
-                entity = {
-                    "content": str(emb["metadata"].get("content", "")),
-                    "document_name": embeddings_data.get("filename", ""),  # 使用 filename 而不是 document_name
-                    "chunk_id": int(emb["metadata"].get("chunk_id", 0)),
-                    "total_chunks": int(emb["metadata"].get("total_chunks", 0)),
-                    "word_count": int(emb["metadata"].get("word_count", 0)),
-                    "page_number": str(emb["metadata"].get("page_number", 0)),
-                    "page_range": str(emb["metadata"].get("page_range", "")),
-                    # "chunking_method": str(emb["metadata"].get("chunking_method", "")),
-                    "embedding_provider": embeddings_data.get("embedding_provider", ""),  # 从顶层配置获取
-                    "embedding_model": embeddings_data.get("embedding_model", ""),  # 从顶层配置获取
-                    "embedding_timestamp": str(emb["metadata"].get("embedding_timestamp", "")),
-                    "vector": [float(x) for x in emb.get("embedding", [])]
-                }
-                entities.append(entity)
-            
-            logger.info(f"Creating Milvus collection: {collection_name}")
-            
-            # 创建collection
-            # field_schemas = [
-            #     FieldSchema(name=field["name"], 
-            #                dtype=getattr(DataType, field["dtype"]),
-            #                is_primary="is_primary" in field and field["is_primary"],
-            #                auto_id="auto_id" in field and field["auto_id"],
-            #                max_length=field.get("max_length"),
-            #                dim=field.get("dim"),
-            #                params=field.get("params"))
-            #     for field in fields
-            # ]
-
-            field_schemas = []
-            for field in fields:
-                extra_params = {}
-                if field.get('max_length') is not None:
-                    extra_params['max_length'] = field['max_length']
-                if field.get('dim') is not None:
-                    extra_params['dim'] = field['dim']
-                if field.get('params') is not None:
-                    extra_params['params'] = field['params']
-                field_schema = FieldSchema(
-                    name=field["name"], 
-                    dtype=getattr(DataType, field["dtype"]),
-                    is_primary=field.get("is_primary", False),
-                    auto_id=field.get("auto_id", False),
-                    **extra_params
+            vectors = embeddings_data["quantized_vectors"] if use_float16 else embeddings_data["vectors"]
+            
+            ids = None
+            upsert_report = None
+            is_new_collection = not (
+                config.upsert and utility.has_collection(collection_name, using=alias, timeout=MILVUS_CONFIG["timeout"])
+            )
+            if is_new_collection:
+                collection = self._create_milvus_collection(collection_name, fields, alias)
+            else:
+                collection = Collection(collection_name, using=alias, timeout=MILVUS_CONFIG["timeout"])
+                if collection.schema.primary_field.dtype != DataType.VARCHAR:
+                    raise ValueError(f"Collection {collection_name} was not created in upsert mode")
+                # 之前创建的集合可能没有 source_file / row / merged_chunk_ids 字段，只写入集合已有的字段
+                existing_fields = {field.name for field in collection.schema.fields}
+                if config.near_dedup and config.near_dedup_mode == "merge" and "merged_chunk_ids" not in existing_fields:
+                    raise ValueError(
+                        f"Collection {collection_name} has no merged_chunk_ids field, "
+                        "use near_dedup_mode 'skip' or index into a new collection"
+                    )
+                fields = [field for field in fields if field["name"] in existing_fields]
+                sample = collection.query(
+                    expr="chunk_id >= 0",
+                    limit=1,
+                    output_fields=["embedding_provider", "embedding_model"],
+                    timeout=MILVUS_CONFIG["timeout"]
                 )
-                field_schemas.append(field_schema)
-
-            schema = CollectionSchema(fields=field_schemas, description=f"Collection for {collection_name}")
-            collection = Collection(name=collection_name, schema=schema)
+                if sample:
+                    self._check_upsert_target(collection_name, sample[0].get("embedding_provider"),
+                                              sample[0].get("embedding_model"), embeddings_data)
+            
+            if config.upsert:
+                existing_ids = [] if is_new_collection else self._milvus_document_ids(collection, filename)
+                embeddings_data, ids, stale_ids, upsert_report = self._plan_upsert(embeddings_data, existing_ids)
+                vectors = embeddings_data["quantized_vectors"] if use_float16 else embeddings_data["vectors"]
+                for start in range(0, len(stale_ids), MILVUS_INSERT_CONFIG["batch_size"]):
+                    stale_batch = stale_ids[start:start + MILVUS_INSERT_CONFIG["batch_size"]]
+                    collection.delete(expr=f"id in {json.dumps(stale_batch)}", timeout=index_timeout)
+                logger.info(f"Deleted {len(stale_ids)} stale chunks of {filename} from {collection_name}")
             
-            # 插入数据
-            logger.info(f"Inserting {len(entities)} vectors")
-            insert_result = collection.insert(entities)
+            # 按列分批写入：向量从内存映射的矩阵中按批切片，每批写入后 flush，内存占用不随文档大小增长
+            total = len(embeddings_data["embeddings"])
+            batch_size = MILVUS_INSERT_CONFIG["batch_size"]
+            inserted = 0
+            for columns in self._milvus_column_batches(embeddings_data, vectors, fields, use_float16, batch_size, ids):
+                insert_result = collection.insert(columns, timeout=index_timeout)
+                if MILVUS_INSERT_CONFIG["flush_every_batch"]:
+                    collection.flush(timeout=index_timeout)
+                inserted += insert_result.insert_count
+                logger.info(f"Inserted {inserted}/{total} vectors into {collection_name}")
+            if not MILVUS_INSERT_CONFIG["flush_every_batch"]:
+                collection.flush(timeout=index_timeout)
             
-            # 创建索引
+            # 创建索引：有调优结果时使用调优后的参数，否则按数据量推导
             index_params = {
                 "metric_type": "COSINE",
                 "index_type": self._get_milvus_index_type(config),
-                "params": self._get_milvus_index_params(config)
+                "params": self._milvus_build_params(collection_name, config, inserted)
             }
-            collection.create_index(field_name="vector", index_params=index_params)
-            collection.load()
+            if is_new_collection:
+                collection.create_index(field_name="vector", index_params=index_params, timeout=index_timeout)
+            collection.load(timeout=index_timeout)
             
             return {
-                "index_size": len(insert_result.primary_keys),
-                "collection_name": collection_name
+                "index_size": inserted,
+                "collection_name": collection_name,
+                "upsert": upsert_report,
+                "stored_vector_dtype": "float16" if use_float16 else "float32"
             }
             
         except Exception as e:
             logger.error(f"Error indexing to Milvus: {str(e)}")
+            self.milvus.request_health_check()
             raise
+
+    def _milvus_build_params(self, collection_name: str, config: VectorDBConfig, num_vectors: int) -> Dict[str, Any]:
+        """
+        获取新建索引使用的参数
         
-        finally:
-            connections.disconnect("default")
+        参数:
+            collection_name: 集合名称
+            config: 向量数据库配置对象
+            num_vectors: 向量数量
+            
+        返回:
+            Milvus索引参数字典
+        """
+        tuned = get_index_tuning_store().build_params(collection_name, config.index_mode)
+        if tuned is not None:
+            logger.info(f"Using tuned index params for {collection_name}: {tuned}")
+            return tuned
+        return default_index_params(config.index_mode, num_vectors)
+
+    def _create_milvus_collection(self, collection_name: str, fields: List[Dict], alias: str) -> Collection:
+        """
+        按字段定义创建 Milvus 集合
+        
+        参数:
+            collection_name: 集合名称
+            fields: 字段定义列表
+            alias: 连接别名
+            
+        返回:
+            新建的 Collection
+        """
+        logger.info(f"Creating Milvus collection: {collection_name}")
+        
+        # 创建collection
+        # field_schemas = [
+        #     FieldSchema(name=field["name"], 
+        #                dtype=getattr(DataType, field["dtype"]),
+        #                is_primary="is_primary" in field and field["is_primary"],
+        #                auto_id="auto_id" in field and field["auto_id"],
+        #                max_length=field.get("max_length"),
+        #                dim=field.get("dim"),
+        #                params=field.get("params"))
+        #     for field in fields
+        # ]
+
+        field_schemas = []
+        for field in fields:
+            extra_params = {}
+            if field.get('max_length') is not None:
+                extra_params['max_length'] = field['max_length']
+            if field.get('dim') is not None:
+                extra_params['dim'] = field['dim']
+            if field.get('params') is not None:
+                extra_params['params'] = field['params']
+            field_schema = FieldSchema(
+                name=field["name"], 
+                dtype=getattr(DataType, field["dtype"]),
+                is_primary=field.get("is_primary", False),
+                auto_id=field.get("auto_id", False),
+                **extra_params
+            )
+            field_schemas.append(field_schema)
+
+        schema = CollectionSchema(fields=field_schemas, description=f"Collection for {collection_name}")
+        collection = Collection(name=collection_name, schema=schema, using=alias, timeout=MILVUS_CONFIG["timeout"])
+        return collection
+
+    def _milvus_document_ids(self, collection: Collection, document_name: str) -> List[str]:
+        """
+        查询集合中某个文档的全部文本块ID
+        
+        参数:
+            collection: Milvus 集合
+            document_name: 文档名称
+            
+        返回:
+            文本块ID列表
+        """
+        iterator = collection.query_iterator(
+            batch_size=MILVUS_INSERT_CONFIG["batch_size"],
+            expr=f"document_name == {json.dumps(document_name, ensure_ascii=False)}",
+            output_fields=["id"],
+            timeout=MILVUS_CONFIG["timeout"]
+        )
+        ids = []
+        while True:
+            batch = iterator.next()
+            if not batch:
+                iterator.close()
+                break
+            ids.extend(row["id"] for row in batch)
+        return ids
+
+    def _milvus_column_batches(self, embeddings_data: Dict[str, Any], vectors: np.ndarray, fields: List[Dict],
+                               use_float16: bool, batch_size: int, ids: List[str] = None):
+        """
+        按批生成列式的 Milvus 写入数据
+        
+        参数:
+            embeddings_data: 嵌入向量数据
+            vectors: 向量矩阵（可以是内存映射）
+            fields: 字段定义列表，列的顺序与其一致（跳过自增主键）
+            use_float16: 是否以 float16 写入向量
+            batch_size: 每批的记录数
+            ids: 非自增主键的ID列表（增量更新时使用）
+            
+        返回:
+            生成器，每次产生一批按字段顺序排列的列数据
+        """
+        embeddings = embeddings_data["embeddings"]
+        row_values = {
+            "content": lambda metadata: str(metadata.get("content", "")),
+            "document_name": lambda metadata: embeddings_data.get("filename", ""),  # 使用 filename 而不是 document_name
+            "chunk_id": lambda metadata: int(metadata.get("chunk_id", 0)),
+            "total_chunks": lambda metadata: int(metadata.get("total_chunks", 0)),
+            "word_count": lambda metadata: int(metadata.get("word_count", 0)),
+            "page_number": lambda metadata: str(metadata.get("page_number", 0)),
+            "page_range": lambda metadata: str(metadata.get("page_range", "")),
+            "embedding_provider": lambda metadata: embeddings_data.get("embedding_provider", ""),  # 从顶层配置获取
+            "embedding_model": lambda metadata: embeddings_data.get("embedding_model", ""),  # 从顶层配置获取
+            "embedding_timestamp": lambda metadata: str(metadata.get("embedding_timestamp", "")),
+            "source_file": lambda metadata: str(embeddings_data.get("source_file", "")),
+            "merged_chunk_ids": lambda metadata: self._merged_chunk_ids(metadata, _MILVUS_MERGED_IDS_MAX_LENGTH)
+        }
+        rows = embeddings_data.get("rows")
+        column_names = [field["name"] for field in fields if not field.get("auto_id")]
+        
+        for start in range(0, len(embeddings), batch_size):
+            batch = [emb["metadata"] for emb in embeddings[start:start + batch_size]]
+            block = np.asarray(vectors[start:start + len(batch)], dtype=np.float16 if use_float16 else np.float32)
+            columns = []
+            for name in column_names:
+                if name == "id":
+                    columns.append(ids[start:start + len(batch)])
+                elif name == "row":
+                    columns.append([
+                        int(rows[position]) if rows is not None else position
+                        for position in range(start, start + len(batch))
+                    ])
+                elif name == "vector":
+                    # FLOAT16_VECTOR 需要 numpy 行向量，FLOAT_VECTOR 整批一次性转换为列表
+                    columns.append(list(block) if use_float16 else block.tolist())
+                else:
+                    columns.append([row_values[name](metadata) for metadata in batch])
+            yield columns
 
     def _index_to_chroma(self, embeddings_data: Dict[str, Any], config: VectorDBConfig) -> Dict[str, Any]:
         """
@@ -336,58 +785,57 @@ class VectorStoreService:
             raise RuntimeError("Chroma client not initialized")
 
         try:
-            # 处理文件名，移除中文字符和其他非法字符
             filename = embeddings_data.get("filename", "")
-            # 移除 .pdf 后缀
-            base_name = filename.replace('.pdf', '')
-            
-            # 将中文文件名转换为拼音或仅保留英文数字
-            # 只保留字母、数字、下划线和连字符
-            safe_name = re.sub(r'[^a-zA-Z0-9\-_]', '', base_name)
-            
-            # 如果处理后的名称为空，使用默认名称
-            if not safe_name:
-                safe_name = "doc"
-            
-            # 确保名称以字母开头
-            if not safe_name[0].isalpha():
-                safe_name = "doc_" + safe_name
-            
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            collection_name = f"{safe_name}_{timestamp}"
-            
-            # 确保集合名称长度不超过63个字符
-            if len(collection_name) > 63:
-                collection_name = collection_name[:59] + timestamp[-4:]
+            if config.upsert:
+                # 增量更新写入固定名称的集合
+                collection_name = config.collection_name or self._safe_collection_name(filename, with_timestamp=False)
+            else:
+                collection_name = self._safe_collection_name(filename)
 
             logger.info(f"Creating collection with name: {collection_name}")
 
             # 检查并打印第一个嵌入向量的信息
+            vectors = embeddings_data["vectors"]
             first_emb = embeddings_data["embeddings"][0]
-            logger.info(f"First embedding type: {type(first_emb['embedding'])}")
-            logger.info(f"First embedding sample: {str(first_emb['embedding'][:5])}")
+            logger.info(f"First embedding sample: {str(vectors[0][:5].tolist())}")
             logger.info(f"First embedding metadata: {first_emb['metadata']}")
 
             # 获取向量维度
-            vector = self._process_single_embedding(first_emb)
-            vector_dim = len(vector)
+            vector_dim = int(vectors.shape[1])
             logger.info(f"Vector dimension: {vector_dim}")
 
-            # 创建新集合，指定维度
-            try:
-                collection = self.chroma_client.create_collection(
+            collection_metadata = {
+                "dimension": vector_dim,
+                "embedding_model": embeddings_data.get("embedding_model", "deepseek-ai/deepseek-base-embedding"),
+                "embedding_provider": embeddings_data.get("embedding_provider", "huggingface")
+            }
+            ids = None
+            upsert_report = None
+            if config.upsert:
+                collection = self.chroma_client.get_or_create_collection(
                     name=collection_name,
                     embedding_function=None,  # 使用原始向量
-                    metadata={
-                        "dimension": vector_dim,
-                        "embedding_model": embeddings_data.get("embedding_model", "deepseek-ai/deepseek-base-embedding"),
-                        "embedding_provider": embeddings_data.get("embedding_provider", "huggingface")
-                    }
+                    metadata=collection_metadata
                 )
-                logger.info("Collection created successfully")
-            except Exception as e:
-                logger.exception("Failed to create collection")
-                raise
+                self._check_upsert_target(collection_name, collection.metadata.get("embedding_provider"),
+                                          collection.metadata.get("embedding_model"), embeddings_data)
+                existing_ids = collection.get(where={"document_name": str(filename)}, include=[])["ids"]
+                embeddings_data, ids, stale_ids, upsert_report = self._plan_upsert(embeddings_data, existing_ids)
+                vectors = embeddings_data["vectors"]
+                if stale_ids:
+                    collection.delete(ids=stale_ids)
+            else:
+                # 创建新集合，指定维度
+                try:
+                    collection = self.chroma_client.create_collection(
+                        name=collection_name,
+                        embedding_function=None,  # 使用原始向量
+                        metadata=collection_metadata
+                    )
+                    logger.info("Collection created successfully")
+                except Exception as e:
+                    logger.exception("Failed to create collection")
+                    raise
 
             # 分批处理数据
             batch_size = 100
@@ -398,13 +846,9 @@ class VectorStoreService:
                     batch = embeddings_data["embeddings"][i:i + batch_size]
                     
                     # 准备批次数据
-                    batch_ids = [str(i + idx) for idx in range(len(batch))]
-                    batch_embeddings = [self._process_single_embedding(emb) for emb in batch]
-                    batch_metadatas = [{
-                        "document_name": str(embeddings_data.get("filename", "")),
-                        "chunk_id": str(emb["metadata"].get("chunk_id", 0)),
-                        "content": str(emb["metadata"].get("content", ""))[:500]  # 限制内容长度
-                    } for emb in batch]
+                    batch_ids = ids[i:i + batch_size] if ids is not None else [str(i + idx) for idx in range(len(batch))]
+                    batch_embeddings = vectors[i:i + batch_size].tolist()
+                    batch_metadatas = [self._chroma_metadata(embeddings_data, emb, i + idx) for idx, emb in enumerate(batch)]
                     batch_documents = [str(emb["metadata"].get("content", ""))[:500] for emb in batch]  # 限制内容长度
 
                     # 添加批次数据
@@ -432,9 +876,12 @@ class VectorStoreService:
                 with open(collection_mapping_file, 'w') as f:
                     json.dump(mapping, f, indent=2)
 
+                # Chroma 只支持 float32 向量，量化结果在这里还原为 float32，不节省内存
                 return {
                     "index_size": total_processed,
-                    "collection_name": collection_name
+                    "collection_name": collection_name,
+                    "upsert": upsert_report,
+                    "stored_vector_dtype": "float32"
                 }
 
             except Exception as e:
@@ -446,6 +893,176 @@ class VectorStoreService:
             logger.exception("Error in _index_to_chroma")
             raise RuntimeError(f"Failed to index to Chroma: {str(e)}")
 
+    def _safe_collection_name(self, filename: str, with_timestamp: bool = True) -> str:
+        """
+        根据文件名生成集合名称
+        
+        参数:
+            filename: 原始文件名
+            with_timestamp: 是否追加时间戳（增量更新使用不带时间戳的固定名称）
+            
+        返回:
+            只包含字母、数字、下划线和连字符，且不超过63个字符的集合名称
+        """
+        # 移除 .pdf 后缀
+        base_name = filename.replace('.pdf', '')
+        
+        # 将中文文件名转换为拼音或仅保留英文数字
+        # 只保留字母、数字、下划线和连字符
+        safe_name = re.sub(r'[^a-zA-Z0-9\-_]', '', base_name)
+        
+        # 如果处理后的名称为空，使用默认名称
+        if not safe_name:
+            safe_name = "doc"
+        
+        # 确保名称以字母开头
+        if not safe_name[0].isalpha():
+            safe_name = "doc_" + safe_name
+        
+        if not with_timestamp:
+            return safe_name[:63]
+        
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        collection_name = f"{safe_name}_{timestamp}"
+        
+        # 确保集合名称长度不超过63个字符
+        if len(collection_name) > 63:
+            collection_name = collection_name[:59] + timestamp[-4:]
+        return collection_name
+
+    def _index_to_local(self, embeddings_data: Dict[str, Any], config: VectorDBConfig) -> Dict[str, Any]:
+        """
+        将嵌入向量写入进程内的本地向量存储（精确检索，index_mode 仅作记录）
+        
+        参数:
+            embeddings_data: 嵌入向量数据
+            config: 向量数据库配置对象
+            
+        返回:
+            索引结果信息字典
+        """
+        try:
+            store = get_local_vector_store()
+            filename = embeddings_data.get("filename", "")
+            info = {
+                "embedding_provider": embeddings_data.get("embedding_provider", ""),
+                "embedding_model": embeddings_data.get("embedding_model", ""),
+                "document_name": filename,
+                "index_mode": config.index_mode
+            }
+            
+            if not config.upsert:
+                collection_name = self._safe_collection_name(filename)
+                records = [
+                    {
+                        "text": str(emb["metadata"].get("content", "")),
+                        "metadata": self._chroma_metadata(embeddings_data, emb, idx)
+                    }
+                    for idx, emb in enumerate(embeddings_data["embeddings"])
+                ]
+                vectors, quantization = self._local_vectors(embeddings_data)
+                info = store.create_collection(collection_name, vectors, records, info, quantization=quantization)
+                return {
+                    "index_size": info["count"],
+                    "collection_name": collection_name,
+                    "stored_vector_dtype": info["vector_dtype"]
+                }
+            
+            # 增量更新写入固定名称的集合；持有集合的写锁完成 检查 -> 对比 -> 写入，
+            # 同一集合的并发增量更新不会基于过期的记录ID做对比
+            collection_name = config.collection_name or self._safe_collection_name(filename, with_timestamp=False)
+            with store.write_lock(collection_name):
+                exists = store.has_collection(collection_name)
+                existing_ids = []
+                if exists:
+                    current = store.get_collection(collection_name).info
+                    self._check_upsert_target(collection_name, current.get("embedding_provider"),
+                                              current.get("embedding_model"), embeddings_data)
+                    existing_ids = store.document_ids(collection_name, filename)
+                changed, ids, stale_ids, upsert_report = self._plan_upsert(embeddings_data, existing_ids)
+                records = [
+                    {
+                        "id": chunk_key,
+                        "text": str(emb["metadata"].get("content", "")),
+                        "metadata": self._chroma_metadata(changed, emb, idx)
+                    }
+                    for idx, (chunk_key, emb) in enumerate(zip(ids, changed["embeddings"]))
+                ]
+                if exists:
+                    info = store.apply_changes(collection_name, stale_ids, changed["vectors"], records)
+                else:
+                    info["document_name"] = ""  # 集合可以包含多个文档
+                    vectors, quantization = self._local_vectors(changed)
+                    info = store.create_collection(collection_name, vectors, records, info, quantization=quantization)
+            return {
+                "index_size": upsert_report["inserted"],
+                "collection_name": collection_name,
+                "upsert": upsert_report,
+                "stored_vector_dtype": info["vector_dtype"]
+            }
+        except Exception as e:
+            logger.exception("Error in _index_to_local")
+            raise RuntimeError(f"Failed to index to local vector store: {str(e)}")
+
+    def _local_vectors(self, embeddings_data: Dict[str, Any]) -> tuple:
+        """
+        本地向量存储直接保存量化编码，内存占用与量化后的嵌入文件相同
+        
+        参数:
+            embeddings_data: 嵌入向量数据
+            
+        返回:
+            (向量或量化编码矩阵, 量化参数（未量化时为 None）)
+        """
+        quantization = embeddings_data.get("quantization")
+        if quantization and "quantized_vectors" in embeddings_data:
+            return embeddings_data["quantized_vectors"], quantization
+        return embeddings_data["vectors"], None
+
+    def _chroma_metadata(self, embeddings_data: Dict[str, Any], emb: Dict, position: int) -> Dict[str, Any]:
+        """
+        构建写入 Chroma 的单个文本块元数据
+        
+        参数:
+            embeddings_data: 嵌入向量数据
+            emb: 单个嵌入结果
+            position: 在待索引数据中的位置
+            
+        返回:
+            元数据字典（Chroma 只接受标量值）
+        """
+        rows = embeddings_data.get("rows")
+        metadata = {
+            "document_name": str(embeddings_data.get("filename", "")),
+            "chunk_id": str(emb["metadata"].get("chunk_id", 0)),
+            "page_number": str(emb["metadata"].get("page_number", "")),
+            "content": str(emb["metadata"].get("content", ""))[:500],  # 限制内容长度
+            # 记录来源嵌入文件和行号，用于检索时按全精度向量重排序
+            "source_file": str(embeddings_data.get("source_file", "")),
+            "row": int(rows[position]) if rows is not None else position
+        }
+        if emb["metadata"].get("merged_chunk_ids"):
+            metadata["merged_chunk_ids"] = self._merged_chunk_ids(emb["metadata"])
+        return metadata
+
+    @staticmethod
+    def _merged_chunk_ids(metadata: Dict[str, Any], max_length: int = None) -> str:
+        """
+        把合并的近重复文本块ID拼接为逗号分隔的字符串
+        
+        参数:
+            metadata: 保留块的元数据
+            max_length: 最大长度，超出时截断到最后一个完整的ID并记录警告
+            
+        返回:
+            逗号分隔的ID，没有合并的块时为空字符串
+        """
+        value = ",".join(str(chunk_id) for chunk_id in metadata.get("merged_chunk_ids") or [])
+        if max_length is not None and len(value) > max_length:
+            logger.warning(f"Truncating merged_chunk_ids of chunk {metadata.get('chunk_id')} to {max_length} characters")
+            value = value[:max(value.rfind(",", 0, max_length + 1), 0)]
+        return value
+
     def _process_single_embedding(self, emb: Dict) -> List[float]:
         """
         处理单个嵌入向量，确保返回浮点数列表
@@ -455,6 +1072,8 @@ class VectorStoreService:
             if embedding is None:
                 raise ValueError("Missing 'embedding' key in vector data")
 
+            if isinstance(embedding, np.ndarray):
+                return embedding.astype(float).tolist()
             if isinstance(embedding, list):
                 return [float(x) for x in embedding]
             elif isinstance(embedding, str):
@@ -503,6 +1122,12 @@ class VectorStoreService:
                     logger.error(f"Error getting Chroma collections: {str(e)}")
                     return []
                     
+            elif provider.lower() == "faiss":
+                return [
+                    {"id": info["name"], "name": info["name"], "count": info["count"]}
+                    for info in get_local_vector_store().list_collections()
+                ]
+                    
             elif provider.lower() == "milvus":
                 # Windows 系统下不支持 Milvus
                 if sys.platform.startswith('win'):
@@ -510,21 +1135,15 @@ class VectorStoreService:
                     return []
                     
                 try:
-                    from pymilvus import connections, utility, Collection
-                    connections.connect(alias="default", uri=MILVUS_CONFIG["uri"])
-                    collections = utility.list_collections()
-                    return [{"id": name, "name": name, "count": Collection(name).num_entities} for name in collections]
-                except ImportError:
-                    logger.warning("Milvus is not installed")
-                    return []
+                    with self.milvus.call() as ctx:
+                        collections = utility.list_collections(using=ctx.alias, timeout=ctx.timeout)
+                        return [
+                            {"id": name, "name": name, "count": Collection(name, using=ctx.alias).num_entities}
+                            for name in collections
+                        ]
                 except Exception as e:
                     logger.error(f"Error getting Milvus collections: {str(e)}")
                     return []
-                finally:
-                    try:
-                        connections.disconnect("default")
-                    except:
-                        pass
                     
             logger.warning(f"Unsupported provider: {provider}")
             return []
@@ -537,6 +1156,28 @@ class VectorStoreService:
         """
         删除指定的集合
         
+        参数:
+            provider: 向量数据库提供商
+            collection_name: 集合名称
+            
+        返回:
+            是否删除成功
+        """
+        try:
+            dropped = self._drop_collection(provider, collection_name)
+        finally:
+            # 删除完成后递增版本号，之前缓存的检索结果不再命中
+            get_collection_versions().bump(provider, collection_name)
+        # 集合删除成功后再删除 BM25 索引和近重复签名，删除失败时集合仍可用于混合检索
+        if dropped:
+            get_bm25_store().delete(getattr(provider, "value", provider), collection_name)
+            get_signature_store().delete(str(getattr(provider, "value", provider)).lower(), collection_name)
+        return dropped
+
+    def _drop_collection(self, provider: str, collection_name: str) -> bool:
+        """
+        删除向量数据库中的集合
+        
         参数:
             provider: 向量数据库提供商
             collection_name: 集合名称
@@ -545,12 +1186,11 @@ class VectorStoreService:
             是否删除成功
         """
         if provider == VectorDBProvider.MILVUS:
-            try:
-                connections.connect(alias="default", uri=MILVUS_CONFIG["uri"])
-                utility.drop_collection(collection_name)
-                return True
-            finally:
-                connections.disconnect("default")
+            forget_milvus_collection(collection_name)
+            with self.milvus.call() as ctx:
+                utility.drop_collection(collection_name, using=ctx.alias, timeout=ctx.timeout)
+            get_index_tuning_store().remove(collection_name)
+            return True
         elif provider == VectorDBProvider.CHROMA:
             try:
                 self.chroma_client.delete_collection(collection_name)
@@ -558,6 +1198,8 @@ class VectorStoreService:
             except Exception as e:
                 logger.error(f"Error deleting Chroma collection: {str(e)}")
                 return False
+        elif provider == VectorDBProvider.FAISS:
+            return get_local_vector_store().delete_collection(collection_name)
         return False
 
     def get_collection_info(self, provider: str, collection_name: str) -> Dict[str, Any]:
@@ -572,16 +1214,14 @@ class VectorStoreService:
             集合信息字典
         """
         if provider == VectorDBProvider.MILVUS:
-            try:
-                connections.connect(alias="default", uri=MILVUS_CONFIG["uri"])
-                collection = Collection(collection_name)
+            with self.milvus.call() as ctx:
+                collection = Collection(collection_name, using=ctx.alias, timeout=ctx.timeout)
                 return {
                     "name": collection_name,
                     "num_entities": collection.num_entities,
-                    "schema": collection.schema.to_dict()
+                    "schema": collection.schema.to_dict(),
+                    "tuning": get_index_tuning_store().get(collection_name)
                 }
-            finally:
-                connections.disconnect("default")
         elif provider == VectorDBProvider.CHROMA:
             try:
                 collection = self.chroma_client.get_collection(collection_name)
@@ -597,6 +1237,21 @@ class VectorStoreService:
             except Exception as e:
                 logger.error(f"Error getting Chroma collection info: {str(e)}")
                 return {}
+        elif provider == VectorDBProvider.FAISS:
+            try:
+                info = get_local_vector_store().collection_info(collection_name)
+                return {
+                    "name": collection_name,
+                    "num_entities": info["count"],
+                    "schema": {
+                        "fields": [
+                            {"name": "vector", "dim": info["dimension"], "index_params": {"index_type": "flat"}}
+                        ]
+                    }
+                }
+            except Exception as e:
+                logger.error(f"Error getting local collection info: {str(e)}")
+                return {}
         return {}
 
     def init_chroma(self):
@@ -656,6 +1311,8 @@ class VectorStoreService:
                 return await self._search_chroma(search_params)
             elif provider == "milvus":
                 return await self._search_milvus(search_params)
+            elif provider == "faiss":
+                return await self._search_local(search_params)
             else:
                 raise ValueError(f"Unsupported vector database provider: {provider}")
                 
@@ -663,16 +1320,237 @@ class VectorStoreService:
             logger.error(f"Search error: {str(e)}")
             raise
 
-    async def _search_chroma(self, params: Dict) -> Dict:
-        """在 Chroma 中执行搜索"""
+    async def batch_search(self, search_params: Dict) -> Dict:
+        """
+        批量执行向量搜索：所有查询一次性生成向量，并通过一次多向量检索得到每个查询的结果
+        
+        参数:
+            search_params: 包含 provider、collection_id、queries，以及共享的 top_k、threshold、rescore；
+                queries 中的每一项可以是查询文本，也可以是带有自己 top_k / threshold 的字典，
+                字典中还可以带上预先生成的查询向量 embedding
+            
+        返回:
+            {"results": 与 queries 顺序一致的 {"query", "results", "total"} 列表, "total_queries": 查询数}
+        """
         try:
+            provider = search_params.get("provider")
+            collection_id = search_params.get("collection_id")
+            queries = self._normalize_queries(search_params)
+            if not collection_id:
+                raise ValueError("Missing collection_id parameter")
+            if not queries:
+                raise ValueError("Missing queries parameter")
+            
+            results = await self._search_queries(
+                provider, collection_id, queries, search_params.get("rescore", False), search_params.get("mode", "dense")
+            )
+            return {
+                "results": [{"query": spec["query"], **result} for spec, result in zip(queries, results)],
+                "total_queries": len(queries)
+            }
+        except Exception as e:
+            logger.error(f"Batch search error: {str(e)}")
+            raise
+
+    async def _search_queries(self, provider: str, collection_name: str, queries: List[Dict],
+                              rescore: bool, mode: str) -> List[Dict]:
+        """
+        按检索模式执行多查询检索
+        
+        dense 为纯向量检索；sparse 为纯 BM25 检索；hybrid 同时执行两路检索（并发执行，延迟取两者中较慢的一路），
+        再按倒数排名融合。threshold 只作用于向量检索的相似度，sparse 和 hybrid 的 score 分别为 BM25 得分和融合得分。
+        
+        参数:
+            provider: 向量数据库提供商
+            collection_name: 集合名称
+            queries: 查询列表
+            rescore: 是否用全精度向量重排序（只作用于向量检索）
+            mode: dense、sparse 或 hybrid
+            
+        返回:
+            与 queries 顺序一致的 {"results", "total"} 列表
+        """
+        search_fn = self._batch_search_fn(provider)
+        if mode == "dense":
+            return await search_fn(collection_name, queries, rescore)
+        if mode not in ("sparse", "hybrid"):
+            raise ValueError(f"Unsupported search mode: {mode}")
+
+        sparse_index = get_bm25_store().get(provider, collection_name)
+        if sparse_index is None:
+            if mode == "sparse":
+                raise ValueError(f"No BM25 index for collection {collection_name}, re-index it to build one")
+            logger.warning(f"No BM25 index for collection {collection_name}, falling back to dense search")
+            return await search_fn(collection_name, queries, rescore)
+
+        if mode == "sparse":
+            return await asyncio.to_thread(self._search_sparse, sparse_index, queries, 1)
+
+        factor = HYBRID_SEARCH_CONFIG["candidate_factor"]
+        dense_queries = [{**spec, "top_k": spec["top_k"] * factor} for spec in queries]
+        dense_results, sparse_results = await asyncio.gather(
+            search_fn(collection_name, dense_queries, rescore),
+            asyncio.to_thread(self._search_sparse, sparse_index, queries, factor)
+        )
+        return self._fuse_results(queries, dense_results, sparse_results)
+
+    def _search_sparse(self, sparse_index, queries: List[Dict], factor: int) -> List[Dict]:
+        """
+        在 BM25 索引中检索
+        
+        参数:
+            sparse_index: BM25Index 实例
+            queries: 查询列表
+            factor: 候选倍数，每个查询返回 top_k * factor 个结果
+            
+        返回:
+            与 queries 顺序一致的 {"results", "total"} 列表
+        """
+        output = []
+        for spec in queries:
+            results = [
+                {
+                    "text": sparse_index.records[row]["text"],
+                    "metadata": sparse_index.records[row]["metadata"],
+                    "score": score
+                }
+                for row, score in sparse_index.search(spec["query"], spec["top_k"] * factor)
+            ]
+            output.append({"results": results, "total": len(results)})
+        return output
+
+    def _fuse_results(self, queries: List[Dict], dense_results: List[Dict], sparse_results: List[Dict]) -> List[Dict]:
+        """
+        按加权的倒数排名融合（RRF）合并两路候选，同一文本块按 (document_name, chunk_id) 识别
+        
+        参数:
+            queries: 查询列表
+            dense_results: 向量检索结果
+            sparse_results: BM25 检索结果
+            
+        返回:
+            与 queries 顺序一致的 {"results", "total"} 列表，每个结果带有 dense_score 和 sparse_score
+        """
+        rrf_k = HYBRID_SEARCH_CONFIG["rrf_k"]
+        weights = {"dense": HYBRID_SEARCH_CONFIG["dense_weight"], "sparse": HYBRID_SEARCH_CONFIG["sparse_weight"]}
+        output = []
+        for spec, dense_result, sparse_result in zip(queries, dense_results, sparse_results):
+            fused = {}
+            for leg, result in (("dense", dense_result), ("sparse", sparse_result)):
+                for rank, item in enumerate(result["results"], 1):
+                    metadata = item["metadata"]
+                    key = (str(metadata.get("document_name")), str(metadata.get("chunk_id")))
+                    entry = fused.setdefault(key, {
+                        "text": item["text"],
+                        "metadata": metadata,
+                        "score": 0.0,
+                        "dense_score": None,
+                        "sparse_score": None
+                    })
+                    entry["score"] += weights[leg] / (rrf_k + rank)
+                    entry[f"{leg}_score"] = item["score"]
+            results = sorted(fused.values(), key=lambda entry: entry["score"], reverse=True)[:spec["top_k"]]
+            output.append({"results": results, "total": len(results)})
+            if "rescore" in dense_result:
+                output[-1]["rescore"] = dense_result["rescore"]
+        return output
+
+    def _batch_search_fn(self, provider: str):
+        """
+        获取提供商对应的批量检索方法
+        
+        参数:
+            provider: 向量数据库提供商
+            
+        返回:
+            批量检索方法
+        """
+        if provider == "chroma":
+            return self._search_chroma_batch
+        elif provider == "milvus":
+            return self._search_milvus_batch
+        elif provider == "faiss":
+            return self._search_local_batch
+        raise ValueError(f"Unsupported vector database provider: {provider}")
+
+    def _normalize_queries(self, search_params: Dict) -> List[Dict]:
+        """
+        把 queries 统一为 {"query", "top_k", "threshold", "embedding"} 列表，未单独指定的参数使用共享值
+        
+        参数:
+            search_params: 批量检索参数
+            
+        返回:
+            查询列表
+        """
+        top_k = search_params.get("top_k", 3)
+        threshold = search_params.get("threshold", 0.7)
+        queries = []
+        for item in search_params.get("queries") or []:
+            if isinstance(item, str):
+                item = {"query": item}
+            if not item.get("query"):
+                raise ValueError("Missing query parameter")
+            queries.append({
+                "query": item["query"],
+                "top_k": int(item.get("top_k") or top_k),
+                "threshold": float(item["threshold"] if item.get("threshold") is not None else threshold),
+                "embedding": item.get("embedding")
+            })
+        return queries
+
+    async def collection_embedding_config(self, provider: str, collection_name: str) -> tuple:
+        """
+        获取集合使用的嵌入配置（在线程中执行，不阻塞事件循环）
+        
+        参数:
+            provider: 向量数据库提供商
+            collection_name: 集合名称
+            
+        返回:
+            (嵌入提供商, 嵌入模型名称)
+        """
+        return await asyncio.to_thread(self.get_collection_embedding_config, provider, collection_name)
+
+    def get_collection_embedding_config(self, provider: str, collection_name: str) -> tuple:
+        """
+        获取集合使用的嵌入配置
+        
+        参数:
+            provider: 向量数据库提供商
+            collection_name: 集合名称
+            
+        返回:
+            (嵌入提供商, 嵌入模型名称)
+        """
+        if provider == "chroma":
             if not self.chroma_client:
                 self.init_chroma()
+            metadata = self.chroma_client.get_collection(name=collection_name, embedding_function=None).metadata or {}
+        elif provider == "milvus":
+            metadata = _get_loaded_milvus_collection(collection_name)
+        elif provider == "faiss":
+            metadata = get_local_vector_store().get_collection(collection_name).info
+        else:
+            raise ValueError(f"Unsupported vector database provider: {provider}")
+        if not metadata.get("embedding_provider") or not metadata.get("embedding_model"):
+            raise ValueError(f"Missing embedding configuration in collection: {collection_name}")
+        return metadata["embedding_provider"], metadata["embedding_model"]
 
+    async def _search_single(self, params: Dict, label: str) -> Dict:
+        """
+        单个查询的检索，复用批量检索路径
+        
+        参数:
+            params: 检索参数
+            label: 日志中使用的提供商名称
+            
+        返回:
+            {"results", "total"}
+        """
+        try:
             collection_name = params.get("collection_id")
             query = params.get("query")
-            top_k = params.get("top_k", 3)
-            threshold = params.get("threshold", 0.7)
 
             # 参数验证
             if not collection_name:
@@ -680,87 +1558,405 @@ class VectorStoreService:
             if not query:
                 raise ValueError("Missing query parameter")
 
-            logger.info(f"Searching in collection: {collection_name}")
+            query_spec = {
+                "query": query,
+                "top_k": params.get("top_k", 3),
+                "threshold": params.get("threshold", 0.7),
+                "embedding": params.get("embedding")
+            }
+            return (await self._search_queries(
+                params.get("provider"), collection_name, [query_spec], params.get("rescore", False), params.get("mode", "dense")
+            ))[0]
+        except Exception as e:
+            logger.error(f"{label} search error: {str(e)}")
+            logger.error(f"Search parameters: {params}")
+            raise
+
+    async def _search_chroma(self, params: Dict) -> Dict:
+        """在 Chroma 中执行搜索"""
+        return await self._search_single({**params, "provider": "chroma"}, "Chroma")
+
+    async def _search_milvus(self, params: Dict) -> Dict:
+        """在 Milvus 中执行搜索，复用长连接和已 load 的集合"""
+        return await self._search_single({**params, "provider": "milvus"}, "Milvus")
+
+    async def _search_local(self, params: Dict) -> Dict:
+        """在进程内的本地向量存储中执行精确搜索"""
+        return await self._search_single({**params, "provider": "faiss"}, "Local")
+
+    async def _embed_queries(self, queries: List[Dict], provider: str, model_name: str) -> List[List[float]]:
+        """
+        一次性生成全部查询的向量，已带有 embedding 的查询直接使用
+        
+        参数:
+            queries: 查询列表
+            provider: 嵌入提供商
+            model_name: 嵌入模型名称
             
-            # 获取集合
-            collection = self.chroma_client.get_collection(
-                name=collection_name,
-                embedding_function=None  # 使用原始向量
+        返回:
+            查询向量列表
+        """
+        from services.embedding_service import EmbeddingService
+        query_embeddings = [spec.get("embedding") for spec in queries]
+        missing = [i for i, embedding in enumerate(query_embeddings) if embedding is None]
+        if missing:
+            embedded = await asyncio.to_thread(
+                EmbeddingService().embed_queries, [queries[i]["query"] for i in missing], provider, model_name
             )
+            for i, embedding in zip(missing, embedded):
+                query_embeddings[i] = embedding
+        if not query_embeddings or any(not embedding for embedding in query_embeddings):
+            raise ValueError("Failed to generate query embedding")
+        return query_embeddings
+
+    def _candidate_count(self, queries: List[Dict], rescore: bool) -> int:
+        """
+        计算一次多向量检索需要返回的候选数：取各查询 top_k 的最大值，重排序时再乘以候选倍数
+        
+        参数:
+            queries: 查询列表
+            rescore: 是否重排序
             
-            # 从集合的 metadata 中获取 embedding 配置
-            collection_metadata = collection.metadata
-            if not collection_metadata:
-                raise ValueError(f"No metadata found for collection: {collection_name}")
-            
-            provider = collection_metadata.get("embedding_provider")
-            model_name = collection_metadata.get("embedding_model")
-            
-            if not provider or not model_name:
-                raise ValueError(f"Missing embedding configuration in collection metadata: {collection_metadata}")
-            
-            logger.info(f"Using embedding config from collection: provider={provider}, model={model_name}")
-            
-            # 使用 EmbeddingService 生成查询向量
-            from services.embedding_service import EmbeddingService, EmbeddingConfig
-            embedding_service = EmbeddingService()
+        返回:
+            候选数
+        """
+        top_k = max(spec["top_k"] for spec in queries)
+        return top_k * RESCORE_CONFIG["candidate_factor"] if rescore else top_k
+
+    def _finalize_results(self, queries: List[Dict], query_embeddings: List[List[float]],
+                          batch_candidates: List[List[Dict]], rescore: bool) -> List[Dict]:
+        """
+        按每个查询自己的 top_k 和 threshold 整理候选结果
+        
+        参数:
+            queries: 查询列表
+            query_embeddings: 查询向量列表
+            batch_candidates: 每个查询的候选列表（按得分降序）
+            rescore: 是否用全精度向量重排序
             
-            # 使用集合中存储的配置
-            config = EmbeddingConfig(
-                provider=provider,
-                model_name=model_name
-            )
+        返回:
+            与 queries 顺序一致的 {"results", "total"} 列表，重排序时还包含 rescore（候选数和实际重新打分的候选数）
+        """
+        output = []
+        for spec, query_embedding, candidates in zip(queries, query_embeddings, batch_candidates):
+            rescore_info = None
+            if rescore:
+                candidate_count = len(candidates)
+                candidates, rescored = self._rescore_candidates(query_embedding, candidates)
+                rescore_info = {"candidates": candidate_count, "rescored": rescored}
+                if candidate_count and not rescored:
+                    rescore_info["skipped"] = (
+                        "No full-precision vectors available for these results: the collection does not record "
+                        "source_file/row, or its embedding file was quantized without keeping a .f32.npy copy"
+                    )
+            candidates = candidates[:spec["top_k"]]
+            formatted_results = [candidate for candidate in candidates if candidate["score"] >= spec["threshold"]]
+            output.append({
+                "results": formatted_results,
+                "total": len(formatted_results)
+            })
+            if rescore_info is not None:
+                output[-1]["rescore"] = rescore_info
+        logger.info(f"Found {sum(result['total'] for result in output)} results above threshold for {len(queries)} queries")
+        return output
+
+    async def _search_chroma_batch(self, collection_name: str, queries: List[Dict], rescore: bool) -> List[Dict]:
+        """
+        在 Chroma 中执行多查询检索（一次 query_embeddings=[...] 调用）
+        
+        参数:
+            collection_name: 集合名称
+            queries: 查询列表
+            rescore: 是否重排序
             
-            # 准备查询数据
-            input_data = {
-                "chunks": [{
-                    "content": query,
-                    "metadata": {
-                        "chunk_id": 0,
-                        "page_number": "0",
-                        "page_range": "",
-                        "word_count": len(query.split())
-                    }
-                }]
-            }
+        返回:
+            与 queries 顺序一致的 {"results", "total"} 列表
+        """
+        if not self.chroma_client:
+            self.init_chroma()
+
+        logger.info(f"Searching in collection: {collection_name}")
+        
+        # 获取集合
+        collection = self.chroma_client.get_collection(
+            name=collection_name,
+            embedding_function=None  # 使用原始向量
+        )
+        
+        # 从集合的 metadata 中获取 embedding 配置
+        collection_metadata = collection.metadata
+        if not collection_metadata:
+            raise ValueError(f"No metadata found for collection: {collection_name}")
+        
+        provider = collection_metadata.get("embedding_provider")
+        model_name = collection_metadata.get("embedding_model")
+        
+        if not provider or not model_name:
+            raise ValueError(f"Missing embedding configuration in collection metadata: {collection_metadata}")
+        
+        logger.info(f"Using embedding config from collection: provider={provider}, model={model_name}")
+        
+        # 使用集合中存储的配置生成查询向量（重复查询直接命中查询向量缓存）
+        query_embeddings = await self._embed_queries(queries, provider, model_name)
+        
+        results = collection.query(
+            query_embeddings=query_embeddings,
+            n_results=self._candidate_count(queries, rescore)
+        )
+
+        # 格式化搜索结果
+        batch_candidates = []
+        for documents, metadatas, distances in zip(
+            results.get("documents") or [],
+            results.get("metadatas") or [],
+            results.get("distances") or []
+        ):
+            batch_candidates.append([
+                {
+                    "text": text,
+                    "metadata": metadata,
+                    "score": 1.0 - (distance / 2.0)
+                }
+                for text, metadata, distance in zip(documents, metadatas, distances)
+            ])
+        return self._finalize_results(queries, query_embeddings, batch_candidates, rescore)
+
+    async def _search_milvus_batch(self, collection_name: str, queries: List[Dict], rescore: bool) -> List[Dict]:
+        """
+        在 Milvus 中执行多查询检索（一次 nq > 1 的 search 调用）
+        
+        参数:
+            collection_name: 集合名称
+            queries: 查询列表
+            rescore: 是否重排序
             
-            # 生成查询向量
-            embeddings, _ = embedding_service.create_embeddings(input_data, config)
-            query_embedding = embeddings[0]["embedding"] if embeddings else None
+        返回:
+            与 queries 顺序一致的 {"results", "total"} 列表
+        """
+        handle = await asyncio.to_thread(_get_loaded_milvus_collection, collection_name)
+        provider = handle["embedding_provider"]
+        model_name = handle["embedding_model"]
+        if not provider or not model_name:
+            raise ValueError(f"Missing embedding configuration in collection: {collection_name}")
+
+        query_embeddings = await self._embed_queries(queries, provider, model_name)
+        n_results = self._candidate_count(queries, rescore)
+
+        def run_search():
+            with self.milvus.call() as ctx:
+                return handle["collection"].search(
+                    data=[handle["encode"](query_embedding) for query_embedding in query_embeddings],
+                    anns_field="vector",
+                    param={"metric_type": handle["metric_type"], "params": _milvus_search_params(handle, n_results)},
+                    limit=n_results,
+                    output_fields=handle["output_fields"],
+                    timeout=ctx.timeout
+                )
+
+        hits = await asyncio.to_thread(run_search)
+
+        batch_candidates = []
+        for query_hits in hits:
+            candidates = []
+            for hit in query_hits:
+                metadata = {field: hit.entity.get(field) for field in handle["output_fields"] if field != "content"}
+                candidates.append({
+                    "text": hit.entity.get("content"),
+                    "metadata": metadata,
+                    "score": float(hit.distance)  # COSINE 度量下 distance 即相似度
+                })
+            batch_candidates.append(candidates)
+        return self._finalize_results(queries, query_embeddings, batch_candidates, rescore)
+
+    async def _search_local_batch(self, collection_name: str, queries: List[Dict], rescore: bool) -> List[Dict]:
+        """
+        在本地向量存储中执行多查询检索（一次矩阵乘法）
+        
+        参数:
+            collection_name: 集合名称
+            queries: 查询列表
+            rescore: 是否重排序
             
-            if not query_embedding:
-                raise ValueError("Failed to generate query embedding")
+        返回:
+            与 queries 顺序一致的 {"results", "total"} 列表
+        """
+        collection = get_local_vector_store().get_collection(collection_name)
+        provider = collection.info.get("embedding_provider")
+        model_name = collection.info.get("embedding_model")
+        if not provider or not model_name:
+            raise ValueError(f"Missing embedding configuration in collection info: {collection.info}")
+
+        query_embeddings = await self._embed_queries(queries, provider, model_name)
+        hits = collection.search(np.asarray(query_embeddings, dtype=np.float32), self._candidate_count(queries, rescore))
+        batch_candidates = [
+            [
+                {
+                    "text": collection.records[row]["text"],
+                    "metadata": collection.records[row]["metadata"],
+                    "score": score
+                }
+                for row, score in query_hits
+            ]
+            for query_hits in hits
+        ]
+        return self._finalize_results(queries, query_embeddings, batch_candidates, rescore)
+
+    def _rescore_candidates(self, query_embedding: List[float], candidates: List[Dict]) -> tuple:
+        """
+        使用嵌入文件中的全精度向量重新计算候选得分并排序
+        
+        候选的 metadata 中需要包含 source_file 和 row，且来源嵌入文件中要有比索引更高精度的向量，
+        否则保留原得分。全精度向量以内存映射方式只读取候选所在的行。
+        
+        参数:
+            query_embedding: 查询向量
+            candidates: 候选结果列表
             
-            # 使用向量查询
-            results = collection.query(
-                query_embeddings=[query_embedding],
-                n_results=top_k
-            )
+        返回:
+            (按新得分降序排列的候选列表, 重新打分的候选数)
+        """
+        by_source = {}
+        for idx, candidate in enumerate(candidates):
+            metadata = candidate.get("metadata") or {}
+            if metadata.get("source_file") and metadata.get("row") is not None:
+                by_source.setdefault(metadata["source_file"], []).append(idx)
 
-            # 格式化搜索结果
-            formatted_results = []
-            for idx, (text, metadata, distance) in enumerate(zip(
-                results.get("documents", [[]])[0],
-                results.get("metadatas", [[]])[0],
-                results.get("distances", [[]])[0]
-            )):
-                score = 1.0 - (distance / 2.0)
-                if score >= threshold:
-                    formatted_results.append({
-                        "text": text,
-                        "metadata": metadata,
-                        "score": score
-                    })
+        rescored = 0
+        for source_file, indices in by_source.items():
+            file_path = os.path.join("02-embedded-docs", source_file)
+            if not os.path.exists(file_path):
+                logger.warning(f"Embedding file for rescoring not found: {file_path}")
+                continue
+            vectors = load_full_precision_vectors(file_path)
+            if vectors is None:
+                continue
+            rows = [int(candidates[idx]["metadata"]["row"]) for idx in indices]
+            scores = rescore_vectors(np.asarray(query_embedding, dtype=np.float32), np.asarray(vectors[rows]))
+            for idx, score in zip(indices, scores):
+                candidates[idx]["score"] = float(score)
+            rescored += len(indices)
 
-            logger.info(f"Found {len(formatted_results)} results above threshold")
-            return {
-                "results": formatted_results,
-                "total": len(formatted_results)
-            }
+        return sorted(candidates, key=lambda candidate: candidate["score"], reverse=True), rescored
 
-        except Exception as e:
-            logger.error(f"Chroma search error: {str(e)}")
-            logger.error(f"Search parameters: {params}")
-            raise
+_MILVUS_OUTPUT_FIELDS = ["content", "document_name", "chunk_id", "page_number", "page_range",
+                         "embedding_provider", "embedding_model", "source_file", "row", "merged_chunk_ids"]
+_MILVUS_MERGED_IDS_MAX_LENGTH = 4096
+_loaded_milvus_collections: Dict[str, Dict[str, Any]] = {}
+# 只保护上面的缓存字典（以及下面的加载锁和代数），不在持有期间 load 集合
+_milvus_search_lock = threading.Lock()
+# 每个集合一把加载锁：同一集合的并发首次检索只 load 一次，不同集合的 load 互不阻塞
+_milvus_load_locks: Dict[str, threading.Lock] = {}
+# forget_milvus_collection 每调用一次加一，加载期间集合被移除时不发布加载结果
+_milvus_generations: Dict[str, int] = {}
+
+def _get_loaded_milvus_collection(collection_name: str) -> Dict[str, Any]:
+    """
+    获取已 load 的 Milvus 集合及其检索所需信息，每个集合在进程内只 load 一次
+
+    参数:
+        collection_name: 集合名称
+
+    返回:
+        包含 collection、索引类型和参数、度量类型、嵌入配置和查询向量编码函数的字典
+    """
+    with _milvus_search_lock:
+        handle = _loaded_milvus_collections.get(collection_name)
+        if handle is not None:
+            return handle
+        load_lock = _milvus_load_locks.setdefault(collection_name, threading.Lock())
+
+    with load_lock:
+        with _milvus_search_lock:
+            handle = _loaded_milvus_collections.get(collection_name)
+            if handle is not None:
+                return handle
+            generation = _milvus_generations.get(collection_name, 0)
+
+        handle = _load_milvus_collection(collection_name)
+        with _milvus_search_lock:
+            if _milvus_generations.get(collection_name, 0) == generation:
+                _loaded_milvus_collections[collection_name] = handle
+        return handle
+
+def _load_milvus_collection(collection_name: str) -> Dict[str, Any]:
+    """
+    load 集合并读取其检索所需信息
+
+    参数:
+        collection_name: 集合名称
 
-    # ... existing code ...
\ No newline at end of file
+    返回:
+        集合信息字典，见 _get_loaded_milvus_collection
+    """
+    manager = get_milvus_connection_manager()
+    with manager.call() as ctx:
+        collection = Collection(collection_name, using=ctx.alias, timeout=ctx.timeout)
+        collection.load(timeout=MILVUS_CONFIG["index_timeout"])
+
+        index_type, index_params, metric_type = "FLAT", {}, "COSINE"
+        if collection.indexes:
+            params = collection.indexes[0].params
+            index_type = params.get("index_type", index_type)
+            metric_type = params.get("metric_type", metric_type)
+            index_params = params.get("params", {})
+            if isinstance(index_params, str):
+                index_params = json.loads(index_params)
+
+        # 嵌入配置在每条记录中都有，取一条即可
+        sample = collection.query(
+            expr="chunk_id >= 0",
+            limit=1,
+            output_fields=["embedding_provider", "embedding_model"],
+            timeout=ctx.timeout
+        )
+    vector_field = next(field for field in collection.schema.fields if field.name == "vector")
+    use_float16 = vector_field.dtype == DataType.FLOAT16_VECTOR
+    # 之前创建的集合没有 source_file / row 字段
+    schema_fields = {field.name for field in collection.schema.fields}
+
+    handle = {
+        "collection": collection,
+        "index_type": index_type,
+        "index_params": index_params,
+        "metric_type": metric_type,
+        # 调优过的集合使用保存的检索参数
+        "search_params": get_index_tuning_store().search_params(collection_name, index_type),
+        "embedding_provider": sample[0].get("embedding_provider") if sample else None,
+        "embedding_model": sample[0].get("embedding_model") if sample else None,
+        "encode": (lambda vector: np.asarray(vector, dtype=np.float16)) if use_float16 else (lambda vector: list(vector)),
+        "output_fields": [field for field in _MILVUS_OUTPUT_FIELDS if field in schema_fields]
+    }
+    logger.info(f"Loaded Milvus collection {collection_name} ({index_type}, {metric_type}) for search")
+    return handle
+
+def forget_milvus_collection(collection_name: str):
+    """
+    从已加载集合缓存中移除集合（删除集合前调用）
+
+    参数:
+        collection_name: 集合名称
+    """
+    with _milvus_search_lock:
+        _loaded_milvus_collections.pop(collection_name, None)
+        _milvus_generations[collection_name] = _milvus_generations.get(collection_name, 0) + 1
+
+def _milvus_search_params(handle: Dict[str, Any], limit: int) -> Dict[str, Any]:
+    """
+    根据集合的索引类型生成检索参数，调优过的集合优先使用调优结果
+
+    参数:
+        handle: _get_loaded_milvus_collection 返回的集合信息
+        limit: 本次检索返回的结果数
+
+    返回:
+        Milvus 检索参数字典
+    """
+    index_types = {value: key for key, value in MILVUS_CONFIG["index_types"].items()}
+    index_mode = index_types.get(handle["index_type"], "flat")
+    params = dict(handle.get("search_params") or MILVUS_CONFIG["search_params"].get(index_mode, {}))
+    if "nprobe" in params and "nlist" in handle["index_params"]:
+        params["nprobe"] = min(params["nprobe"], int(handle["index_params"]["nlist"]))
+    if "ef" in params:
+        # HNSW 要求 ef 不小于返回结果数
+        params["ef"] = max(params["ef"], limit)
+    return params
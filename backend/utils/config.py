@@ -1,3 +1,4 @@
+import os
 from enum import Enum
 from typing import Dict, Any
 
@@ -27,5 +28,209 @@ MILVUS_CONFIG = {
             "M": 16,
             "efConstruction": 500
         }
+    },
+    # 单次调用的默认超时（秒），写入和建索引使用单独的超时
+    "timeout": 10,
+    "index_timeout": 600,
+    # 共享连接的健康检查间隔（秒）
+    "health_check_interval": 30,
+    # 检索参数：IVF 类索引对应 nprobe，HNSW 对应 ef（检索时 ef 至少取 top_k）
+    "search_params": {
+        "flat": {},
+        "ivf_flat": {"nprobe": 16},
+        "ivf_sq8": {"nprobe": 16},
+        "hnsw": {"ef": 64}
     }
-} 
\ No newline at end of file
+}
+
+# Milvus 写入配置：按列分批写入，每批的记录数以及是否每批写入后立即 flush
+MILVUS_INSERT_CONFIG = {
+    "batch_size": 1000,
+    "flush_every_batch": True
+}
+
+# 嵌入向量缓存配置（按 provider + model + 规范化文本哈希进行内容寻址）
+EMBEDDING_CACHE_CONFIG = {
+    "enabled": True,
+    "path": os.path.join("02-embedded-docs", ".cache", "embedding_cache.db"),
+    "max_entries": 200000
+}
+
+# 本地嵌入模型的多进程执行配置（默认关闭）
+# workers 为 None 时使用 CPU 核心数；torch_threads_per_worker 为 None 时按 CPU 核心数 / workers 分配
+EMBEDDING_PROCESS_POOL_CONFIG = {
+    "enabled": os.getenv("EMBEDDING_PROCESS_POOL_ENABLED", "false").lower() == "true",
+    "providers": ["huggingface"],
+    "workers": int(os.getenv("EMBEDDING_PROCESS_POOL_WORKERS", "0")) or None,
+    "torch_threads_per_worker": int(os.getenv("EMBEDDING_TORCH_THREADS_PER_WORKER", "0")) or None
+}
+
+# 嵌入结果清单配置：记录每个嵌入结果的文件名、模型、维度等信息，按文件名查询时不再扫描目录
+EMBEDDING_MANIFEST_CONFIG = {
+    "path": os.path.join("02-embedded-docs", ".cache", "manifest.db"),
+    "embedded_docs_dir": "02-embedded-docs"
+}
+
+# 查询向量内存缓存配置（TTL + LRU），检索时重复的查询不再调用嵌入模型
+QUERY_EMBEDDING_CACHE_CONFIG = {
+    "enabled": True,
+    "max_entries": 10000,
+    "ttl_seconds": 3600
+}
+
+# 嵌入模型注册表配置：常驻内存的模型总预算（MB）与启动预热列表
+# 预热列表也可通过环境变量 EMBEDDING_WARMUP_MODELS 指定，格式为 "provider:model_name,provider:model_name"
+EMBEDDING_MODEL_REGISTRY_CONFIG = {
+    "memory_budget_mb": int(os.getenv("EMBEDDING_MODEL_MEMORY_BUDGET_MB", "4096")),
+    "warmup_models": [
+        # {"provider": "huggingface", "model_name": "BAAI/bge-base-zh-v1.5"}
+    ]
+}
+
+# 嵌入批处理配置
+# batch_sizes: 各提供商单批最多文本数
+# adaptive: 是否按文本长度自适应拆分批次（按长度排序后，单批 "文本数 x 最长文本字符数" 不超过 max_batch_chars）
+EMBEDDING_BATCH_CONFIG = {
+    "batch_sizes": {
+        "openai": 20,
+        "bedrock": 20,
+        "huggingface": 32
+    },
+    "default_batch_size": 20,
+    "adaptive": True,
+    "max_batch_chars": 64000
+}
+
+# 嵌入结果文件格式："npy" 为 float32 二进制矩阵 + JSON 元数据，"json" 为旧的内联 JSON 格式
+# quantization: None（float32）、"float16" 或 "int8"，仅对 npy 格式生效
+# keep_full_precision: 量化时是否额外保留全精度向量（.f32.npy）用于检索时对候选重排序，
+#     保留后磁盘占用高于量化前；未保留时 rescore 跳过重排序。/embed 请求可以单独指定
+# recall_sample_size: 量化后测量 recall@10 时抽样的查询数
+EMBEDDING_ARTIFACT_CONFIG = {
+    "format": "npy",
+    "quantization": None,
+    "keep_full_precision": False,
+    "recall_sample_size": 200
+}
+
+# 远程嵌入提供商的并发与限流配置
+# max_in_flight: 同时在途的批次请求数
+# requests_per_minute / tokens_per_minute: 提供商限额（令牌数按字符估算）
+# one_request_per_text: 该提供商的 embed_documents 是否对每条文本单独发起请求（Bedrock）
+REMOTE_EMBEDDING_CONFIG = {
+    "openai": {
+        "max_in_flight": 4,
+        "requests_per_minute": 3000,
+        "tokens_per_minute": 1000000,
+        "one_request_per_text": False
+    },
+    "bedrock": {
+        "max_in_flight": 4,
+        "requests_per_minute": 600,
+        "tokens_per_minute": 300000,
+        "one_request_per_text": True
+    },
+    "max_retries": 6,
+    "backoff_base_seconds": 1.0,
+    "backoff_max_seconds": 60.0
+}
+
+# 流式嵌入任务配置：每个批次（检查点）包含的块数和任务目录
+EMBEDDING_STREAM_CONFIG = {
+    "chunks_per_batch": 64,
+    "jobs_dir": os.path.join("02-embedded-docs", ".jobs")
+}
+
+# 进程内精确向量检索（FAISS 槽位）的集合保存目录
+LOCAL_VECTOR_STORE_CONFIG = {
+    "path": os.path.join("03-vector-store", "local")
+}
+
+# 检索重排序配置：开启 rescore 时先取 top_k * candidate_factor 个候选，再用全精度向量重新打分
+RESCORE_CONFIG = {
+    "candidate_factor": 4
+}
+
+# 索引前的近重复文本块检测（MinHash + LSH）默认参数；path 保存增量更新集合中已索引文本块的签名
+NEAR_DUPLICATE_CONFIG = {
+    "path": os.path.join("03-vector-store", "near_duplicate"),
+    "threshold": 0.9,
+    "num_perm": 128,
+    "shingle_size": 5
+}
+
+# 检索评估流水线配置：每批嵌入/检索的查询数和同时在途的批次数上限
+EVALUATION_CONFIG = {
+    "batch_size": 64,
+    "max_concurrency": 4
+}
+
+# 检索基准测试配置：默认测试的 provider:index_mode 组合、抽样查询数、预热查询数和结果目录
+BENCHMARK_CONFIG = {
+    "targets": ["milvus:flat", "milvus:ivf_flat", "milvus:ivf_sq8", "milvus:hnsw", "chroma:hnsw", "faiss:flat"],
+    "top_k": 10,
+    "sample_queries": 200,
+    "warmup_queries": 5,
+    "output_dir": "07-benchmark-results",
+    "work_dir": os.path.join("07-benchmark-results", ".work")
+}
+
+# ANN 索引参数自动调优配置
+# 未调优的新集合按数据量推导 nlist（nlist_per_sqrt_n * sqrt(n)）；调优时在 nlist/nprobe 或 M/ef 空间中
+# 寻找满足目标 recall@k 且平均延迟最低的参数，结果按集合保存在 path 中
+INDEX_TUNING_CONFIG = {
+    "path": os.path.join("03-vector-store", "index_tuning.json"),
+    "work_dir": os.path.join("03-vector-store", ".tuning"),
+    "target_recall": 0.95,
+    "top_k": 10,
+    "sample_queries": 200,
+    "nlist_per_sqrt_n": 4,
+    "nlist_factors": [0.5, 1, 2, 4],
+    "hnsw_m": [8, 16, 32],
+    "hnsw_ef_construction": 200,
+    "ef_candidates": [16, 32, 64, 128, 256, 512]
+}
+
+# BM25 稀疏索引配置：索引时从文本块内容构建，按集合保存在 path 下
+BM25_CONFIG = {
+    "enabled": True,
+    "path": os.path.join("03-vector-store", "bm25"),
+    "k1": 1.2,
+    "b": 0.75
+}
+
+# 混合检索配置：稠密和稀疏两路各取 top_k * candidate_factor 个候选，按加权的倒数排名融合（RRF）
+HYBRID_SEARCH_CONFIG = {
+    "candidate_factor": 3,
+    "rrf_k": 60,
+    "dense_weight": 1.0,
+    "sparse_weight": 1.0
+}
+
+# 交叉编码器重排序配置：模型在 CPU 上加载一次并在请求之间共享
+# 检索时先取 candidates 个候选（不超过 max_candidates，保证重排序延迟有上限），一次批量打分后取 top_k
+RERANK_CONFIG = {
+    "model": os.getenv("RERANK_MODEL", "BAAI/bge-reranker-base"),
+    "candidates": 20,
+    "max_candidates": 50,
+    "batch_size": 32,
+    "max_length": 512,
+    "cache_max_entries": 50000
+}
+
+# 检索结果缓存：以规范化后的请求参数和集合版本号为键，集合被索引、增量更新或删除时版本号递增
+SEARCH_RESULT_CACHE_CONFIG = {
+    "enabled": True,
+    "max_entries": 1000
+}
+
+# 语义缓存：按集合缓存查询向量 -> 检索结果和生成的回答，新查询与缓存查询的余弦相似度不低于阈值时直接返回
+# search_default: /search 未指定 semantic_cache 时是否使用语义缓存。默认关闭，由调用方按请求开启
+# （sparse / hybrid 检索始终不使用）；/generate 同样需要在请求中指定 semantic_cache 才会使用
+SEMANTIC_CACHE_CONFIG = {
+    "enabled": True,
+    "search_default": False,
+    "similarity_threshold": 0.95,
+    "max_entries": 2000,
+    "ttl_seconds": 3600
+}